@@ -8,34 +8,52 @@
 
     - Loads the preamp module
     - Processing commands entry point: do()
+    - Publishes the preamp state, aux info and loudness monitor values
+      for subscribed clients (see share/pubsub.py)
+    - Emits typed 'events' for level, loudness and lu_offset changes
+    - Commands latency metrics (see share/metrics.py)
 
 """
 
 import os
 import sys
+from   time import time
 
 UHOME       = os.path.expanduser('~')
 MAINFOLDER  = f'{UHOME}/pAudio'
 sys.path.append(f'{MAINFOLDER}/code/share')
 
 from common   import *
+import pubsub
+import metrics
+from cmdlog   import CommandLog
 from services import preamp
 from services import aux
 from services import players
 
 
-# COMMAND LOG FILE
+# COMMAND LOG FILE (written in background, see share/cmdlog.py)
 LOGFNAME = f'{LOGFOLDER}/paudio_cmd.log'
-
-if os.path.exists(LOGFNAME) and os.path.getsize(LOGFNAME) > 10e6:
-    print ( f"{Fmt.RED}(paudio_) log file exceeds ~ 10 MB '{LOGFNAME}'{Fmt.END}" )
+CMDLOG   = CommandLog(LOGFNAME, CONFIG.get('command_log'))
 
 print ( f"{Fmt.BLUE}(paudio) logging commands in '{LOGFNAME}'{Fmt.END}" )
 
+# State keys and the type of the event emitted when they change
+LEVEL_EVENTS = {    'level':            'level',
+                    'lu_offset':        'lu_offset',
+                    'equal_loudness':   'loudness'  }
+
+# Events sequence number, so that subscribers can detect lost events
+EVENT_SEQ = 0
+
 
 def _init():
     run_drcfir2png()
 
+    pubsub.publish('state', preamp.state)
+    pubsub.watch_file('aux_info',           AUXINFO_PATH)
+    pubsub.watch_file('loudness_monitor',   LDMON_PATH)
+
 
 def run_drcfir2png():
     """ Prepare DRC FIR graphs
@@ -44,15 +62,85 @@ def run_drcfir2png():
     sp.Popen(cmd, shell=True)
 
 
+def emit_level_events(before, relative):
+    """ Emits an event for each changed level setting, e.g.:
+
+            {'type': 'level', 'value': -19.0, 'delta': 1.0,
+             'relative': True, 'seq': 123}
+
+        (relative: it was ordered as a relative change)
+    """
+    global EVENT_SEQ
+
+    for key, etype in LEVEL_EVENTS.items():
+
+        value = preamp.state[key]
+
+        if value == before[key]:
+            continue
+
+        EVENT_SEQ += 1
+
+        event = {'type': etype, 'value': value, 'relative': relative,
+                 'seq': EVENT_SEQ}
+
+        if key == 'level':
+            event["delta"] = round(value - before[key], 2)
+
+        pubsub.emit('events', event)
+
+
+def is_read_only(cmd_phrase):
+    """ Commands that can be attended concurrently when running
+        under an asyncio `server.py`
+        (bool)
+    """
+    prefix, cmd, args, _ = read_cmd_phrase(cmd_phrase)
+
+    if cmd == 'state' or cmd.startswith('get_'):
+        return True
+
+    if prefix == 'aux' and cmd in ('info', 'hello', 'echo'):
+        return True
+
+    # 'metrics reset' clears the histograms
+    if prefix == 'aux' and cmd == 'metrics' and args in ('', 'report', 'prometheus'):
+        return True
+
+    return False
+
+
 def do(cmd_phrase):
 
+    t0 = time()
+
     prefix, cmd, args, add = read_cmd_phrase(cmd_phrase)
+    read_only = is_read_only(cmd_phrase)
+
+    # Latency metrics and the log are accounted by command name
+    label = cmd if prefix == 'preamp' else f'{prefix} {cmd}'
+
+    with metrics.command(label), metrics.span('paudio.do'):
+
+        result = _do(prefix, cmd, args, add, read_only)
+
+        CMDLOG.log( label, f'{args} add' if add else args, result,
+                    (time() - t0) * 1000, read_only )
+
+    return result
+
+
+def _do(prefix, cmd, args, add, read_only):
+
     result    = ''
 
     match prefix:
 
         case 'preamp':
+            before = {k: preamp.state[k] for k in LEVEL_EVENTS}
             result = preamp.do(cmd, args, add)
+            if not read_only:
+                emit_level_events(before, relative=add)
 
         case 'aux':
             result = aux.do(cmd, args, add)
@@ -65,10 +153,10 @@ def do(cmd_phrase):
             # This should never occur because preamp is the defaulted as prefix
             result = 'unknown service'
 
-    logline = f'{strftime("%Y/%m/%d %H:%M:%S")}; {cmd_phrase}; {result}'
-
-    with open(LOGFNAME, 'a') as FLOG:
-            FLOG.write(f'{logline}\n')
+    # Only changes will be notified to subscribers
+    if not read_only:
+        with metrics.span('publish'):
+            pubsub.publish('state', preamp.state)
 
     if type(result) != str:
         try:
@@ -11,18 +11,18 @@
 from    subprocess  import Popen
 import  os
 import  sys
+from    time        import time
 
 UHOME = os.path.expanduser("~")
 sys.path.append(f'{UHOME}/pAudio/code/share')
 
 from common import *
+from cmdlog import CommandLog
 
 
-# COMMAND LOG FILE
+# COMMAND LOG FILE (written in background, see share/cmdlog.py)
 LOGFNAME = f'{LOGFOLDER}/paudio_ctrl.log'
-
-if os.path.exists(LOGFNAME) and os.path.getsize(LOGFNAME) > 10e6:
-    print ( f"{Fmt.RED}(paudio_ctrl) log file exceeds ~ 10 MB '{LOGFNAME}'{Fmt.END}" )
+CMDLOG   = CommandLog(LOGFNAME, CONFIG.get('command_log'))
 
 print ( f"{Fmt.BLUE}(paudio_ctrl) logging commands in '{LOGFNAME}'{Fmt.END}" )
 
@@ -52,6 +52,8 @@ def manage_onoff(mode):
 # Interface function for this module
 def do( cmdphrase):
 
+    t0 = time()
+
     result = 'bad command'
 
     try:
@@ -69,10 +71,9 @@ def do( cmdphrase):
             result = manage_onoff( arg )
 
 
-    logline = f'{strftime("%Y/%m/%d %H:%M:%S")}; {cmd}; {result}'
+    read_only = cmd == 'amp_switch' and arg == 'state'
 
-    with open(LOGFNAME, 'a') as FLOG:
-            FLOG.write(f'{logline}\n')
+    CMDLOG.log( cmd, arg, result, (time() - t0) * 1000, read_only )
 
     if type(result) != str:
         result = json.dumps(result)
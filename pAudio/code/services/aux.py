@@ -16,6 +16,12 @@ MAINFOLDER  = f'{UHOME}/pAudio'
 sys.path.append(f'{MAINFOLDER}/code/share')
 
 from common import *
+import metrics
+
+
+# AUXINFO is updated from the 'info' command and from the preamp EQ graph
+# renderer thread, so it is kept in memory and changed under this lock.
+AUXINFO_LOCK = threading.Lock()
 
 
 def init():
@@ -26,13 +32,24 @@ def init():
     global AUXINFO
 
 
-    AUXINFO = {
-        "amp":              "on",
-        "loudness_monitor": read_json_file(LDMON_PATH),
-        "last_macro":       "",
-        "warning":          "",
-        "new_eq_graph":     False
-    }
+    ldmon = read_json_file(LDMON_PATH)
+
+    with AUXINFO_LOCK:
+        AUXINFO = {
+            "amp":              "on",
+            "loudness_monitor": ldmon,
+            "last_macro":       "",
+            "warning":          "",
+            "eq_graph_version": 0
+        }
+    save_aux_info()
+
+
+def set_eq_graph_version(version):
+    """ Issued by the preamp EQ graph renderer when a new PNG is dumped
+    """
+    with AUXINFO_LOCK:
+        AUXINFO["eq_graph_version"] = version
     save_aux_info()
 
 
@@ -88,7 +105,9 @@ def zita_j2n(args):
 def save_aux_info():
     """ this must be threaded """
     def dosave():
-        save_json_file(AUXINFO, AUXINFO_PATH)
+        # the latest in memory values, even if saves are done out of order
+        with AUXINFO_LOCK:
+            save_json_file(AUXINFO, AUXINFO_PATH)
     job = threading.Thread(target=dosave,)
     job.start()
 
@@ -131,9 +150,11 @@ def do(cmd, args, add):
             result = read_json_file(LDMON_PATH)
 
         case 'info':
-            AUXINFO["loudness_monitor"] = read_json_file(LDMON_PATH)
+            ldmon = read_json_file(LDMON_PATH)
+            with AUXINFO_LOCK:
+                AUXINFO["loudness_monitor"] = ldmon
+                result = dict(AUXINFO)
             save_aux_info()
-            result = AUXINFO
 
         case 'reset_loudness_monitor' | 'reset_lu_monitor':
             result = manage_lu_monitor('reset')
@@ -145,6 +166,19 @@ def do(cmd, args, add):
         case 'zita_j2n':
             result = zita_j2n(args)
 
+        # Commands latency histograms, see share/metrics.py.
+        # The Prometheus text is given as a JSON string to keep
+        # the answer in a single line.
+        case 'metrics':
+            match args:
+                case 'prometheus':
+                    result = json.dumps( metrics.prometheus() )
+                case 'reset':
+                    metrics.reset()
+                    result = 'done'
+                case _:
+                    result = metrics.report()
+
     if type(result) != str:
         result = json.dumps(result)
 
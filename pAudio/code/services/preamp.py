@@ -21,7 +21,10 @@ sys.path.append(f'{MAINFOLDER}/code/share')
 sys.path.append(f'{MAINFOLDER}/code/services/preamp_mod')
 
 from    common      import *
-from    eqfir2png   import fir2png
+import  metrics
+import  paudio_client
+from    eqfir2png   import request_render
+from    time        import time
 
 # import Jack stuff ONLY with LINUX
 if sys.platform == 'linux' and CONFIG.get('jack'):
@@ -38,49 +41,61 @@ STATE_PATH  = f'{MAINFOLDER}/.preamp_state'
 #
 state = read_json_file(STATE_PATH)
 
+# Saving the state in background (write-behind)
+STATE_SAVER = JsonWriteBehind(state, STATE_PATH)
+
 
 # INIT
 def init():
 
-    def resume_audio():
-
-        do_levels( 'level', dB=state["level"] )
-
-        set_polarity( state["polarity"] )
+    def validate_state():
+        """ The saved state must fit the current configuration
+            before preparing the DSP with it
+        """
+        # tones can be clamped when ordered out of range
+        tmax = CONFIG["tones_span_dB"]
+        for tone in 'bass', 'treble':
+            dB = x2int( max(-tmax, min(+tmax, state[tone])) )
+            if dB != state[tone]:
+                print(f'{Fmt.BOLD}{tone} clamped to {dB}{Fmt.END}')
+            state[tone] = dB
 
-        set_solo( state["solo"] )
+        if not state["target"] in TARGET_SETS + ['none']:
+            state["target"] = 'none'
 
-        do_levels( 'balance', dB=state["balance"] )
+        if not state["drc_set"] in DRC_SETS:
+            state["drc_set"] = 'none'
 
-        set_mute( state["muted"] )
+        if not state["xo_set"] in XO_SETS:
+            state["xo_set"] = ''
 
-        # tones can be clamped when ordered out of range
-        res = do_levels( 'bass', dB=state["bass"] )
-        if res != 'done':
-            print(f'{Fmt.BOLD}{res}{Fmt.END}')
-            state["bass"] = x2int(res.split()[-1])
+        # the level is lowered if there is no headroom
+        hr = calc_headroom(state)
+        if hr < 0:
+            state["level"] = round(state["level"] + hr, 1)
+            print(f'{Fmt.BOLD}level lowered to {state["level"]} (headroom){Fmt.END}')
+            hr = 0.0
+        state["gain_headroom"] = hr
 
-        res = do_levels( 'treble', dB=state["treble"] )
-        if res != 'done':
-            print(f'{Fmt.BOLD}{res}{Fmt.END}')
-            state["treble"] = x2int(res.split()[-1])
 
-        do_levels( 'lu_offset', dB=state["lu_offset"] )
+    def resume_audio():
+        """ The initial DSP config already has the state settings,
+            only the main fader and the source are pending.
+        """
+        DSP.set_volume( state["level"] + CONFIG["ref_level_gain_offset"] )
 
-        do_levels( 'target', tID=state["target"] )
+        set_mute( state["muted"] )
 
-        set_loudness( mode=state["equal_loudness"] )
+        set_source(state["source"])
 
-        if not state["drc_set"] in DRC_SETS:
-            state["drc_set"] = 'none'
-        set_drc( state["drc_set"] )
+        eq2png()
 
-        if not state["xo_set"] in XO_SETS:
-            state["xo_set"] = ''
-        else:
-            set_xo( state["xo_set"] )
 
-        set_source(state["source"])
+    def print_timings(timings):
+        print(f'{Fmt.BLUE}(preamp) startup timing:')
+        for stage, ms in timings:
+            print(f'    {stage:32} {ms:8.1f} ms')
+        print(f'    {"TOTAL":32} {sum([ms for _, ms in timings]):8.1f} ms{Fmt.END}')
 
 
     global state, CONFIG, SOURCES, TARGET_SETS, DRC_SETS, XO_SETS
@@ -174,13 +189,14 @@ def init():
 
     state["dsp_buffer_size"]    = 0
 
+    validate_state()
 
-    # Preparing and running camillaDSP
-    run_cdsp = DSP.init_camilladsp( pAudio_config=CONFIG )
+    # Preparing and running camillaDSP, including the state settings
+    run_cdsp = DSP.init_camilladsp( pAudio_config=CONFIG, state=state )
 
     if run_cdsp == 'done':
 
-        state["dsp_buffer_size"] = DSP.CC.config.active()["devices"]["chunksize"]
+        state["dsp_buffer_size"] = DSP.get_config()["devices"]["chunksize"]
         state["dsp_buffer_ms"]   = int(round(state["dsp_buffer_size"] / state["fs"] * 1000))
 
         # Changing MacOS default playback device
@@ -190,7 +206,10 @@ def init():
             change_default_sound_device( CONFIG["coreaudio"]["devices"]["capture"]["device"] )
 
         # Resuming audio settings on the DSP
+        t0 = time()
         resume_audio()
+        print_timings( DSP.INIT_TIMINGS + [('resume audio',
+                                            round((time() - t0) * 1000, 1))] )
 
         # Saving state with user settings mods
         save_json_file(state, STATE_PATH)
@@ -204,46 +223,27 @@ def init():
 
 
 # Dumping EQ to .png file and alerting clients to let them know
+@metrics.timed('preamp.eq2png')
 def eq2png():
 
-    def alert_new_eq_graph(timeout=1):
-        """ This sets the 'new_eq_graph' field to True for a while
-            so that the web page can realize when the graph is dumped.
-            This helps on slow machines because the PNG graph takes a while
-            after the 'done' is received when issuing some audio command.
-        """
-
-        def new_eq_graph(mode):
-            aux_info = read_json_file(AUXINFO_PATH)
-            aux_info['new_eq_graph'] = mode
-            save_json_file(aux_info, AUXINFO_PATH)
-
-        def mytimer(timeout):
-            sleep(timeout)
-            new_eq_graph(False)
-
-        new_eq_graph(True)
-
-        job = threading.Thread(target=mytimer, args=(timeout,))
-        job.start()
-
+    # The web page can draw the EQ by itself, see 'get_eq_response'
+    if not CONFIG.get('eq_graph_png', True):
+        return
 
-    def do_graph(e):
-        fir2png()
-        e.set()
-
-
-    def flag_to_aux_info(e):
-        e.wait()    # waits until set flag is true
-        alert_new_eq_graph()
+    def graph_done(version):
+        """ Publish the graph version, so that the web page can realize
+            when the new PNG graph is dumped. This helps on slow machines
+            because it takes a while after the 'done' is received when
+            issuing some audio command.
+        """
+        # aux owns the .aux_info file (imported here because paudio.py
+        # loads the preamp first)
+        from services import aux
+        aux.set_eq_graph_version(version)
 
 
-    # Threading because saving the PNG file can take too long
-    e  = threading.Event()
-    j1 = threading.Thread(target=do_graph,         args=(e,))
-    j2 = threading.Thread(target=flag_to_aux_info, args=(e,))
-    j1.start()
-    j2.start()
+    # A single renderer thread, because saving the PNG file can take too long
+    request_render( *DSP.get_eq_fir(), on_done=graph_done )
 
 
 # Interface functions with the underlying modules
@@ -328,7 +328,7 @@ def set_source(sname):
                 remote_ip               = SOURCES[sname].get('ip')
                 remote_vol_daemon_port  = SOURCES[sname].get('port') + 5
 
-                send_cmd('hello', host=remote_ip, port=remote_vol_daemon_port)
+                paudio_client.send('hello', host=remote_ip, port=remote_vol_daemon_port)
 
     else:
         res = f'must be in: {SOURCES.keys()}'
@@ -336,6 +336,142 @@ def set_source(sname):
     return res
 
 
+def calc_headroom(candidate):
+    """ The gain headroom for a candidate state
+    """
+    hr = - candidate["level"]                           \
+         + candidate["lu_offset"]                       \
+         - CONFIG["ref_level_gain_offset"]              \
+         - abs(candidate["balance"]) / 2.0              \
+         - CONFIG["drcs_offset"]
+
+    if not candidate["tone_defeat"]:
+
+        if candidate["bass"] > 0:
+            hr -= candidate["bass"]
+
+        if candidate["treble"] > 0:
+            hr -= candidate["treble"]
+
+    if candidate["target"] != 'none':
+        tgain = x2float( candidate["target"][:4] )
+        if tgain > 0:
+            hr -= tgain
+
+    return round(hr, 1)
+
+
+def do_scene(scene):
+    """ Applies several settings at once, e.g.:
+
+            {"level": -20, "bass": 2, "target": "+3.0-1.0", "drc_set": "sofa"}
+
+        The headroom is checked once for the resulting state, then the DSP
+        receives a single EQ and config update.
+    """
+    aliases = { 'loudness':     'equal_loudness',
+                'drc':          'drc_set' }
+
+    allowed = ( 'level', 'balance', 'lu_offset', 'bass', 'treble',
+                'target', 'equal_loudness', 'drc_set' )
+
+    try:
+        scene = json.loads(scene)
+        scene = { aliases.get(k, k): v for k, v in scene.items() }
+    except:
+        return 'needs a json dictionary'
+
+    for k in scene:
+        if not k in allowed:
+            return f'scene settings must be in: {allowed}'
+
+    candidate = state.copy()
+    candidate.update(scene)
+
+    # Validation
+    try:
+        for k in ('level', 'balance', 'lu_offset', 'bass', 'treble'):
+            candidate[k] = x2float( candidate[k] )
+    except:
+        return 'needs float values'
+
+    clamped = ''
+    tmax = CONFIG["tones_span_dB"]
+    for k in ('bass', 'treble'):
+        if abs(candidate[k]) > tmax:
+            candidate[k] = max(-tmax, min(+tmax, candidate[k]))
+            clamped += f' {k} clamped to {candidate[k]}'
+        candidate[k] = int(round(candidate[k]))
+
+    if type(candidate["equal_loudness"]) != bool:
+        return 'equal_loudness must be true/false'
+
+    if not candidate["target"] in TARGET_SETS + ['none']:
+        return f'target must be in: {TARGET_SETS}'
+
+    if 'drc_set' in scene and not DRC_SETS:
+        return 'drc not available'
+
+    if DRC_SETS and not candidate["drc_set"] in DRC_SETS + ['none']:
+        return f'drc must be in: {DRC_SETS}'
+
+    hr = calc_headroom(candidate)
+
+    if hr < 0:
+        return 'no headroom'
+
+    # Only the changed settings are passed to the DSP
+    def changed(*keys):
+        return any( [candidate[k] != state[k] for k in keys] )
+
+    kwargs = {}
+
+    if changed('level'):
+        kwargs["volume"] = candidate["level"] + CONFIG["ref_level_gain_offset"]
+
+    if changed('level', 'equal_loudness'):
+        kwargs["loudness"] = (candidate["equal_loudness"], candidate["level"])
+
+    if not state["tone_defeat"]:
+        if changed('bass'):
+            kwargs["bass"] = candidate["bass"]
+        if changed('treble'):
+            kwargs["treble"] = candidate["treble"]
+
+    if changed('target'):
+        kwargs["target"] = candidate["target"]
+
+    if changed('balance'):
+        kwargs["balance"] = candidate["balance"]
+
+    if changed('lu_offset'):
+        kwargs["lu_offset"] = -candidate["lu_offset"]
+
+    if DRC_SETS and changed('drc_set'):
+        kwargs["drc"] = candidate["drc_set"]
+        kwargs["drc_gain"] = CONFIG["drcs_offset"] if candidate["drc_set"] == 'none' \
+                             else 0.0
+
+    result = DSP.set_scene(**kwargs)
+
+    if result == 'done':
+
+        for k in allowed:
+            state[k] = candidate[k]
+
+        state["gain_headroom"] = hr
+
+        # dumps eq to png
+        if 'bass' in kwargs or 'treble' in kwargs or \
+           'target' in kwargs or 'loudness' in kwargs:
+            eq2png()
+
+        if clamped:
+            result = f'done,{clamped}'
+
+    return result
+
+
 def do_levels(cmd, dB=0.0, tID='+0.0-0.0', tone_defeat='False', add=False):
     """ Level related commands
     """
@@ -383,7 +519,7 @@ def do_levels(cmd, dB=0.0, tID='+0.0-0.0', tone_defeat='False', add=False):
         return res
 
 
-    def calc_headroom():
+    def get_candidate():
 
         candidate = state.copy()
 
@@ -392,26 +528,7 @@ def do_levels(cmd, dB=0.0, tID='+0.0-0.0', tone_defeat='False', add=False):
         else:
             candidate[cmd] = dB
 
-        hr = - candidate["level"]                           \
-             + candidate["lu_offset"]                       \
-             - CONFIG["ref_level_gain_offset"]              \
-             - abs(candidate["balance"]) / 2.0              \
-             - CONFIG["drcs_offset"]
-
-        if not candidate["tone_defeat"]:
-
-            if candidate["bass"] > 0:
-                hr -= candidate["bass"]
-
-            if candidate["treble"] > 0:
-                hr -= candidate["treble"]
-
-        if candidate["target"] != 'none':
-            tgain = x2float( candidate["target"][:4] )
-            if tgain > 0:
-                hr -= tgain
-
-        return round(hr, 1)
+        return candidate
 
 
     # getting absolute values from relative command
@@ -425,7 +542,7 @@ def do_levels(cmd, dB=0.0, tID='+0.0-0.0', tone_defeat='False', add=False):
             dB = max(-tmax, min(+tmax, dB))
             clamped = str(dB)
 
-    hr = calc_headroom()
+    hr = calc_headroom( get_candidate() )
 
     if hr >= 0:
 
@@ -486,6 +603,7 @@ def do_levels(cmd, dB=0.0, tID='+0.0-0.0', tone_defeat='False', add=False):
 
 
 # Entry function
+@metrics.timed('preamp.do')
 def do(cmd, args, add):
 
     def normalize_cmd(cmd):
@@ -496,6 +614,7 @@ def do(cmd, args, add):
                     'set_target':   'target',
                     'drc':          'set_drc',
                     'xo':           'set_xo',
+                    'apply':        'scene',
                     'input':        'set_source',
                     'source':       'set_source',
             }[cmd]
@@ -517,6 +636,19 @@ def do(cmd, args, add):
         case 'state':
             result = json.dumps(state)
 
+        # Some state fields, e.g. 'get_state level' or 'get_state level muted'
+        case 'get_state':
+            fields = args.split()
+            try:
+                if len(fields) == 1:
+                    result = json.dumps( state[fields[0]] )
+                elif fields:
+                    result = json.dumps( {f: state[f] for f in fields} )
+                else:
+                    result = json.dumps(state)
+            except KeyError as e:
+                result = f'unknown state field {str(e)}'
+
         case 'get_sources':
             result = json.dumps( list(SOURCES.keys()) )
 
@@ -529,6 +661,18 @@ def do(cmd, args, add):
         case 'get_xo_sets':
             result = json.dumps(XO_SETS)
 
+        case 'get_eq_response':
+            # optional: number of log spaced points
+            try:
+                points = int(args) if args else 0
+            except (ValueError, TypeError):
+                points = None
+
+            if points is None or points < 0:
+                result = 'needs an integer number of points'
+            else:
+                result = json.dumps( DSP.get_eq_response(points) )
+
         case 'set_source':
             new = args
             if state["source"] != new:
@@ -657,11 +801,20 @@ def do(cmd, args, add):
         case 'get_cdsp_drc_gain':
             result = DSP.get_drc_gain()
 
+        case 'get_cdsp_apply_ms':
+            result = DSP.get_apply_ms()
+
+        case 'scene':
+            result = do_scene(args)
+
+        case 'resync_cdsp_config':
+            result = DSP.resync_config()
+
         case _:
             result = 'unknown command'
 
     if dosave:
-        save_json_file(state, STATE_PATH)
+        STATE_SAVER.touch()
 
     if type(result) != str:
         try:
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    Precomputes the EQ impulses for every reachable combination of
+    bass, treble, loudness curve index and target, so that the running
+    preamp only needs to point CamillaDSP to the proper FIR.
+
+    usage:  eq_bake.py  [-fs=48000] [-span=6] [-targets=+3.0-1.0,...|all]
+                        [-jobs=N]
+
+        -fs         sample rate (default: the configured one)
+        -span       bass and treble span in dB (default: tones_span_dB)
+        -targets    comma separated target IDs, or 'all'
+                    (default: the configured target and the flat one)
+        -jobs       parallel processes (default: number of CPUs)
+
+    The archive eq/eq_baked_<fs>.bin is a JSON header line, padded to a
+    64 bytes boundary, then float32 impulses of 'taps' length:
+
+        {   "fs":       48000,
+            "taps":     4096,
+            "bass":     [-6, ... +6],
+            "treble":   [-6, ... +6],
+            "loudness": [0, ... 120],
+            "targets":  ["+0.0-0.0", ...],
+            "sources":  {"bass_mag.dat": [size, mtime_ns], ...}
+        }
+
+    The impulse row for a (b, t, l, tID) EQ state is given by baked_row()
+"""
+
+import  os
+import  sys
+import  json
+import  time
+from    concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import  numpy as np
+
+UHOME       = os.path.expanduser('~')
+MAINFOLDER  = f'{UHOME}/pAudio'
+sys.path.append(f'{MAINFOLDER}/code/share')
+
+from common import *
+
+sys.path.append(f'{MAINFOLDER}/code/share/audiotools')
+from tools  import semispectrum2impulse
+
+from curves_store import load_store
+
+
+LOUDNESS_REF_LEVEL = 83
+
+# Worker processes curves store
+_STORE = None
+
+
+def baked_path(fs):
+    return f'{EQFOLDER}/eq_baked_{fs}.bin'
+
+
+def baked_row(index, key):
+    """ The archive row for a (b, t, l, tID) EQ state key, or None
+    """
+    b, t, l, tID = key
+
+    try:
+        ti  = index["targets"].index(tID)
+        bi  = index["bass"].index(b)
+        tri = index["treble"].index(t)
+        li  = index["loudness"].index(l)
+    except ValueError:
+        return None
+
+    nb  = len(index["bass"])
+    ntr = len(index["treble"])
+    nl  = len(index["loudness"])
+
+    return ((ti * nb + bi) * ntr + tri) * nl + li
+
+
+def read_baked_index(path):
+    """ Reads the header of a baked archive
+        (dict)
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+    index = json.loads(header)
+    index["offset"] = len(header)
+    return index
+
+
+def _render_chunk(folder, tID, b, t, loud_indexes):
+    """ (worker) impulses for all the loudness indexes of a (tID, b, t)
+    """
+    global _STORE
+
+    if _STORE is None:
+        _STORE = load_store(folder, check=False)
+
+    tones = _STORE.curves('bass')[b + 12] + _STORE.curves('treble')[t + 12]
+    base  = tones + _STORE.target(tID)
+    loud  = _STORE.curves(f'ref_{LOUDNESS_REF_LEVEL}_loudness')[loud_indexes]
+
+    # a 2D batch of spectrums at once
+    return semispectrum2impulse( (base + loud).astype('float64') ).astype('float32')
+
+
+def bake(fs, span, targets, jobs=None):
+
+    folder = f'{EQFOLDER}/curves_{fs}_N11'
+    store  = load_store(folder)
+
+    if targets == ['all']:
+        targets = store.target_ids()
+
+    for tID in targets:
+        store.target(tID)   # raises ValueError if not found
+
+    tones   = list( range(-int(span), int(span) + 1) )
+    nloud   = store.curves(f'ref_{LOUDNESS_REF_LEVEL}_loudness').shape[0]
+    loud    = list( range(nloud) )
+    taps    = 2 * (store.index["N"] - 1)
+
+    index = {   'fs':       fs,
+                'taps':     taps,
+                'bass':     tones,
+                'treble':   tones,
+                'loudness': loud,
+                'targets':  targets,
+                'sources':  store.index["sources"]
+            }
+
+    nchunks = len(targets) * len(tones) ** 2
+    nrows   = nchunks * nloud
+
+    print(f'(eq_bake) {nrows} impulses of {taps} taps, '
+          f'{round(nrows * taps * 4 / 1e6)} MB')
+
+    header = json.dumps(index).encode()
+    header += b' ' * (63 - len(header) % 64) + b'\n'
+
+    path = baked_path(fs)
+    tmp  = f'{path}.tmp'
+
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.truncate( len(header) + nrows * taps * 4 )
+
+    data = np.memmap( tmp, dtype='float32', mode='r+',
+                      offset=len(header), shape=(nrows, taps) )
+
+    tc = time.time()
+
+    todo    = [ (tID, b, t) for tID in targets for b in tones for t in tones ]
+    workers = jobs or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        # Only a few chunks in flight, each one is written as soon as it
+        # is done, so memory stays at a few loudness rows sets.
+        pending = {}
+        done    = 0
+
+        while todo or pending:
+
+            while todo and len(pending) < 2 * workers:
+                tID, b, t = todo.pop(0)
+                first = baked_row(index, (b, t, loud[0], tID))
+                job = pool.submit(_render_chunk, folder, tID, b, t, loud)
+                pending[job] = first
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for job in finished:
+                first = pending.pop(job)
+                data[first : first + nloud, :] = job.result()
+                done += 1
+
+            print(f'\r(eq_bake) {int(100 * done / nchunks)} %', end='')
+
+    data.flush()
+    del data
+    os.replace(tmp, path)
+
+    print(f'\n(eq_bake) saved `{path}` in {round(time.time() - tc, 1)} s')
+
+
+if __name__ == "__main__":
+
+    fs      = CONFIG["samplerate"]
+    span    = CONFIG["tones_span_dB"]
+    targets = list( dict.fromkeys( [CONFIG.get('target', '+0.0-0.0'),
+                                    '+0.0-0.0'] ) )
+    jobs    = None
+
+    for opc in sys.argv[1:]:
+
+        if opc.startswith('-fs='):
+            fs = int( opc.split('=')[-1] )
+
+        elif opc.startswith('-span='):
+            span = float( opc.split('=')[-1] )
+
+        elif opc.startswith('-targets='):
+            targets = opc.split('=')[-1].split(',')
+
+        elif opc.startswith('-jobs='):
+            jobs = int( opc.split('=')[-1] )
+
+        else:
+            print(__doc__)
+            sys.exit()
+
+    bake(fs, span, targets, jobs)
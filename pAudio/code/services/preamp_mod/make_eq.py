@@ -10,9 +10,21 @@
             have the 'eq' variable
 
             To save the composed eq to a FIR file, use save_eq_IR()
+
+            Synthesized impulses are kept in a LRU cache keyed by the
+            (bass, treble, loudness index, target) EQ state, optionally
+            persisted on disk as PCM blobs, see get_eq_cached_path()
+
+            After an EQ change, prerender_neighbours() lets a background
+            thread fill the cache with the neighbouring EQ states
+
+            If an eq_bake.py archive is available, the impulses are taken
+            from it, see get_eq_baked()
 """
 import  os
 import  sys
+import  threading
+from    collections import OrderedDict
 import  numpy as np
 
 UHOME       = os.path.expanduser('~')
@@ -20,10 +32,15 @@ MAINFOLDER  = f'{UHOME}/pAudio'
 sys.path.append(f'{MAINFOLDER}/code/share')
 
 from common import *
+import metrics
 
 sys.path.append(f'{MAINFOLDER}/code/share/audiotools')
 from tools  import semispectrum2impulse, savePCM32
 
+from curves_store import load_store
+
+from eq_bake import baked_path, baked_row, read_baked_index
+
 
 LOUDNESS_REF_LEVEL = 83
 
@@ -37,30 +54,308 @@ spl             = 83.0
 target          = '+0.0-0.0'
 equal_loudness  = False
 
+# The last composed eq, its EQ state key and a version counter
+eq              = None
+eq_key          = None
+eq_version      = 0
+
+# Synthesized EQ impulses LRU cache, optionally persisted on disk
+EQ_CACHE_SIZE       = CONFIG.get('eq_cache_size', 64)
+EQ_CACHE_DISK_MAX   = CONFIG.get('eq_cache_disk_max', 2000)
+if CONFIG.get('eq_cache_disk'):
+    EQ_CACHE_FOLDER = f'{EQFOLDER}/cache_{CONFIG["samplerate"]}'
+else:
+    EQ_CACHE_FOLDER = ''
+EQ_CACHE            = OrderedDict()
+EQ_CACHE_LOCK       = threading.Lock()
+# the disk blobs, least recently used first
+EQ_CACHE_BLOBS      = OrderedDict()
+
+# Background pre-rendering of neighbouring EQ states (latest wins)
+EQ_PRERENDER        = CONFIG.get('eq_prerender', True)
+PRERENDER_KEY       = None
+PRERENDER_EVENT     = threading.Event()
+PRERENDER_THREAD    = None
+
+# Precomputed impulses archive (see eq_bake.py)
+BAKED_PATH          = baked_path(CONFIG["samplerate"])
+BAKED_INDEX         = {}
+BAKED_DATA          = None
+
 
 def _init():
-    global BASS_PATH, TREB_PATH, LOUD_PATH, BASS_CURVES, TREB_CURVES, LOUD_CURVES
-    BASS_PATH     = f'{CURVES_FOLDER}/bass_mag.dat'
-    TREB_PATH     = f'{CURVES_FOLDER}/treble_mag.dat'
-    LOUD_PATH     = f'{CURVES_FOLDER}/ref_{LOUDNESS_REF_LEVEL}_loudness_mag.dat'
-    LOUD_CURVES   = np.loadtxt(LOUD_PATH)
-    BASS_CURVES   = np.loadtxt(BASS_PATH)
-    TREB_CURVES   = np.loadtxt(TREB_PATH)
+    """ Curves are read from the memory mapped binary store of CURVES_FOLDER,
+        it will be compiled from the .dat files if needed.
+    """
+    global STORE, BASS_CURVES, TREB_CURVES, LOUD_CURVES
+    STORE         = load_store(CURVES_FOLDER)
+    LOUD_CURVES   = STORE.curves(f'ref_{LOUDNESS_REF_LEVEL}_loudness')
+    BASS_CURVES   = STORE.curves('bass')
+    TREB_CURVES   = STORE.curves('treble')
+
+    if EQ_CACHE_FOLDER:
+        _prepare_cache_folder()
+
+    _load_baked()
+
+
+def _load_baked():
+    """ Maps the baked impulses archive, if any and up to date
+    """
+    global BAKED_INDEX, BAKED_DATA
+
+    if not os.path.isfile(BAKED_PATH):
+        return
+
+    try:
+        index = read_baked_index(BAKED_PATH)
+
+        if index["sources"] != STORE.index["sources"]:
+            print(f'{Fmt.BOLD}(make_eq) `{BAKED_PATH}` is outdated, '
+                  f'please run eq_bake.py again{Fmt.END}')
+            return
+
+        nrows = os.path.getsize(BAKED_PATH) - index["offset"]
+        nrows //= index["taps"] * 4
+
+        BAKED_DATA = np.memmap( BAKED_PATH, dtype='float32', mode='r',
+                                offset=index["offset"],
+                                shape=(nrows, index["taps"]) )
+        BAKED_INDEX = index
+
+    except Exception as e:
+        print(f'{Fmt.RED}(make_eq) bad `{BAKED_PATH}`: {str(e)}{Fmt.END}')
+
+
+def _prepare_cache_folder():
+    """ Makes the disk cache folder, and purges the oldest blobs
+        beyond EQ_CACHE_DISK_MAX (cache_put keeps the limit later on).
+        The blobs are wiped if the curves sources have changed since they
+        were rendered, see the sources.json manifest.
+    """
+    os.makedirs(EQ_CACHE_FOLDER, exist_ok=True)
+
+    blobs = [f'{EQ_CACHE_FOLDER}/{x}' for x in os.listdir(EQ_CACHE_FOLDER)
+                                      if x.endswith('.pcm')]
+
+    manifest = f'{EQ_CACHE_FOLDER}/sources.json'
+    sources  = STORE.index["sources"]
+
+    if not os.path.isfile(manifest) or read_json_file(manifest) != sources:
+
+        if blobs:
+            print(f'{Fmt.BOLD}(make_eq) curves have changed, wiping '
+                  f'`{EQ_CACHE_FOLDER}`{Fmt.END}')
+        for blob in blobs:
+            os.remove(blob)
+        blobs = []
 
+        save_json_file(sources, manifest)
 
+    blobs.sort(key=os.path.getmtime)
+    with EQ_CACHE_LOCK:
+        for blob in blobs:
+            EQ_CACHE_BLOBS[blob] = None
+    _trim_cache_folder()
+
+
+def _trim_cache_folder():
+    """ Removes the least recently used blobs beyond EQ_CACHE_DISK_MAX
+    """
+    with EQ_CACHE_LOCK:
+        old = []
+        while len(EQ_CACHE_BLOBS) > EQ_CACHE_DISK_MAX:
+            old.append( EQ_CACHE_BLOBS.popitem(last=False)[0] )
+
+    for blob in old:
+        try:
+            os.remove(blob)
+        except OSError:
+            pass
+
+
+def _blob_path(key):
+    b, t, l, tID = key
+    return f'{EQ_CACHE_FOLDER}/eq_b{b:+d}_t{t:+d}_l{l}_{tID}.pcm'
+
+
+def cache_get(key):
+    """ A cached impulse from memory or disk, or None
+    """
+    with EQ_CACHE_LOCK:
+        if key in EQ_CACHE:
+            EQ_CACHE.move_to_end(key)
+            return EQ_CACHE[key]
+
+    if BAKED_INDEX:
+        row = baked_row(BAKED_INDEX, key)
+        if row is not None:
+            return BAKED_DATA[row]
+
+    if EQ_CACHE_FOLDER and os.path.isfile( _blob_path(key) ):
+        blob = _blob_path(key)
+        try:
+            imp = np.fromfile( blob, dtype='float32' )
+        except OSError:
+            # just trimmed
+            return None
+        with EQ_CACHE_LOCK:
+            if blob in EQ_CACHE_BLOBS:
+                EQ_CACHE_BLOBS.move_to_end(blob)
+        cache_put(key, imp, persist=False)
+        return imp
+
+    return None
+
+
+def cache_put(key, imp, persist=True):
+    """ Stores an impulse in the LRU cache, and on disk if configured
+        (up to EQ_CACHE_DISK_MAX blobs)
+    """
+    with EQ_CACHE_LOCK:
+        EQ_CACHE[key] = imp
+        EQ_CACHE.move_to_end(key)
+        while len(EQ_CACHE) > EQ_CACHE_SIZE:
+            EQ_CACHE.popitem(last=False)
+
+    if EQ_CACHE_FOLDER and persist:
+        blob = _blob_path(key)
+        if not os.path.isfile(blob):
+            # the prerender thread could be writing the same blob
+            tmp = f'{blob}.{threading.get_ident()}.tmp'
+            savePCM32(imp, tmp)
+            os.replace(tmp, blob)
+            with EQ_CACHE_LOCK:
+                EQ_CACHE_BLOBS[blob] = None
+            _trim_cache_folder()
+
+
+def synth_impulse(key):
+    """ The impulse for an EQ state key, from the cache or
+        synthesized (and cached)
+    """
+    imp = cache_get(key)
+
+    if imp is None:
+        # magnitude --> IR
+        imp = semispectrum2impulse( compose_eq(*key), dB=True ).astype('float32')
+        cache_put(key, imp)
+
+    return imp
+
+
+@metrics.timed()
 def save_eq_IR(pcm_path=EQ_PCM_PATH, mag_is_dB=True):
     # magnitude --> IR
-    imp = semispectrum2impulse(eq, dB=mag_is_dB)
+    if mag_is_dB:
+        imp = synth_impulse(eq_key)
+    else:
+        imp = semispectrum2impulse(eq, dB=False)
     savePCM32(imp, pcm_path)
 
 
-def make_tone_curve():
+def get_eq_baked():
+    """ The baked archive location of the current eq, as
+        (path, skip_bytes, read_bytes), or None if not baked
+    """
+    if not BAKED_INDEX:
+        return None
+
+    row = baked_row(BAKED_INDEX, eq_key)
+
+    if row is None:
+        return None
+
+    nbytes = BAKED_INDEX["taps"] * 4
+
+    return BAKED_PATH, BAKED_INDEX["offset"] + row * nbytes, nbytes
+
+
+def get_eq_cached_path():
+    """ The disk cache PCM blob for the current eq, so that it can be
+        directly used with no file writing. Void if no disk cache.
+    """
+    if not EQ_CACHE_FOLDER:
+        return ''
+
+    blob = _blob_path(eq_key)
+
+    if not os.path.isfile(blob):
+        imp = synth_impulse(eq_key)
+        # the blob could have been purged from disk but not from memory
+        if not os.path.isfile(blob):
+            cache_put(eq_key, imp)
+
+    return blob
+
+
+def neighbour_keys(key):
+    """ The EQ state keys around the given one, the most likely first:
+        level +/-1, +/-2 dB (if equal loudness), then bass and treble +/-1 dB
+    """
+    b, t, l, tID = key
+
+    keys = []
+
+    if equal_loudness:
+        for step in (-1, +1, -2, +2):
+            nl = clamp_loudness_index(l + step)
+            keys.append( (b, t, nl, tID) )
+
+    for step in (-1, +1):
+        if abs(b + step) <= 12:
+            keys.append( (b + step, t, l, tID) )
+        if abs(t + step) <= 12:
+            keys.append( (b, t + step, l, tID) )
+
+    return [k for i, k in enumerate(keys) if k != key and k not in keys[:i]]
+
+
+def _prerender_loop():
+    """ Renders the neighbours of the last requested key into the cache.
+        A new request aborts the pending neighbours of the previous one.
+    """
+    while True:
+
+        PRERENDER_EVENT.wait()
+        PRERENDER_EVENT.clear()
+
+        for key in neighbour_keys(PRERENDER_KEY):
+
+            if PRERENDER_EVENT.is_set():
+                break
+
+            try:
+                synth_impulse(key)
+            except Exception as e:
+                print(f'{Fmt.RED}(make_eq) prerender {key}: {str(e)}{Fmt.END}')
+
+
+def prerender_neighbours():
+    """ Schedules the current eq neighbours to be rendered in background
+    """
+    global PRERENDER_KEY, PRERENDER_THREAD
+
+    if not EQ_PRERENDER or eq_key is None:
+        return
+
+    PRERENDER_KEY = eq_key
+
+    if PRERENDER_THREAD is None:
+        PRERENDER_THREAD = threading.Thread( target=_prerender_loop,
+                                             daemon=True )
+        PRERENDER_THREAD.start()
+
+    PRERENDER_EVENT.set()
+
+
+def make_tone_curve(b=None, t=None):
     """ Combina bass y treble
         Hay 25 curvas desde -12 hasta +12 dB, la cero es [12,:]
         Valores redondeados en saltos de 1 dB
     """
-    b = int(round(bass))
-    t = int(round(treble))
+    b = int(round(bass   if b is None else b))
+    t = int(round(treble if t is None else t))
     if abs(b) > 12 or abs(t) > 12:
         raise Exception('Tone values must be in +/- 12 dB')
     bass_idx = b + 12
@@ -71,31 +366,84 @@ def make_tone_curve():
 
 
 def get_target(targetID):
-    target_path = f'{CURVES_FOLDER}/room_target/{targetID}_target_mag.dat'
-    return np.loadtxt(target_path)
+    return STORE.target(targetID)
 
 
-def get_loudness(curve_index):
+def clamp_loudness_index(curve_index):
     max_index = LOUD_CURVES.shape[0] - 1
-    curve_index = min(max_index, max(0, curve_index))
+    return min(max_index, max(0, curve_index))
+
+
+def get_loudness(curve_index):
+    curve_index = clamp_loudness_index(curve_index)
     return LOUD_CURVES[curve_index, :]
 
 
+def get_eq_key(b=None, t=None, level_spl=None, loud=None, tID=None):
+    """ The (bass, treble, loudness index, target) EQ state key,
+        defaults to the current module variables.
+    """
+    b           = int(round(bass   if b is None else b))
+    t           = int(round(treble if t is None else t))
+    level_spl   = spl            if level_spl is None else level_spl
+    loud        = equal_loudness if loud      is None else loud
+    tID         = target         if tID       is None else tID
+
+    if loud:
+        loudness_curve_index = clamp_loudness_index( int(round(level_spl)) )
+    else:
+        loudness_curve_index = LOUDNESS_REF_LEVEL
+
+    return (b, t, loudness_curve_index, tID)
+
+
+def compose_eq(b, t, loudness_curve_index, tID):
+    """ The EQ curve (dB) for the given state
+    """
+    # (i) The stored curves are float32
+    return ( make_tone_curve(b, t)
+             + get_loudness(loudness_curve_index)
+             + get_target(tID)
+           ).astype('float64')
+
+
+@metrics.timed()
 def make_eq():
     """ Composing the EQ
     """
 
-    global eq
+    global eq, eq_key, eq_version
 
-    if equal_loudness:
-        loudness_curve_index = int(round(spl))
+    eq_key = get_eq_key()
+
+    eq = compose_eq(*eq_key)
+
+    eq_version += 1
 
+
+def get_eq_response(points=0):
+    """ The composed eq curve (dB) over the N11 frequency grid,
+        optionally decimated to log spaced points from 20 Hz to 20 KHz.
+        (dict)
+    """
+    # a consistent snapshot, make_eq() could run meanwhile
+    curve, version = eq, eq_version
+
+    if curve is None:
+        return {'version': version, 'freq': [], 'mag': []}
+
+    freq = STORE.curve('freq').astype('float64')
+
+    if points:
+        flog = np.geomspace(20, min(20000, freq[-1]), int(points))
+        idx  = np.unique( np.searchsorted(freq, flog).clip(0, len(freq) - 1) )
     else:
-        loudness_curve_index = LOUDNESS_REF_LEVEL
+        idx  = np.arange(len(freq))
 
-    eq =   make_tone_curve() \
-         + get_loudness(loudness_curve_index) \
-         + get_target(target)
+    return {    'version':  version,
+                'freq':     np.round(freq[idx], 1).tolist(),
+                'mag':      np.round(curve[idx], 2).tolist()
+           }
 
 
 _init()
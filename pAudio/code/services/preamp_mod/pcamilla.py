@@ -6,8 +6,9 @@
 import  os
 import  sys
 import  shutil
+import  copy
 import  subprocess      as      sp
-from    time            import  sleep
+from    time            import  sleep, time
 import  yaml
 import  json
 from    camilladsp      import  CamillaClient
@@ -23,6 +24,7 @@ MAINFOLDER  = f'{UHOME}/pAudio'
 sys.path.append(f'{MAINFOLDER}/code/share')
 
 from    common import *
+import  metrics
 
 if sys.platform == 'linux' and CONFIG.get('jack'):
     import  jack
@@ -33,15 +35,164 @@ HOST = '127.0.0.1'
 PORT = 1234
 CC   = CamillaClient(HOST, PORT)
 
+# An in-process shadow of the CamillaDSP active config, so that setters
+# do not need to download it. It is refreshed only on init, after uploads
+# and when ordering resync_config()
+CFG_SHADOW = {}
+
+# Uploaded configs are stamped in its `title` field with a sequence number,
+# so that we can know when CamillaDSP has applied them.
+CFG_SEQ = 0
+
+# The measured time for the last upload to be applied (milliseconds)
+LAST_APPLY_MS = 0.0
+
+# Startup stages timing [(stage, milliseconds), ...]
+INIT_TIMINGS = []
+
+
+def _wait_config_applied(stamp, timeout=0.5):
+    """ Polls CamillaDSP until the config stamped with the given title
+        is the active one and the processing is running.
+        (string)    'applied', 'timeout', or the processing state
+                    if not running (e.g. 'STALLED', 'INACTIVE'),
+                    because a config is not applied until running.
+    """
+    period = 0.005
+    tries  = int(timeout / period)
+
+    while tries:
+
+        try:
+            s = CC.general.state().name
+
+            if s in ('INACTIVE', 'STALLED'):
+                return s
+
+            # PAUSED is running, but silent input
+            if s in ('RUNNING', 'PAUSED') and CC.config.title() == stamp:
+                return 'applied'
+
+        except:
+            pass
+
+        sleep(period)
+        tries -= 1
+
+    return 'timeout'
+
+
+def _config_diff(old, new, path=()):
+    """ The paths (tuples of keys) where `new` differs from `old`.
+        Lists are compared as a whole, e.g. the pipeline steps order matters.
+    """
+    if type(old) == dict and type(new) == dict:
+
+        diffs = []
+
+        for k in list(old) + [x for x in new if x not in old]:
+
+            # The title is just our stamp, see set_config_sync()
+            if not path and k == 'title':
+                continue
+
+            if k not in old or k not in new:
+                diffs.append( path + (k,) )
+            else:
+                diffs += _config_diff(old[k], new[k], path + (k,))
+
+        return diffs
+
+    if old != new:
+        return [path]
+
+    return []
+
+
+def _is_scalar_change(diffs):
+    """ Only filter gain, inverted or mute parameters have changed
+        (bool)
+    """
+    for d in diffs:
+        if not (len(d) == 4 and d[0] == 'filters' and d[2] == 'parameters'
+                and d[3] in ('gain', 'inverted', 'mute')):
+            return False
+    return True
+
+
+def _make_patch(cfg, diffs):
+    """ A partial config having only the values at the given paths
+    """
+    patch = {}
+    for d in diffs:
+        node = patch
+        for k in d[:-1]:
+            node = node.setdefault(k, {})
+        value = cfg
+        for k in d:
+            value = value[k]
+        node[d[-1]] = value
+    return patch
+
+
 #####
 # (!) use ALWAYS set_config_sync(some_config) to upload a new one
 #####
-def set_config_sync(cfg, wait=0.1):
-    """ (i) When ordering set config some time is needed to be running
-        This is a fake sync, but just works  >:-)
+@metrics.timed()
+def set_config_sync(cfg, timeout=0.5):
+    """ (i) When ordering set config some time is needed to be running,
+        so this waits until CamillaDSP reports the new config as active
+        and running, or the timeout expires.
+
+        Uploads are skipped when nothing has changed versus the config shadow,
+        and only scalar filter parameter changes are patched if the
+        CamillaDSP client supports it, so the full config is not reloaded.
+
+        Returns the measured apply time (milliseconds)
+    """
+    global CFG_SHADOW, CFG_SEQ, LAST_APPLY_MS
+
+    diffs = _config_diff(CFG_SHADOW, cfg)
+
+    if not diffs:
+        return 0.0
+
+    CFG_SEQ += 1
+    stamp = f'pAudio #{CFG_SEQ}'
+    cfg["title"] = stamp
+
+    t0 = time()
+
+    if _is_scalar_change(diffs) and hasattr(CC.config, 'patch'):
+        patch = _make_patch(cfg, diffs)
+        patch["title"] = stamp
+        CC.config.patch(patch)
+
+    else:
+        CC.config.set_active(cfg)
+
+    CFG_SHADOW = cfg
+
+    result = _wait_config_applied(stamp, timeout)
+
+    if result == 'timeout':
+        print(f'{Fmt.RED}(pcamilla) config {stamp} not confirmed '
+              f'after {timeout} s{Fmt.END}')
+
+    LAST_APPLY_MS = round( (time() - t0) * 1000, 1 )
+
+    return LAST_APPLY_MS
+
+
+def resync_config():
+    """ Refresh the config shadow from the CamillaDSP active config
     """
-    CC.config.set_active(cfg)
-    sleep(wait)
+    global CFG_SHADOW
+    try:
+        CFG_SHADOW = CC.config.active()
+        return 'done'
+    except Exception as e:
+        return f'(pcamilla.resync_config) ERROR: {str(e)}'
 
 
 def _connect_to_camilla():
@@ -83,13 +234,18 @@ def get_state():
 
 
 def get_config():
-    return CC.config.active()
+    """ A copy of the config shadow, so it can be modified
+        then uploaded by set_config_sync()
+    """
+    return copy.deepcopy(CFG_SHADOW)
 
 
-def _prepare_cam_config(pAudio_config):
+def _prepare_cam_config(pAudio_config, state=None):
     """
         1. Prepares a base CamillaDSP config
         2. Translates pAudio configuration to the CamillaDSP config
+        3. Applies the (validated) preamp state if given, so that no
+           further uploads are needed when resuming
     """
 
     def prepare_base_config():
@@ -513,14 +669,63 @@ def _prepare_cam_config(pAudio_config):
     # Dither
     update_dither()
 
+    # Resuming the preamp state
+    if state:
+        _apply_state(cam_config, state, pAudio_config)
+
     return cam_config
 
 
-def init_camilladsp(pAudio_config):
+def _apply_state(cfg, state, pAudio_config):
+    """ The preamp state settings that belong to the CamillaDSP config
+        (the main fader volume and mute are not)
+    """
+
+    match state["solo"]:
+        case 'l' | 'L': _apply_midside(cfg, 'solo_L')
+        case 'r' | 'R': _apply_midside(cfg, 'solo_R')
+
+    _apply_polarity(cfg, state["polarity"])
+
+    _apply_balance(cfg, state["balance"])
+
+    _apply_lu_offset(cfg, -state["lu_offset"])
+
+    # The EQ
+    if state["tone_defeat"]:
+        mkeq.bass   = 0.0
+        mkeq.treble = 0.0
+    else:
+        mkeq.bass   = float(state["bass"])
+        mkeq.treble = float(state["treble"])
+
+    mkeq.target         = '+0.0-0.0' if state["target"] == 'none' \
+                          else state["target"]
+    mkeq.spl            = state["level"] + mkeq.LOUDNESS_REF_LEVEL
+    mkeq.equal_loudness = state["equal_loudness"]
+
+    _apply_eq( cfg, _render_eq() )
+
+    # DRC and its gain, see preamp.set_drc()
+    if pAudio_config.get("drc_sets"):
+
+        _apply_drc(cfg, state["drc_set"])
+
+        if state["drc_set"] == 'none':
+            _apply_drc_gain(cfg, pAudio_config["drcs_offset"])
+
+    if state.get("xo_set"):
+        _apply_xo(cfg, state["xo_set"])
+
+
+def init_camilladsp(pAudio_config, state=None):
     """ Updates camilladsp.yml with user configs,
         includes auto making the DRC yaml stuff,
         then runs the CamillaDSP process.
 
+        The initial config includes the given preamp state settings.
+        Stage timings are left in INIT_TIMINGS.
+
         returns a <string>:
 
             'done' OR 'some problem description...'
@@ -573,7 +778,7 @@ def init_camilladsp(pAudio_config):
             return [l.strip() for l in logs if 'ERROR' in l]
 
 
-        period = .5
+        period = .05
         tries = int(timeout / period)
 
         while tries:
@@ -581,10 +786,10 @@ def init_camilladsp(pAudio_config):
             s = CC.general.state()
             if str(s) == 'ProcessingState.RUNNING':
                 break
-            else:
+            elif tries % 10 == 0:
                 print(f'{Fmt.BLUE}{"." * int(tries * period)}{Fmt.END}')
 
-            sleep(.5)
+            sleep(period)
             tries -= 1
 
         if tries:
@@ -595,10 +800,19 @@ def init_camilladsp(pAudio_config):
             return False
 
 
+    def timing(stage):
+        nonlocal t0
+        INIT_TIMINGS.append( (stage, round((time() - t0) * 1000, 1)) )
+        t0 = time()
+
+
     global CC
 
+    t0 = time()
+
     # Prepare the camilladsp.yml as per the pAudio user configuration
-    cfg_init = _prepare_cam_config(pAudio_config)
+    cfg_init = _prepare_cam_config(pAudio_config, state)
+    timing('prepare config')
 
     # Dumping config
     with open(f'{LOGFOLDER}/camilladsp_init.yml', 'w') as f:
@@ -612,15 +826,16 @@ def init_camilladsp(pAudio_config):
     cdsp_cmd = f'camilladsp --wait -m -a 127.0.0.1 -p 1234 ' + \
                f'--logfile "{LOGFOLDER}/camilladsp.log"'
     p = sp.Popen( cdsp_cmd, shell=True )
-    sleep(1)
 
 
     # Early return if connection to CamillaDSP fails
+    # (it retries while the process is starting)
     if _connect_to_camilla():
         print(f'{Fmt.BLUE}Connected to CamillaDSP websocket.{Fmt.END}')
+        timing('camilladsp start and connect')
     else:
         print(f'{Fmt.BOLD}ERROR connecting to CamillaDSP websocket.{Fmt.END}')
-        return str(e)
+        return 'Unable to connect to CamillaDSP'
 
 
     # Loading configuration
@@ -630,6 +845,11 @@ def init_camilladsp(pAudio_config):
 
         if check_cdsp_running(timeout=5):
 
+            timing('config load and run')
+
+            # The initial config shadow
+            resync_config()
+
             # Check CPAL jack ports
             if pAudio_config.get('jack'):
                 if not cpal_ports_ok():
@@ -663,16 +883,31 @@ def append_item_to_pipeline(cfg, item = ''):
         cfg["pipeline"][n]['names'] = names_new
 
 
-def reload_eq():
-
-    def toggle_last_eq():
-        global LAST_EQ
-        LAST_EQ = {'A':'B', 'B':'A'}[LAST_EQ]
+def _render_eq():
+    """ Composes the EQ from the make_eq module variables, then
+        returns the FIR to be used as (path, skip_bytes, read_bytes)
+    """
 
+    global LAST_EQ
 
     mkeq.make_eq()
-    eq_path  = f'{EQFOLDER}/eq_{LAST_EQ}.pcm'
-    mkeq.save_eq_IR(eq_path)
+
+    # A baked or a disk cached impulse can be pointed directly,
+    # otherwise it is written to the A/B alternate file.
+    skip_bytes, read_bytes = 0, 0
+
+    baked = mkeq.get_eq_baked()
+
+    if baked:
+        eq_path, skip_bytes, read_bytes = baked
+
+    else:
+        eq_path = mkeq.get_eq_cached_path()
+
+    if not eq_path:
+        eq_path  = f'{EQFOLDER}/eq_{LAST_EQ}.pcm'
+        mkeq.save_eq_IR(eq_path)
+        LAST_EQ = {'A':'B', 'B':'A'}[LAST_EQ]
 
     # For convenience, it will be symlinked to eq.pcm,
     # so that a viewer could display the current curve
@@ -680,23 +915,52 @@ def reload_eq():
         os.unlink(EQ_LINK)
     os.symlink(eq_path, EQ_LINK)
 
+    return eq_path, skip_bytes, read_bytes
 
-    cfg = CC.config.active()
-    cfg["filters"]["preamp_eq"]["parameters"]["filename"] = eq_path
+
+@metrics.timed()
+def reload_eq():
+
+    cfg = get_config()
+    _apply_eq( cfg, _render_eq() )
     set_config_sync(cfg)
 
-    toggle_last_eq()
+    # Next likely EQ states (volume or tone steps) are prepared in background
+    mkeq.prerender_neighbours()
+
+
+def get_eq_fir():
+    """ The EQ FIR in use as (path, skip_bytes, read_bytes)
+    """
+    params = CFG_SHADOW["filters"]["preamp_eq"]["parameters"]
+
+    return ( params["filename"],
+             params.get("skip_bytes_lines") or 0,
+             params.get("read_bytes_lines") or 0 )
 
 
 # Getting AUDIO
 
+def get_eq_response(points=0):
+    """ The current EQ curve, see make_eq.get_eq_response()
+    """
+    return mkeq.get_eq_response(points)
+
+
 def get_drc_gain():
-    return json.dumps( CC.config.active()["filters"]["drc_gain"] )
+    return json.dumps( CFG_SHADOW["filters"]["drc_gain"] )
+
+
+def get_apply_ms():
+    """ The time spent by the last config upload to be applied
+    """
+    return LAST_APPLY_MS
 
 
 # Setting AUDIO, allways **MUST** return some string, usually 'done'
 
 # RELOAD EQ setting audio functions
+@metrics.timed()
 def set_treble(dB):
 
     result = 'done'
@@ -717,6 +981,7 @@ def set_treble(dB):
     return result
 
 
+@metrics.timed()
 def set_bass(dB):
 
     result = 'done'
@@ -737,6 +1002,7 @@ def set_bass(dB):
     return result
 
 
+@metrics.timed()
 def set_target(tID):
 
     try:
@@ -753,6 +1019,7 @@ def set_target(tID):
         return f'(pcamilla.set_target) ERROR: {str(e)}'
 
 
+@metrics.timed()
 def set_loudness(mode, level):
 
     if type(mode) != bool:
@@ -768,6 +1035,7 @@ def set_loudness(mode, level):
 
 
 # Other setting audio functions
+@metrics.timed()
 def set_volume(dB=None, mode='abs'):
     """ get or set the Main fader volume
 
@@ -787,6 +1055,7 @@ def set_volume(dB=None, mode='abs'):
     return CC.volume.volume(0)
 
 
+@metrics.timed()
 def set_mute(mode):
 
     if mode in (True, 'true', 'on', 1):
@@ -802,18 +1071,84 @@ def set_mute(mode):
     return 'done'
 
 
+# Config modifiers: they only update the given config, so that several
+# changes can be uploaded at once by set_config_sync()
+def _apply_eq(cfg, eq_fir):
+    """ eq_fir: (path, skip_bytes, read_bytes) as given by _render_eq()
+    """
+    eq_path, skip_bytes, read_bytes = eq_fir
+    cfg["filters"]["preamp_eq"]["parameters"]["filename"] = eq_path
+    cfg["filters"]["preamp_eq"]["parameters"]["skip_bytes_lines"] = skip_bytes
+    cfg["filters"]["preamp_eq"]["parameters"]["read_bytes_lines"] = read_bytes
+
+
+def _apply_midside(cfg, mode):
+    if mode == 'off':
+        mode = 'normal'
+    cfg["mixers"]["preamp_mixer"] = make_mixer_preamp(midside_mode = mode)
+
+
+def _apply_polarity(cfg, mode):
+
+    match mode:
+
+        case '++':      inv_L = False;   inv_R = False
+        case '--':      inv_L = True;    inv_R = True
+        case '+-':      inv_L = False;   inv_R = True
+        case '-+':      inv_L = True;    inv_R = False
+
+    cfg["filters"]["bal_pol_L"]["parameters"]["inverted"] = inv_L
+    cfg["filters"]["bal_pol_R"]["parameters"]["inverted"] = inv_R
+
+
+def _apply_balance(cfg, dB):
+    cfg["filters"]["bal_pol_L"]["parameters"]["gain"] = -dB / 2.0
+    cfg["filters"]["bal_pol_R"]["parameters"]["gain"] = +dB / 2.0
+
+
+def _apply_xo(cfg, xo_set):
+
+    # Update xo Filter steps
+    for step in cfg["pipeline"]:
+
+        if step["type"] == 'Filter':
+
+            names = [n for n in step["names"]]
+
+            # The xo filter is located in the 1st position
+            if 'xo.' in names[0]:
+
+                if step["names"][0][-3:] in ('.mp', '.lp'):
+
+                    step["names"][0] = step["names"][0].replace('.lp', f'.{xo_set}') \
+                                                       .replace('.mp', f'.{xo_set}')
+
+
+def _apply_drc(cfg, drcID):
+    if drcID == 'none':
+        clear_pipeline_input_filters(cfg, pattern='drc.')
+    else:
+        insert_drc_to_pipeline(cfg, drcID)
+
+
+def _apply_drc_gain(cfg, dB):
+    cfg["filters"]["drc_gain"]["parameters"]["gain"] = dB
+
+
+def _apply_lu_offset(cfg, dB):
+    cfg["filters"]["lu_offset"]["parameters"]["gain"] = dB
+
+
+@metrics.timed()
 def set_midside(mode):
 
     modes = ('off', 'mid', 'side', 'solo_L', 'solo_R')
 
     if mode in modes:
 
-        c = CC.config.active()
-
-        if mode == 'off':
-            mode = 'normal'
+        c = get_config()
 
-        c["mixers"]["preamp_mixer"] = make_mixer_preamp(midside_mode = mode)
+        _apply_midside(c, mode)
 
         set_config_sync(c)
 
@@ -823,23 +1158,23 @@ def set_midside(mode):
         return f'mode error must be in: {modes}'
 
 
+@metrics.timed()
 def set_solo(mode):
 
-    c = CC.config.active()
+    c = get_config()
 
     match mode:
-        case 'l' | 'L': m = make_mixer_preamp(midside_mode='solo_L')
-        case 'r' | 'R': m = make_mixer_preamp(midside_mode='solo_R')
-        case 'off':     m = make_mixer_preamp(midside_mode='normal')
+        case 'l' | 'L': _apply_midside(c, 'solo_L')
+        case 'r' | 'R': _apply_midside(c, 'solo_R')
+        case 'off':     _apply_midside(c, 'normal')
         case _:         return 'solo mode must be in: L | R | off'
 
-    c["mixers"]["preamp_mixer"] = m
-
     set_config_sync(c)
 
     return "done"
 
 
+@metrics.timed()
 def set_polarity(mode):
     """ Polarity applied to channels
     """
@@ -847,60 +1182,39 @@ def set_polarity(mode):
 
     modes = ('++', '--', '+-', '-+')
 
-    result = f'Polarity must be in: {modes}'
-
-    c = CC.config.active()
-
-    match mode:
+    if not mode in modes:
+        return f'Polarity must be in: {modes}'
 
-        case '++':      inv_L = False;   inv_R = False
-        case '--':      inv_L = True;    inv_R = True
-        case '+-':      inv_L = False;   inv_R = True
-        case '-+':      inv_L = True;    inv_R = False
+    c = get_config()
 
-    c["filters"]["bal_pol_L"]["parameters"]["inverted"] = inv_L
-    c["filters"]["bal_pol_R"]["parameters"]["inverted"] = inv_R
+    _apply_polarity(c, mode)
 
     set_config_sync(c)
 
     return "done"
 
 
+@metrics.timed()
 def set_balance(dB):
     """ negative dBs means towards Left, positive to Right
     """
-    c = CC.config.active()
-    c["filters"]["bal_pol_L"]["parameters"]["gain"] = -dB / 2.0
-    c["filters"]["bal_pol_R"]["parameters"]["gain"] = +dB / 2.0
+    c = get_config()
+
+    _apply_balance(c, dB)
 
     set_config_sync(c)
 
     return "done"
 
 
+@metrics.timed()
 def set_xo(xo_set):
     """ xo_set:     mp | lp
     """
 
-    cfg = CC.config.active()
-
-    # Pipeline outputs
-    ppln = cfg["pipeline"]
-
-    # Update xo Filter steps
-    for step in ppln:
-
-        if step["type"] == 'Filter':
-
-            names = [n for n in step["names"]]
+    cfg = get_config()
 
-            # The xo filter is located in the 1st position
-            if 'xo.' in names[0]:
-
-                if step["names"][0][-3:] in ('.mp', '.lp'):
-
-                    step["names"][0] = step["names"][0].replace('.lp', f'.{xo_set}') \
-                                                       .replace('.mp', f'.{xo_set}')
+    _apply_xo(cfg, xo_set)
 
     try:
         set_config_sync(cfg)
@@ -912,62 +1226,114 @@ def set_xo(xo_set):
     return result
 
 
+@metrics.timed()
 def set_drc(drcID):
 
     result = ''
 
-    cfg = CC.config.active()
-
-    if drcID == 'none':
-        try:
-            clear_pipeline_input_filters(cfg, pattern='drc.')
-            set_config_sync(cfg)
-            result = 'done'
-
-        except Exception as e:
-            result = f'(pcamilla.set_drc: `none`) ERROR: {str(e)}'
+    cfg = get_config()
 
-    else:
-        try:
-            insert_drc_to_pipeline(cfg, drcID)
-            set_config_sync(cfg)
-            result = 'done'
+    try:
+        _apply_drc(cfg, drcID)
+        set_config_sync(cfg)
+        result = 'done'
 
-        except Exception as e:
-            result = f'(pcamilla.set_drc: `{drcID}`) ERROR: {str(e)}'
+    except Exception as e:
+        result = f'(pcamilla.set_drc: `{drcID}`) ERROR: {str(e)}'
 
     return result
 
 
+@metrics.timed()
 def set_drc_gain(dB):
 
-    cfg = CC.config.active()
+    cfg = get_config()
 
-    cfg["filters"]["drc_gain"]["parameters"]["gain"] = dB
+    _apply_drc_gain(cfg, dB)
 
     set_config_sync(cfg)
 
     return 'done'
 
 
+@metrics.timed()
 def set_lu_offset(dB):
 
-    cfg = CC.config.active()
+    cfg = get_config()
 
-    cfg["filters"]["lu_offset"]["parameters"]["gain"] = dB
+    _apply_lu_offset(cfg, dB)
 
     set_config_sync(cfg)
 
     return 'done'
 
 
-    cfg = CC.config.active()
+@metrics.timed()
+def set_scene(volume=None, bass=None, treble=None, target=None,
+              loudness=None, balance=None, lu_offset=None,
+              drc=None, drc_gain=None):
+    """ Several settings at once, with a single EQ synthesis
+        and a single config upload.
 
-    cfg["filters"]["lu_offset"]["parameters"]["gain"] = dB
+        Omitted (None) settings are not modified.
 
-    set_config_sync(cfg)
+        loudness: (mode, level) as per set_loudness()
+    """
 
-    return 'done'
+    cfg = get_config()
+
+    try:
+
+        # EQ
+        eq_changed = False
+
+        if bass is not None:
+            mkeq.bass = float( max(-12, min(+12, int(round(bass)))) )
+            eq_changed = True
+
+        if treble is not None:
+            mkeq.treble = float( max(-12, min(+12, int(round(treble)))) )
+            eq_changed = True
+
+        if target is not None:
+            mkeq.target = '+0.0-0.0' if target == 'none' else target
+            eq_changed = True
+
+        if loudness is not None:
+            mode, level         = loudness
+            mkeq.spl            = level + mkeq.LOUDNESS_REF_LEVEL
+            mkeq.equal_loudness = mode
+            eq_changed = True
+
+        if eq_changed:
+            _apply_eq( cfg, _render_eq() )
+
+        # Gains and pipeline
+        if balance is not None:
+            _apply_balance(cfg, balance)
+
+        if lu_offset is not None:
+            _apply_lu_offset(cfg, lu_offset)
+
+        if drc is not None:
+            _apply_drc(cfg, drc)
+
+        if drc_gain is not None:
+            _apply_drc_gain(cfg, drc_gain)
+
+        set_config_sync(cfg)
+
+        # The main fader is not part of the config
+        if volume is not None and volume <= 0:
+            CC.volume.set_volume(0, volume)
+
+        if eq_changed:
+            mkeq.prerender_neighbours()
+
+        return 'done'
+
+    except Exception as e:
+        return f'(pcamilla.set_scene) ERROR: {str(e)}'
 
 
 _prepare_eq_conv_pcms()
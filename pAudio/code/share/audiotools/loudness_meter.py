@@ -17,8 +17,8 @@
 # along with 'pe.audio.sys'.  If not, see <https://www.gnu.org/licenses/>.
 
 """
-    Measures EBU R128 [M]omentary & [I]ntegrated loudness of
-    an audio stream from a system sound device.
+    Measures EBU R128 [M]omentary, [S]hort-term & [I]ntegrated loudness
+    of an audio stream from a system sound device.
 
     To view suported devices use '-l' option
 
@@ -27,11 +27,11 @@ import sys
 import os
 import argparse
 import numpy as np
-from scipy.signal import lfilter, lfilter_zi
+from scipy.signal import sosfilt
 import queue
 import threading
-# Thanks to https://python-sounddevice.readthedocs.io
-import sounddevice as sd
+# (i) sounddevice is imported when capturing audio, so the filtering and
+#     gating functions can be used without a sound device.
 
 
 def biquad(fs, f0, Q, ftype, dBgain=0.0):
@@ -122,8 +122,191 @@ def biquad(fs, f0, Q, ftype, dBgain=0.0):
     return b, a
 
 
+class BlocksRing(object):
+    """
+        A ring buffer of the last 100 ms blocks energies (sum of squares)
+        for each channel, enough for the 3 s short-term loudness, so no
+        samples are kept.
+
+        .add(energy)        Stores the energies of a block
+
+        .loudness(nblocks)  Stereo loudness of the last nblocks blocks.
+                            While the window is still filling, it is
+                            the loudness of the blocks received so far.
+    """
+
+    def __init__(self, bs, size=30):
+        self.bs       = bs
+        self.energies = np.zeros( (size, 2) )
+        self.pos      = 0
+        self.filled   = 0
+
+
+    def add(self, energy):
+        self.energies[self.pos] = energy
+        self.pos    = (self.pos + 1) % len(self.energies)
+        self.filled = min(self.filled + 1, len(self.energies))
+
+
+    def loudness(self, nblocks):
+
+        n = min(nblocks, self.filled)
+        if not n:
+            return -100.0
+
+        idx = np.arange(self.pos - n, self.pos) % len(self.energies)
+        msq = np.sum( self.energies[idx], axis=0 ) / (self.bs * n)
+
+        # Stereo loudness (divided by 2 channels)
+        if msq[0] or msq[1]:    # avoid log10(0)
+            return -0.691 + 20 * np.log10(msq[0] + msq[1]) / 2
+        else:
+            return -100.0
+
+
+class LoudnessHistogram(object):
+    """
+        Loudness values counted in fixed 0.02 LU bins from -70 to +5 LUFS,
+        so the gated measurements take O(bins) time and constant memory
+        no matter how long the program runs.
+
+        The energy of the values is accumulated for each bin, so the
+        gated means are exact but for the bin where the relative gate
+        falls, it is weighted by its part above the gate. Percentiles
+        are interpolated between the closest ranks, each rank valued as
+        the mean loudness of its bin. The results are within half a bin
+        of the direct computation for programs with a smooth loudness,
+        a rank can be missed if values are just at the gate.
+
+        .add(L)             Counts a loudness value (the absolute gate
+                            -70 LUFS is applied here)
+
+        .integrated()       EBU R128 gated (I)ntegrated loudness from
+                            the 400 ms blocks values (-10 LU relative gate)
+
+        .loudness_range()   EBU Tech 3342 (LRA) from the short-term
+                            values (-20 LU relative gate, 10% to 95%)
+    """
+
+    LOW     = -70.0
+    HIGH    =   5.0
+    STEP    =   0.02
+
+
+    def __init__(self):
+        nbins       = int( round( (self.HIGH - self.LOW) / self.STEP ) )
+        self.counts = np.zeros(nbins, dtype='int64')
+        self.energy = np.zeros(nbins)
+
+
+    def reset(self):
+        self.counts[:] = 0
+        self.energy[:] = 0.0
+
+
+    def add(self, L):
+
+        if L <= self.LOW:
+            return
+
+        i = min( int( (L - self.LOW) / self.STEP ), len(self.counts) - 1 )
+
+        self.counts[i] += 1
+        self.energy[i] += 10 ** ( (L + 0.691) / 10 )
+
+
+    def _gated(self, relative_gate):
+        """ The bins above the relative gate, the bin where the gate
+            falls is weighted by its part above the gate.
+            (counts, energies) from the gate bin, or None if nothing
+            was counted
+        """
+        total = self.counts.sum()
+        if not total:
+            return None
+
+        gate = -0.691 + 10 * np.log10( self.energy.sum() / total ) \
+               + relative_gate
+
+        pos    = max( 0.0, (gate - self.LOW) / self.STEP )
+        first  = min( int(pos), len(self.counts) - 1 )
+
+        counts = self.counts[first:].astype('float64')
+        energy = self.energy[first:].copy()
+
+        part = 1.0 - min( 1.0, pos - first )
+        counts[0] *= part
+        energy[0] *= part
+
+        return counts, energy
+
+
+    def integrated(self):
+
+        gated = self._gated(-10.0)
+        if gated is None or not gated[0].sum():
+            return -100.0
+
+        counts, energy = gated
+
+        return -0.691 + 10 * np.log10( energy.sum() / counts.sum() )
+
+
+    def loudness_range(self):
+
+        gated = self._gated(-20.0)
+        if gated is None or not gated[0].sum():
+            return 0.0
+
+        counts, energy = gated
+
+        # the number of gated values, the gate bin by its part above the gate
+        acc = np.cumsum( np.round(counts) )
+        if not acc[-1]:
+            return 0.0
+
+        def value(rank):
+            """ the mean loudness of the bin holding a rank """
+            k = np.searchsorted(acc, rank, side='right')
+            return -0.691 + 10 * np.log10( energy[k] / counts[k] )
+
+        def percentile(p):
+            """ linear interpolation between the closest ranks """
+            r    = (acc[-1] - 1) * p
+            rank = int(r)
+            if rank + 1 >= acc[-1]:
+                return value(rank)
+            return value(rank) + (r - rank) * (value(rank + 1) - value(rank))
+
+        return percentile(0.95) - percentile(0.10)
+
+
+def k_weighting_sos(fs):
+    """ The 'K' weighting filter: 100Hz HPF + 1000Hz High Shelf +4dB,
+        as cascaded second order sections for signal.sosfilt
+    """
+    sections = []
+    for b, a in ( biquad(fs, 100,  .707, 'hpf'            ),
+                  biquad(fs, 1000, .707, 'highshelf', 4.0 ) ):
+        sections.append( np.concatenate( (b / a[0], a / a[0]) ) )
+    return np.array(sections)
+
+
+def k_block(k_sos, k_zi, x):
+    """ K-filters a stereo audio block x[:, channel], both channels at once.
+        The filter state k_zi is carried from block to block,
+        so the stream is filtered without discontinuities.
+        (K-filtered block, its energy (sum of squares) per channel, new k_zi)
+    """
+    y, k_zi = sosfilt( k_sos, x, axis=0, zi=k_zi )
+    return y, np.einsum('ij,ij->j', y, y), k_zi
+
+
 def parse_cmdline():
 
+    # Thanks to https://python-sounddevice.readthedocs.io
+    import sounddevice as sd
+
     def int_or_str(text):
         """Helper function for argument parsing."""
         try:
@@ -151,8 +334,8 @@ def parse_cmdline():
 
 class LU_meter(object):
     """
-        Measures EBU R128 [M]omentary & [I]ntegrated loudness of
-        an audio stream from a system sound device.
+        Measures EBU R128 [M]omentary, [S]hort-term & [I]ntegrated loudness
+        of an audio stream from a system sound device.
 
 
         .start()        Start to measure
@@ -163,10 +346,14 @@ class LU_meter(object):
 
         .display        On console use, will display measurements (boolean)
 
-        .M              [M]omentary loudness measurement
+        .M              [M]omentary loudness measurement (400 ms)
+
+        .S              [S]hort-term loudness measurement (3 s)
 
         .I              [I]ntegrated loudness measurement (cummulated)
 
+        .LRA            Loudness Range (cummulated)
+
         .M_event        Event object to notify the user for changes in [M]
 
         .M_threshold    Threshold in dB to trigger M_event
@@ -197,8 +384,15 @@ class LU_meter(object):
         self.meas_reset  = False
         # Measured (M)omentary Loudness  dBFS
         self.M = -100.0
+        # Measured (S)hort-term Loudness dBFS
+        self.S = -100.0
         # Measured (I)ntegrated Loudness dBFS
         self.I = -100.0
+        # Measured Loudness Range (LU)
+        self.LRA = 0.0
+        # Histograms of the 400 ms (M) and 3 s (S) loudness values
+        self.M_hist = LoudnessHistogram()
+        self.S_hist = LoudnessHistogram()
 
 
     def reset(self):
@@ -208,62 +402,47 @@ class LU_meter(object):
     def start(self):
         """ Starts metering forever """
 
+        # Thanks to https://python-sounddevice.readthedocs.io
+        import sounddevice as sd
+
 
         def display_header():
-            print(f'    -------- dBFS --------      --- dBLU @ -23dBFS ---')
-            print(f'    Momentary   Integrated      Momentary   Integrated')
+            print(f'    -------------- dBFS --------------      '
+                  f'--------- dBLU @ -23dBFS ---------')
+            print(f'    Momentary   Short-term  Integrated      '
+                  f'Momentary   Short-term  Integrated')
 
 
         def display_measurements():
             # A header must be already displayed
             M_FS = round(self.M, 1)
+            S_FS = round(self.S, 1)
             I_FS = round(self.I, 1)
             M_LU = M_FS - -23.0        # from dBFS to dBLU ( 0 dBLU = -23dBFS )
+            S_LU = S_FS - -23.0
             I_LU = I_FS - -23.0
-            print( f'    {M_FS:6.1f}      {I_FS:6.1f}      '
-                   f'    {M_LU:6.1f}      {I_LU:6.1f}', end='\r' )
-
-
-        def get_coeffs(fs, f0, Q, ftype, dBgain=0.0):
-            """ this calculates coeffs and initial conditions
-                for signal.lfilter
-            """
-            b, a = biquad( fs, f0, Q, ftype, dBgain )
-            zi   = lfilter_zi(b, a)
-            return b, a, zi
-
-
-        def k_filter(x):
-            """ input:  stereo audio block: x[:, channel]
-                output: x K-filtered, 100Hz HPF + 1000Hz High Shelf +4dB
-            """
-            y = np.copy( x )
-            # coeffs includes 'b', 'a' and initial condition 'zi' for lfilter
-            # hpf_coeffs     -->  100Hz HPF
-            # hshelf_coeffs  -->  1000Hz High Shelf +4dB
-            for coeffs in (hpf_coeffs, hshelf_coeffs):
-                b, a, zi = coeffs
-                y[:, 0], _ = lfilter( b, a, x[:,0], zi = zi * x[:, 0][0] )
-                y[:, 1], _ = lfilter( b, a, x[:,1], zi = zi * x[:, 1][0] )
-            return y
+            print( f'    {M_FS:6.1f}      {S_FS:6.1f}      {I_FS:6.1f}      '
+                   f'    {M_LU:6.1f}      {S_LU:6.1f}      {I_LU:6.1f}', end='\r' )
 
 
         def callback(indata, frames, time, status):
             """ The handler for input stream audio chunks,
                 simply puts data into the input-queue
+                (indata is reused by sounddevice, so it is copied)
             """
             if status:
                 print( f'----- {status} -----' )
-            qIn.put( indata )
+            qIn.put( indata.copy() )
 
 
         def loop_forever():
             """ loop capturing stream and processing audio blocks """
 
-            # Initialize cummulative mean and gates
-            G1mean  = -100.0
-            G1      = 0
-            G2      = 0
+            nonlocal k_zi
+
+            # Blocks received, so that the windows are full before
+            # counting their values
+            nblocks = 0
             # Memorize last measurements used for evaluate if threshold exceeded
             M_last = -100.0
             I_last = -100.0
@@ -279,32 +458,25 @@ class LU_meter(object):
                     # Reading captured blocks of 100 ms from the input-queue
                     b100 = qIn.get()
 
-                    # “K” weight filtering the 100ms chunks
-                    k100 = k_filter(b100)
-
-                    # Sliding the 400ms (w)indow and filling it with k100 chunks
-                    w400[ : bs * 3 ] = w400[ bs : ]
-                    w400[ bs * 3 : ] = k100
-
-                    # Mean square calculation for 400ms audio blocks
-                    msqL = np.sum( np.square( w400[:,0] ) ) / (fs * 0.4)
-                    msqR = np.sum( np.square( w400[:,1] ) ) / (fs * 0.4)
+                    # The energy of the “K” weight filtered 100ms chunk
+                    # for each channel, stored in the ring buffer
+                    _, energy, k_zi = k_block(k_sos, k_zi, b100)
+                    ring.add(energy)
+                    nblocks += 1
 
-                    # Stereo (M)omentary Loudness (divided by 2 channels)
-                    if msqL or msqR:    # avoid log10(0)
-                        self.M = -0.691 + 20 * np.log10(msqL + msqR) / 2
-                    else:
-                        self.M = -100.0
+                    # (M)omentary Loudness: 400 ms, (S)hort-term: 3 s
+                    self.M = ring.loudness(4)
+                    self.S = ring.loudness(NBLOCKS)
 
-                    # Dual gatting to compute (I)ntegrated Loudness.
-                    if self.M > -70.0:
-                        # cumulative moving average
-                        G1 += 1
-                        G1mean = G1mean + (self.M - G1mean) / G1
+                    # Gated (I)ntegrated Loudness over the 400 ms blocks
+                    # (overlapping 75%), and Loudness Range over the 3 s ones
+                    if nblocks >= 4:
+                        self.M_hist.add(self.M)
+                        self.I = self.M_hist.integrated()
 
-                    if self.M > (G1mean - 10.0):
-                        G2 += 1
-                        self.I = G1mean + (self.M - G1mean) / G2
+                    if nblocks >= NBLOCKS:
+                        self.S_hist.add(self.S)
+                        self.LRA = self.S_hist.loudness_range()
 
                     # End of measurements, let's manage events:
 
@@ -312,10 +484,11 @@ class LU_meter(object):
                     if self.meas_reset:
                         print('(lu_meter) restarting measurement')
                         self.M  = -100.0
+                        self.S  = -100.0
                         self.I  = -100.0
-                        G1mean  = -100.0
-                        G1 = 0
-                        G2 = 0
+                        self.LRA = 0.0
+                        self.M_hist.reset()
+                        self.S_hist.reset()
                         self.meas_reset = False  # releasing the flag
 
                     # Prints to console
@@ -340,12 +513,14 @@ class LU_meter(object):
         # Block size in samples for 100 msec of audio at Fs
         bs  = int( fs * 0.100 )
 
-        # Initialize a 400ms stereo block window
-        w400 = np.zeros( (4 * bs, 2) , dtype='float32')
+        # The last 100 ms blocks energies, enough for the 3 s short-term
+        NBLOCKS  = 30
+        ring     = BlocksRing(bs, NBLOCKS)
 
-        # Prepare the needed coeffs for 'K' filtering audio blocks
-        hpf_coeffs =    get_coeffs(fs, 100,  .707, 'hpf'            )
-        hshelf_coeffs = get_coeffs(fs, 1000, .707, 'highshelf', 4.0 )
+        # Prepare the 'K' filter sections and their state,
+        # shaped (sections, 2, channels) for filtering along axis 0
+        k_sos = k_weighting_sos(fs)
+        k_zi  = np.zeros( (k_sos.shape[0], 2, 2) )
 
         # Prepare display header
         if self.display:
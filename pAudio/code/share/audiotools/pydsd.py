@@ -362,7 +362,7 @@ def semiblackmanharris(m):
     %% m = Número de muestras.
     """
     # generamos la ventana con tamaño 2*m
-    w = signal.blackmanharris(2*m)
+    w = signal.windows.blackmanharris(2*m)
     # devolvemos la mitad derecha
     return w[m:]
 
@@ -371,7 +371,7 @@ def blackmanharris(m):
     """
     %% Obtiene una ventana Blackman-Harris de longitud m.
     """
-    return signal.blackmanharris(m)
+    return signal.windows.blackmanharris(m)
 
 
 def minphsp(sp):
@@ -3,6 +3,7 @@
     common use tools
 """
 import os.path
+from functools import lru_cache
 import numpy as np
 from scipy.io import wavfile
 from scipy import signal
@@ -348,21 +349,75 @@ def fft_spectrum(freq, mag, fs=44100, wsize=2**12, make_whole=False):
     return freq_new, mag_new
 
 
+@lru_cache(maxsize=8)
+def _minphase_vectors(taps):
+    """ The cepstrum folding vector and the right half Blackman-Harris
+        window for a given IR length (cached, read-only arrays)
+    """
+    # Folding the real cepstrum to causal gives the minimum phase:
+    # c[0] and c[taps/2] are kept, the positive quefrencies are doubled
+    # and the negative ones are discarded.
+    fold = np.zeros(taps)
+    fold[0] = 1.0
+    fold[1 : taps // 2] = 2.0
+    fold[taps // 2] = 1.0
+
+    window = signal.windows.blackmanharris(2 * taps)[taps:]
+
+    fold.flags.writeable   = False
+    window.flags.writeable = False
+
+    return fold, window
+
+
 def semispectrum2impulse(semisp, dB=True):
     """
         Converting freq domain ---( IFFT )---> tieme domain
 
-        semisp :    an even spaced positive semispectrum of magnitude values
+        semisp :    an even spaced positive semispectrum of magnitude values,
+                    or a 2D array of them (one per row)
         dB     :    magnitudes are given in dB
         taps   :    IR length
 
-        return :    a MINIMUMM PHASE IR from the given semispectrum frequency response
+        return :    a MINIMUMM PHASE IR from the given semispectrum frequency
+                    response (or a 2D array of IRs)
+    """
+
+    semisp = np.asarray(semisp)
+
+    # Check for ODD length
+    if semisp.shape[-1] % 2 == 0:
+        raise ValueError(f'(!) ERROR, it must be an ODD semispectrum: {semisp.shape[-1]}')
+
+    # dBs --> linear
+    if dB:
+        semisp = 10.0**(semisp/20.0)
+
+    # (i) The minimum phase is derived from the real cepstrum of the
+    #     magnitude, so only real FFTs of the positive semispectrum
+    #     are needed, instead of building the WHOLE spectrum.
+    #     See semispectrum2impulse_hilbert() for the classic way.
+    taps = 2 * (semisp.shape[-1] - 1)                   # FIR taps
+    fold, window = _minphase_vectors(taps)
+
+    cepstrum = np.fft.irfft( np.log(np.abs(semisp)), n=taps, axis=-1 )
+    minphsp  = np.exp( np.fft.rfft( cepstrum * fold, axis=-1 ) )
+
+    # freq. domain  --> time domain and windowing
+    imp = np.fft.irfft( minphsp, n=taps, axis=-1 ) * window
+
+    return imp
+
+
+def semispectrum2impulse_hilbert(semisp, dB=True):
+    """
+        The former semispectrum2impulse() by using pydsd (DSD) functions,
+        kept as a reference. Only 1D semispectrums.
     """
 
     # Check for ODD length
     if len(semisp) % 2 == 0:
         raise ValueError(f'(!) ERROR, it must be an ODD semispectrum: {len(semisp)}')
-        sys.exit()
 
     # dBs --> linear
     if dB:
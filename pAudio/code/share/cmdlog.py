@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    A command log written in background, so that the commands processing
+    does not wait for the disk.
+
+    One JSON record per line:
+
+        {"ts": "2024/10/23 17:16:43", "cmd": "level", "args": "-1 add",
+         "result": "done", "ms": 3.2}
+
+    The file is rotated by size and optionally by time, keeping some
+    backups as <file>.1, <file>.2 ...
+
+    Read-only commands (e.g. the web page 'state' polling) can be logged,
+    sampled (one of every N for each command) or dropped.
+
+    Optional config.yml settings:
+
+        command_log:
+            max_MB:         10
+            backups:        3
+            rotate_hours:   0           # 0: only by size
+            read_only:      sample      # log | sample | drop
+            sample_every:   60
+"""
+
+import  os
+import  json
+import  queue
+import  atexit
+import  threading
+from    time import time, strftime
+from    fmt import Fmt
+
+
+# Pending records, beyond this they will be discarded
+QUEUE_SIZE  = 1000
+
+# Long results (e.g. the whole state) are truncated
+RESULT_MAX  = 200
+
+
+class CommandLog(object):
+
+    def __init__(self, fpath, options=None):
+
+        options             = options or {}
+
+        self.fpath          = fpath
+        self.max_bytes      = options.get('max_MB', 10) * 1e6
+        self.backups        = options.get('backups', 3)
+        self.rotate_secs    = options.get('rotate_hours', 0) * 3600
+        self.read_only      = options.get('read_only', 'sample')
+        self.sample_every   = max(1, options.get('sample_every', 60))
+
+        self.queue          = queue.Queue(maxsize=QUEUE_SIZE)
+        self.samples        = {}
+        self.dropped        = 0
+        self.f              = None
+        self.opened         = 0
+
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+
+    def log(self, cmd, args, result, ms, read_only=False):
+        """ Queues a record, never blocks
+        """
+        if read_only:
+
+            if self.read_only == 'drop':
+                return
+
+            if self.read_only == 'sample':
+                n = self.samples.get(cmd, 0)
+                self.samples[cmd] = n + 1
+                if n % self.sample_every:
+                    return
+
+        record = {  'ts':       strftime('%Y/%m/%d %H:%M:%S'),
+                    'cmd':      cmd,
+                    'args':     args,
+                    'result':   str(result)[:RESULT_MAX],
+                    'ms':       round(ms, 1)
+                 }
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+    def close(self):
+        """ Writes the pending records
+        """
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                self.thread.join(timeout=2)
+            except queue.Full:
+                pass
+
+
+    def _open(self):
+        self.f      = open(self.fpath, 'a')
+        self.opened = time()
+
+
+    def _rotate(self):
+
+        self.f.close()
+
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.fpath}.{n}'):
+                os.replace(f'{self.fpath}.{n}', f'{self.fpath}.{n + 1}')
+
+        if self.backups:
+            os.replace(self.fpath, f'{self.fpath}.1')
+        else:
+            os.remove(self.fpath)
+
+        self._open()
+
+
+    def _needs_rotation(self):
+
+        if self.f.tell() >= self.max_bytes:
+            return True
+
+        if self.rotate_secs and time() - self.opened >= self.rotate_secs \
+           and self.f.tell():
+            return True
+
+        return False
+
+
+    def _write(self, records):
+
+        if self.dropped:
+            records.append( { 'ts':     strftime('%Y/%m/%d %H:%M:%S'),
+                              'cmd':    'cmdlog',
+                              'args':   '',
+                              'result': f'{self.dropped} records dropped',
+                              'ms':     0.0 } )
+            self.dropped = 0
+
+        for r in records:
+            self.f.write( json.dumps(r) + '\n' )
+        self.f.flush()
+
+        if self._needs_rotation():
+            self._rotate()
+
+
+    def _loop(self):
+
+        try:
+            self._open()
+        except Exception as e:
+            print(f'{Fmt.RED}(cmdlog) cannot open `{self.fpath}`: {str(e)}{Fmt.END}')
+            return
+
+        while True:
+
+            # A batch of records, the ones queued meanwhile are included
+            records = [ self.queue.get() ]
+
+            while True:
+                try:
+                    records.append( self.queue.get_nowait() )
+                except queue.Empty:
+                    break
+
+            end = None in records
+            records = [r for r in records if r is not None]
+
+            try:
+                self._write(records)
+            except Exception as e:
+                print(f'{Fmt.RED}(cmdlog) error writing `{self.fpath}`: {str(e)}{Fmt.END}')
+
+            if end:
+                self.f.close()
+                break
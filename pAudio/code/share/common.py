@@ -3,8 +3,10 @@
 # Copyright (c) Rafael Sánchez
 # This file is part of 'pAudio', a PC based personal audio system.
 
+import  os
 import  subprocess as sp
 import  threading
+import  atexit
 import  socket
 from    time import sleep, strftime
 import  yaml
@@ -14,6 +16,7 @@ import  sys
 import  ipaddress
 from    getpass import getuser
 from    config import *
+import  paudio_client
 
 USER = getuser()
 
@@ -61,13 +64,16 @@ def send_cmd( cmd, sender='', verbose=False, timeout=3,
 
         with socket.create_connection( (host, port), timeout=timeout ) as s:
 
-            s.send( cmd.encode() )
+            # (i) The newline terminates the command phrase for servers
+            #     running in asyncio mode, the classic ones will strip it.
+            s.send( f'{cmd}\n'.encode() )
 
             if verbose:
                 print( f'{Fmt.BLUE}(send_cmd) ({sender}) Tx: \'{cmd}\'{Fmt.END}' )
 
             ans = ''
 
+            # Read until the server closes or the answer line is complete
             while True:
 
                 tmp = s.recv(1024)
@@ -77,6 +83,10 @@ def send_cmd( cmd, sender='', verbose=False, timeout=3,
 
                 ans += tmp.decode()
 
+                if ans.endswith('\n'):
+                    ans = ans[:-1]
+                    break
+
             if verbose:
                 print( f'{Fmt.BLUE}(send_cmd) ({sender}) Rx: \'{ans}\'{Fmt.END}' )
 
@@ -142,17 +152,27 @@ def read_json_file(fpath, timeout=1):
     return d
 
 
-def save_json_file(d, fpath, timeout=1):
+def save_json_file(d, fpath, timeout=1, fsync=False):
     """ Some json files cannot be ready to write because concurrency,
-        so let's retry
+        so let's retry.
+        The file is replaced atomically, so readers never find it half written.
+        fsync waits for the disk, use it only out of the requests path
+        (e.g. JsonWriteBehind).
     """
 
+    # A temporary file for each writer thread
+    tmp_path = f'{fpath}.{os.getpid()}.{threading.get_ident()}.tmp'
+
     period = 0.1
     tries = int(timeout / period)
     while tries:
         try:
-            with open(fpath, 'w') as f:
+            with open(tmp_path, 'w') as f:
                 f.write(json.dumps(d))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, fpath)
             break
         except:
             tries -= 1
@@ -164,6 +184,41 @@ def save_json_file(d, fpath, timeout=1):
         return False
 
 
+class JsonWriteBehind(object):
+    """ Saves a dict to a json file in background, so that the caller
+        does not wait for the disk.
+
+        touch() marks the dict as modified, changes within `interval`
+        seconds are coalesced into a single save_json_file().
+        flush() saves now if pending, it is also done when exiting.
+    """
+
+    def __init__(self, d, fpath, interval=0.5):
+        self.d          = d
+        self.fpath      = fpath
+        self.interval   = interval
+        self.dirty      = threading.Event()
+        self.lock       = threading.Lock()
+        threading.Thread(target=self._loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def touch(self):
+        self.dirty.set()
+
+    def flush(self):
+        with self.lock:
+            if self.dirty.is_set():
+                self.dirty.clear()
+                # a shallow copy because the dict can be modified meanwhile
+                save_json_file(self.d.copy(), self.fpath, fsync=True)
+
+    def _loop(self):
+        while True:
+            self.dirty.wait()
+            sleep(self.interval)
+            self.flush()
+
+
 def read_yaml_file(fpath):
     with open(fpath, 'r') as f:
         c = yaml.safe_load(f.read())
@@ -416,25 +471,17 @@ def get_drc_sets_from_loudspeaker_folder():
 
 
 def get_target_sets(fs=44100):
-    """ looks for '+x.x-x.x_target_mag.dat files inside the eq folder
+    """ The '+x.x-x.x' target IDs available in the curves store
+        of the eq folder (see curves_store.py)
     """
-    targets_folder  = f'{EQFOLDER}/curves_{fs}_N11/room_target'
-    files = []
-    sets  = []
+    # (i) Importing here to avoid loading numpy to every common user
+    from curves_store import load_store
 
     try:
-        files = os.listdir(targets_folder)
-        files = [x for x in files if os.path.isfile(f'{targets_folder}/{x}') ]
-        files = [x for x in files if x.endswith('_target_mag.dat') ]
-    except:
-        pass
-
-    for file in files:
-        tID = file.split('_target')[0]
-        if not tID in sets:
-            sets.append(tID)
-
-    return sorted(sets)
+        return load_store(f'{EQFOLDER}/curves_{fs}_N11').target_ids()
+    except Exception as e:
+        print(f'{Fmt.RED}(common) cannot load target sets: {str(e)}{Fmt.END}')
+        return []
 
 
 def process_is_running(pattern):
@@ -458,12 +505,13 @@ def wait4server(timeout=60):
     tries  = int(timeout / period)
 
     while tries:
-        try:
-            sp.check_output(f'echo aux hello | nc localhost {CONFIG["paudio_port"]}', shell=True)
+        ans = paudio_client.send( 'aux hello', host='localhost',
+                                  port=CONFIG.get('paudio_port', 9980),
+                                  timeout=period )
+        if ans == 'ACK':
             break
-        except:
-            tries -= 1
-            sleep(period)
+        tries -= 1
+        sleep(period)
 
     if tries:
         return True
@@ -743,14 +791,14 @@ def remote_zita_restart(raddr='', ctrl_port=0, zita_port=0, mode='restart'):
 
         print(f'{Fmt.GRAY}(common) stopping remote {raddr}: {remotecmd}{Fmt.END}')
 
-        send_cmd(remotecmd, host=raddr, port=ctrl_port, timeout=1)
+        paudio_client.send(remotecmd, host=raddr, port=ctrl_port, timeout=1)
 
         return None
 
 
     zargs     = json.dumps( (get_my_ip(), zita_port, 'start') )
     remotecmd = f'aux zita_j2n {zargs}'
-    result = send_cmd(remotecmd, host=raddr, port=ctrl_port)
+    result = paudio_client.send(remotecmd, host=raddr, port=ctrl_port)
 
     print(f'(common) SENDING TO REMOTE: {remotecmd}')
 
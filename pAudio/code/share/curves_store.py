@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    A binary curve store for a 'curves_<fs>_N11' folder.
+
+    The text .dat curves (bass, treble, loudness, room targets) are compiled
+    into a single 'curves.bin' file holding float32 arrays, which is memory
+    mapped read-only. The store is automatically rebuilt when the .dat
+    sources change.
+
+    curves.bin layout:
+
+        - A JSON header line, padded with spaces to a 64 bytes boundary:
+
+            {   "N":        2049,
+                "rows":     {"bass": [0, 25], "freq": [25, 1], ...},
+                "targets":  {"+0.0-0.0": 51, ...},
+                "sources":  {"bass_mag.dat": [size, mtime_ns], ...}
+            }
+
+        - float32 rows of N points
+
+    usage:  store = load_store(folder)
+            store.curves('bass')        --> 2D array (25, N)
+            store.target('+3.0-0.5')    --> 1D array (N)
+            store.target_ids()          --> list of target IDs
+"""
+
+import  os
+import  sys
+import  json
+import  numpy as np
+
+UHOME = os.path.expanduser("~")
+sys.path.append(f'{UHOME}/pAudio/code/share')
+
+from    fmt import Fmt
+
+
+STORE_FNAME     = 'curves.bin'
+TARGETS_SUBDIR  = 'room_target'
+
+# Loaded stores
+_STORES = {}
+
+
+class CurvesStore(object):
+    """ A read-only view of a compiled curves folder
+    """
+
+    def __init__(self, index, data):
+        self.index  = index
+        self.data   = data
+
+    def curves(self, name):
+        first, count = self.index["rows"][name]
+        return self.data[first : first + count, :]
+
+    def curve(self, name):
+        return self.curves(name)[0, :]
+
+    def target(self, tID):
+        if not tID in self.index["targets"]:
+            raise ValueError(f'target `{tID}` not found')
+        return self.data[ self.index["targets"][tID], : ]
+
+    def target_ids(self):
+        return sorted( self.index["targets"].keys() )
+
+
+def _get_sources(folder):
+    """ The .dat magnitude sources as a dictionary:
+            {relative path: [size, mtime_ns]}
+    """
+    sources = {}
+
+    for subdir in ('', TARGETS_SUBDIR):
+
+        path = f'{folder}/{subdir}' if subdir else folder
+
+        try:
+            files = sorted( os.listdir(path) )
+        except:
+            continue
+
+        for fname in files:
+
+            if not fname.endswith('_mag.dat') and \
+               not (fname == 'freq.dat' and not subdir):
+                continue
+
+            relpath = f'{subdir}/{fname}' if subdir else fname
+            st = os.stat(f'{folder}/{relpath}')
+            sources[relpath] = [st.st_size, st.st_mtime_ns]
+
+    return sources
+
+
+def _read_index(store_path):
+    """ Reads the header of a curves.bin file
+        (dict)
+    """
+    with open(store_path, 'rb') as f:
+        header = f.readline()
+    index = json.loads(header)
+    index["offset"] = len(header)
+    return index
+
+
+def _compile_store(folder, sources):
+    """ Parses the .dat sources, then writes the curves.bin file
+        (index, data, written)
+    """
+    rows    = {}
+    targets = {}
+    arrays  = []
+    nrows   = 0
+
+    for relpath in sources:
+
+        a = np.atleast_2d( np.loadtxt(f'{folder}/{relpath}') ).astype('float32')
+
+        if relpath.startswith(f'{TARGETS_SUBDIR}/'):
+            tID = relpath.split('/')[-1].split('_target')[0]
+            targets[tID] = nrows
+        else:
+            name = relpath.replace('_mag.dat', '').replace('.dat', '')
+            rows[name] = [nrows, a.shape[0]]
+
+        arrays.append(a)
+        nrows += a.shape[0]
+
+    data = np.concatenate(arrays) if arrays else np.zeros((0, 0), dtype='float32')
+
+    index = {   'N':        data.shape[1],
+                'rows':     rows,
+                'targets':  targets,
+                'sources':  sources
+            }
+
+    # The header line is padded so that the float32 data becomes aligned
+    header = json.dumps(index).encode()
+    header += b' ' * (63 - len(header) % 64) + b'\n'
+
+    store_path = f'{folder}/{STORE_FNAME}'
+    tmp_path   = f'{store_path}.tmp'
+
+    written = False
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            data.tofile(f)
+        os.replace(tmp_path, store_path)
+        written = True
+        print(f'{Fmt.BLUE}(curves_store) compiled `{store_path}`{Fmt.END}')
+
+    except Exception as e:
+        print(f'{Fmt.RED}(curves_store) cannot write `{store_path}`: {str(e)}{Fmt.END}')
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    index["offset"] = len(header)
+
+    return index, data, written
+
+
+def load_store(folder, check=True):
+    """ Returns the CurvesStore for a 'curves_<fs>_N11' folder.
+
+        check:  verify that the .dat sources have not changed,
+                otherwise the store will be rebuilt.
+    """
+    if folder in _STORES and not check:
+        return _STORES[folder]
+
+    store_path = f'{folder}/{STORE_FNAME}'
+    sources    = _get_sources(folder)
+
+    if folder in _STORES and _STORES[folder].index["sources"] == sources:
+        return _STORES[folder]
+
+    index = {}
+    if os.path.isfile(store_path):
+        try:
+            index = _read_index(store_path)
+        except Exception as e:
+            print(f'{Fmt.RED}(curves_store) bad `{store_path}`: {str(e)}{Fmt.END}')
+
+    if index and index["sources"] == sources:
+        nrows = sum( [c for _, c in index["rows"].values()] ) + len(index["targets"])
+        data = np.memmap( store_path, dtype='float32', mode='r',
+                          offset=index["offset"], shape=(nrows, index["N"]) )
+
+    else:
+        index, data, written = _compile_store(folder, sources)
+
+        # Prefer the read-only mapped file if just written, an older
+        # file left there (e.g. read-only or full disk) does not match
+        if written and data.size:
+            data = np.memmap( store_path, dtype='float32', mode='r',
+                              offset=index["offset"], shape=data.shape )
+
+    _STORES[folder] = CurvesStore(index, data)
+
+    return _STORES[folder]
+
+
+# for command line usage: compile the store for the given folders
+if __name__ == '__main__':
+
+    if not sys.argv[1:]:
+        print('usage: curves_store.py  path/to/curves_<fs>_N11  ...')
+        sys.exit()
+
+    for folder in sys.argv[1:]:
+        store = load_store( folder.rstrip('/') )
+        print(f'{folder}: {len(store.target_ids())} targets, N={store.index["N"]}')
@@ -5,8 +5,13 @@
 
 """
     Dumps the EQ FIR in use to a .png file
+
+    A single renderer thread, see request_render(), serves the running
+    preamp: only the newest request is rendered, the figure is built once.
 """
 
+import  threading
+import  queue
 import  numpy as np
 from    scipy       import signal, fft
 from    matplotlib  import pyplot as plt, use as matplotlib_use
@@ -24,6 +29,7 @@ UHOME = os.path.expanduser("~")
 sys.path.append(f'{UHOME}/pAudio/code/share')
 
 from common import *
+import metrics
 
 EQFIR_PATH  = f'{EQFOLDER}/eq.pcm'
 IMGFOLDER   = f'{MAINFOLDER}/code/share/www/images'
@@ -42,12 +48,24 @@ DB_LIMITS   = [-9, +21]
 DB_TICKS    = [-6, 0, 6, 12, 18]
 DB_LABELS   = ['-6', '0', '6', '12', '18']
 
+# The figure is built once, then only the curve is updated
+FIG         = None
+LINE        = None
+
+# Renderer worker (latest wins)
+RENDER_QUEUE    = queue.Queue(maxsize=1)
+RENDER_THREAD   = None
+GRAPH_VERSION   = 0
+
 
-def readPCM(fname):
-    """ reads impulse from a pcm float32 file
+def readPCM(fname, skip_bytes=0, read_bytes=0):
+    """ reads impulse from a pcm float32 file, or from a chunk of it
     """
     #return np.fromfile(fname, dtype='float32')
-    return np.memmap(fname, dtype='float32', mode='r')
+    imp = np.memmap(fname, dtype='float32', mode='r', offset=skip_bytes)
+    if read_bytes:
+        imp = imp[ : read_bytes // 4 ]
+    return imp
 
 
 def get_spectrum(imp, fs):
@@ -85,9 +103,10 @@ def init():
         print(f'(eqfir2png) unexpected error whith mkdir "{IMGFOLDER}"')
 
 
-def fir2png(firpath=EQFIR_PATH):
-    """ Do plot a png from a pcm FIR file
-    """
+def prepare_figure():
+
+    global FIG, LINE
+
     fig, ax = plt.subplots()
     fig.set_figwidth( 5 )   # 5 inches at 100dpi => 500px wide
     fig.set_figheight( 1.5 )
@@ -105,13 +124,70 @@ def fir2png(firpath=EQFIR_PATH):
 
     ax.set_title( 'EQ' )
 
-    freqs, magdB = get_spectrum( readPCM(firpath), CONFIG["samplerate"] )
+    LINE, = ax.plot([], [], color='grey', linewidth=3)
+    FIG   = fig
+
+
+@metrics.timed()
+def fir2png(firpath=EQFIR_PATH, skip_bytes=0, read_bytes=0):
+    """ Do plot a png from a pcm FIR file
+        (skip_bytes and read_bytes as per the CamillaDSP Raw Conv filter)
+    """
+    if FIG is None:
+        prepare_figure()
+
+    freqs, magdB = get_spectrum( readPCM(firpath, skip_bytes, read_bytes),
+                                 CONFIG["samplerate"] )
 
-    ax.plot(freqs, magdB, color='grey', linewidth=3)
+    LINE.set_data(freqs, magdB)
 
-    plt.savefig( EQPNG_PATH, facecolor=WEBCOLOR )
+    FIG.savefig( EQPNG_PATH, facecolor=WEBCOLOR )
     #plt.show()
-    plt.close('all')
+
+
+def render_loop(on_done):
+    """ The renderer thread: renders the newest requested FIR,
+        then calls on_done(GRAPH_VERSION)
+    """
+    global GRAPH_VERSION
+
+    while True:
+
+        fir = RENDER_QUEUE.get()
+
+        try:
+            fir2png(*fir)
+        except Exception as e:
+            print(f'(eqfir2png) ERROR rendering {fir}: {str(e)}')
+            continue
+
+        GRAPH_VERSION += 1
+
+        if on_done:
+            on_done(GRAPH_VERSION)
+
+
+def request_render(firpath=EQFIR_PATH, skip_bytes=0, read_bytes=0, on_done=None):
+    """ Asks the renderer thread for a new graph. A still pending
+        request is dropped, so that only the newest EQ is rendered.
+        (on_done is taken at the first request)
+    """
+    global RENDER_THREAD
+
+    if RENDER_THREAD is None:
+        RENDER_THREAD = threading.Thread( target=render_loop, args=(on_done,),
+                                          daemon=True )
+        RENDER_THREAD.start()
+
+    while True:
+        try:
+            RENDER_QUEUE.put_nowait( (firpath, skip_bytes, read_bytes) )
+            break
+        except queue.Full:
+            try:
+                RENDER_QUEUE.get_nowait()
+            except queue.Empty:
+                pass
 
 
 init()
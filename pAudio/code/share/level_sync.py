@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    Multiroom level synchronization by UDP multicast (or broadcast)
+
+    usage:   level_sync.py    listen [-p=PORT] | stop
+
+        listen      applies the level settings received from the master
+                    (remote_volume_daemon.py) to the local pAudio
+        -p=PORT     the local pAudio port (default: paudio_port)
+
+    The master sends a compact datagram for every level change, whatever
+    the number of listening rooms:
+
+        {"id":1729700000,"seq":12,"level":-20.0,"delta":-1.0,
+         "lu_offset":6,"loudness":true}
+
+    'id' changes when the master restarts. A datagram following the last
+    one received applies the relative level 'delta' (if any), otherwise
+    the absolute settings are applied. Repeated or older datagrams are
+    ignored, so the master can repeat the last one periodically to recover
+    lost datagrams.
+
+    Settings are applied only while the local pAudio is listening to a
+    'remote...' source whose address is the master one, having
+    'remote_track_level: true'.
+
+    config.yml (the same for the master and the listeners):
+
+        remote_volume:
+            multicast:
+                group:      239.255.98.1    # or a broadcast address
+                port:       9996
+                interface:  0.0.0.0         # e.g. 127.0.0.1 for loopback tests
+                ttl:        1
+                repeat:     2               # seconds, 0: do not repeat
+"""
+
+import  sys
+import  os
+import  json
+import  socket
+import  ipaddress
+from    subprocess import Popen
+from    time import time
+
+UHOME       = os.path.expanduser("~")
+sys.path.append(f'{UHOME}/pAudio/code/share')
+
+import  paudio_client
+from    common import CONFIG, USER
+
+
+MCONFIG     = (CONFIG.get('remote_volume') or {}).get('multicast') or {}
+GROUP       = MCONFIG.get('group', '239.255.98.1')
+PORT        = MCONFIG.get('port', CONFIG.get('paudio_port', 9980) + 16)
+INTERFACE   = MCONFIG.get('interface', '0.0.0.0')
+TTL         = MCONFIG.get('ttl', 1)
+REPEAT      = MCONFIG.get('repeat', 2)
+
+# A new id when the master restarts, so that listeners reset the sequence
+SENDER_ID   = int(time())
+
+
+def is_multicast():
+    return ipaddress.ip_address(GROUP).is_multicast
+
+
+def sender_socket():
+    """ A socket to send datagrams to the group
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    if is_multicast():
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, TTL)
+        # local listeners too
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                     socket.inet_aton(INTERFACE))
+    else:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    return s
+
+
+def listener_socket():
+    """ A socket receiving the group datagrams, several listeners
+        can share the port (e.g. local instances for testing)
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    if is_multicast():
+        s.bind( ('', PORT) )
+        mreq = socket.inet_aton(GROUP) + socket.inet_aton(INTERFACE)
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    else:
+        s.bind( ('', PORT) )
+
+    return s
+
+
+def pack(seq, state, delta=None):
+    """ The datagram for the master level settings
+        (bytes)
+    """
+    msg = { 'id':           SENDER_ID,
+            'seq':          seq,
+            'level':        state["level"],
+            'lu_offset':    state["lu_offset"],
+            'loudness':     state["equal_loudness"] }
+
+    if delta is not None:
+        msg["delta"] = delta
+
+    return json.dumps(msg, separators=(',', ':')).encode()
+
+
+def unpack(data):
+    """ (dict or None if not valid)
+    """
+    try:
+        msg = json.loads(data)
+        for key in 'id', 'seq', 'level', 'lu_offset', 'loudness':
+            msg[key]
+        return msg
+    except:
+        return None
+
+
+def master_sources():
+    """ The local 'remote...' sources tracking the master level
+        {source: master address}
+    """
+    sources = {}
+
+    jack_sources = (CONFIG.get('jack') or {}).get('sources') or {}
+
+    for sname, params in jack_sources.items():
+        if 'remote' in sname and params.get('remote_track_level'):
+            sources[sname] = params.get('remote_addr', '').split(':')[0]
+
+    return sources
+
+
+def listening_to(master_addr, paudio_port):
+    """ The local pAudio is listening to the master
+        (bool)
+    """
+    source = paudio_client.get('source', host='localhost', port=paudio_port,
+                               timeout=1)
+
+    return master_sources().get(source) == master_addr
+
+
+def commands(msg, relative):
+    """ The commands to apply a datagram
+        (list)
+    """
+    cmds = [ f'lu_offset {msg["lu_offset"]}',
+             f'loudness {msg["loudness"]}' ]
+
+    if relative:
+        if msg.get('delta'):
+            cmds.append( f'level {msg["delta"]} add' )
+    else:
+        cmds.append( f'level {msg["level"]}' )
+
+    return cmds
+
+
+def receive(s, last, paudio_port):
+    """ Reads a datagram, then the commands to apply it, none if it is
+        not valid, repeated, stale, or not listening to its master.
+        last: the last (id, seq) for each master address, updated here
+        (master address, list)
+    """
+    data, (addr, _) = s.recvfrom(1024)
+
+    msg = unpack(data)
+    if not msg:
+        return addr, []
+
+    prev = last.get(addr)
+
+    # repeated or stale
+    if prev and prev[0] == msg["id"] and msg["seq"] <= prev[1]:
+        return addr, []
+
+    if not listening_to(addr, paudio_port):
+        # a fresh start when listening again
+        last.pop(addr, None)
+        return addr, []
+
+    relative = bool(prev) and prev == (msg["id"], msg["seq"] - 1)
+
+    last[addr] = (msg["id"], msg["seq"])
+
+    return addr, commands(msg, relative)
+
+
+def listen(paudio_port):
+    """ Applies the master datagrams to the local pAudio, forever
+    """
+    s = listener_socket()
+    print( f'(level_sync) listening at {GROUP}:{PORT}' )
+
+    # last (id, seq) for each master address
+    last = {}
+
+    while True:
+
+        addr, cmds = receive(s, last, paudio_port)
+
+        if cmds:
+            print( f'(level_sync) {addr} #{last[addr][1]}: {cmds}' )
+            paudio_client.send_many( cmds, host='localhost', port=paudio_port )
+
+
+def killme():
+    Popen( f'pkill -u {USER} -f "level_sync.py listen"', shell=True )
+    sys.exit()
+
+
+if __name__ == "__main__":
+
+    paudio_port = CONFIG.get('paudio_port', 9980)
+    mode        = ''
+
+    for opc in sys.argv[1:]:
+
+        if opc in ('listen', 'stop'):
+            mode = opc
+
+        elif opc.startswith('-p='):
+            paudio_port = int( opc.split('=')[-1] )
+
+        else:
+            print(__doc__)
+            sys.exit()
+
+    match mode:
+
+        case 'listen':
+            listen(paudio_port)
+
+        case 'stop':
+            killme()
+
+        case _:
+            print(__doc__)
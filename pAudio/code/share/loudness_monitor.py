@@ -39,7 +39,8 @@ else:
 
 
 def prepare_ldmon_path():
-    init_values = {"LU_I": -77.0, "LU_M": -80.0, "scope": "track"}
+    init_values = {"LU_I": -77.0, "LU_M": -80.0, "LU_S": -80.0, "LRA": 0.0,
+                   "scope": "track"}
     with open( LDMON_PATH, 'w') as f:
         f.write( json.dumps(init_values) )
 
@@ -175,10 +176,15 @@ def save2disk():
         # From dBFS to dBLU ( 0 dBLU = -23dBFS )
         I_LU = meter.I - -23.0
         M_LU = meter.M - -23.0
+        S_LU = meter.S - -23.0
         # Floor the value on disk as per the used threshold
         I_LU = I_LU // meter.I_threshold * meter.I_threshold
         M_LU = M_LU // meter.M_threshold * meter.M_threshold
-        d = { "LU_I":  I_LU, "LU_M":  M_LU, "scope": scope }
+        S_LU = S_LU // meter.I_threshold * meter.I_threshold
+        # The short-term loudness range (LU)
+        LRA  = round(float(meter.LRA), 1)
+        d = { "LU_I":  I_LU, "LU_M":  M_LU, "LU_S":  S_LU, "LRA": LRA,
+              "scope": scope }
         f.write( json.dumps(d) )
 
 
@@ -190,7 +196,8 @@ if __name__ == '__main__':
         if sys.argv[1] == 'stop':
             Popen( 'pkill -KILL -f "loudness_monitor.py start"', shell=True )
             with open(LDMON_PATH, 'w') as f:
-                f.write('{"LU_I": -99.0, "LU_M": -99.0, "scope": "album"}')
+                f.write('{"LU_I": -99.0, "LU_M": -99.0, "LU_S": -99.0, '
+                        '"LRA": 0.0, "scope": "album"}')
             sys.exit()
 
         elif sys.argv[1] == 'start':
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    In-memory latency histograms of the server process.
+
+    The wall time of every instrumented stage is accounted for the command
+    in progress in the current thread, other threads (e.g. the EQ graph
+    renderer) are accounted as 'background'.
+
+        with command('level'):          # paudio.do()
+            ...
+            with span('make_eq'):
+                ...
+
+        @timed()                        # stage named 'module.function'
+        def set_bass(dB):
+            ...
+
+        report()        --> {command: {stage: {count, sum_ms, max_ms,
+                                               p50_ms, p95_ms, p99_ms}}}
+        prometheus()    --> Prometheus text exposition format
+
+    Histograms have fixed buckets, so memory does not grow with time.
+"""
+
+import  threading
+import  functools
+from    time import perf_counter
+
+
+# Histogram buckets upper bounds (milliseconds)
+BUCKETS_MS  = ( 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100,
+                250, 500, 1000, 2500, 5000, float('inf') )
+
+# Beyond this number of (command, stage) pairs, commands are accounted as
+# 'other', e.g. if a client sends a lot of unknown commands.
+MAX_SERIES  = 500
+
+# {(command, stage): Histogram}
+HISTOGRAMS  = {}
+
+LOCK        = threading.Lock()
+
+# The command in progress for each thread
+_CURRENT    = threading.local()
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count  = 0
+        self.sum    = 0.0
+        self.max    = 0.0
+
+    def observe(self, ms):
+        for i, le in enumerate(BUCKETS_MS):
+            if ms <= le:
+                self.counts[i] += 1
+                break
+        self.count  += 1
+        self.sum    += ms
+        self.max    = max(self.max, ms)
+
+    def percentile(self, p):
+        """ An estimate, the upper bound of the bucket where `p` falls
+        """
+        if not self.count:
+            return 0.0
+        limit = self.count * p / 100
+        acc = 0
+        for le, c in zip(BUCKETS_MS, self.counts):
+            acc += c
+            if acc >= limit:
+                return min(le, self.max)
+        return self.max
+
+
+def current():
+    """ The command in progress in this thread
+    """
+    return getattr(_CURRENT, 'command', 'background')
+
+
+def observe(stage, ms, cmd=None):
+
+    cmd = cmd or current()
+
+    with LOCK:
+
+        key = (cmd, stage)
+
+        if not key in HISTOGRAMS and len(HISTOGRAMS) >= MAX_SERIES:
+            key = ('other', stage)
+
+        if not key in HISTOGRAMS:
+            HISTOGRAMS[key] = Histogram()
+
+        HISTOGRAMS[key].observe(ms)
+
+
+class span(object):
+    """ Context manager to measure a stage
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe( self.stage, (perf_counter() - self.t0) * 1000 )
+        return False
+
+
+class command(object):
+    """ Context manager to set the command in progress for this thread
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+    def __enter__(self):
+        self.prev = current()
+        _CURRENT.command = self.cmd
+        return self
+
+    def __exit__(self, *exc):
+        _CURRENT.command = self.prev
+        return False
+
+
+def timed(stage=None):
+    """ Decorator to measure a function as a stage,
+        by default named as 'module.function'
+    """
+    def decorator(func):
+
+        name = stage or f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def report():
+    """ Summary of the histograms
+        (dict)
+    """
+    with LOCK:
+
+        result = {}
+
+        for (cmd, stage), h in sorted(HISTOGRAMS.items()):
+            result.setdefault(cmd, {})[stage] = {
+                'count':    h.count,
+                'sum_ms':   round(h.sum, 3),
+                'max_ms':   round(h.max, 3),
+                'p50_ms':   round(h.percentile(50), 3),
+                'p95_ms':   round(h.percentile(95), 3),
+                'p99_ms':   round(h.percentile(99), 3)
+            }
+
+        return result
+
+
+def _label(value):
+    """ Prometheus label value escaping
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus():
+    """ The histograms in Prometheus text format (seconds)
+        (string)
+    """
+    name  = 'paudio_stage_duration_seconds'
+    lines = [ f'# HELP {name} Wall time of pAudio command stages.',
+              f'# TYPE {name} histogram' ]
+
+    with LOCK:
+
+        for (cmd, stage), h in sorted(HISTOGRAMS.items()):
+
+            labels = f'command="{_label(cmd)}",stage="{_label(stage)}"'
+
+            acc = 0
+            for le, c in zip(BUCKETS_MS, h.counts):
+                acc += c
+                le = '+Inf' if le == float('inf') else f'{le / 1000:g}'
+                lines.append( f'{name}_bucket{{{labels},le="{le}"}} {acc}' )
+
+            lines.append( f'{name}_sum{{{labels}}} {h.sum / 1000:.6f}' )
+            lines.append( f'{name}_count{{{labels}}} {h.count}' )
+
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with LOCK:
+        HISTOGRAMS.clear()
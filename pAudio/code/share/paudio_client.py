@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    A client for the pAudio command protocol: newline terminated command
+    phrases, a newline terminated answer for each one (see server.py)
+
+    Connections are kept in a per host pool, so consecutive commands do not
+    need a new TCP connection, and several commands can be pipelined in a
+    single round trip. The timeout is a deadline for the whole call.
+
+        ans     = send('level -1 add', host, port, timeout=1)
+        answers = send_many(['lu_offset 6', 'level -20'], host, port)
+        level   = get('level', host, port)      # by 'get_state level'
+
+    The asyncio flavour, concurrent sends are pipelined:
+
+        cli = await async_client(host, port)
+        ans = await cli.send('state', timeout=1)
+
+    Servers not running in asyncio mode close the connection after
+    answering, they are supported by send() and send_many() but without
+    pooling nor pipelining. A host is asked once by the 'server_mode'
+    phrase, only asyncio mode servers answer 'asyncio' (see server.py).
+
+    send(), send_many() and get() give errors as the answer string, as
+    common.send_cmd() does, the Client classes raise them.
+"""
+
+import  json
+import  socket
+import  asyncio
+import  threading
+from    collections import deque
+from    time import time
+
+
+# Idle connections kept for each (host, port)
+POOL_SIZE   = 4
+
+# {(host, port): [Client, ...]}
+POOL        = {}
+POOL_LOCK   = threading.Lock()
+
+# (host, port) known to keep the connection open (asyncio mode servers)
+PERSISTENT  = set()
+
+# (host, port) already asked by the 'server_mode' phrase
+PROBED      = set()
+
+# {(host, port, loop): AsyncClient}
+ASYNC_CLIENTS = {}
+
+
+class Client(object):
+    """ A connection to a pAudio server
+    """
+
+    def __init__(self, host, port, timeout=3, framed=True):
+        self.host   = host
+        self.port   = port
+        self.sock   = socket.create_connection( (host, port), timeout=timeout )
+        # newline framed answers, otherwise the answer lasts until
+        # the server closes (not in asyncio mode)
+        self.framed = framed
+        self.buff   = b''
+        self.used   = False
+        # answers read from the last send_many()
+        self.read   = 0
+        # the server has closed after answering (not in asyncio mode)
+        self.closed = False
+
+
+    def _readline(self, deadline):
+
+        while not (self.framed and b'\n' in self.buff):
+
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise TimeoutError(f'no answer from {self.host}:{self.port}')
+
+            self.sock.settimeout(remaining)
+            chunk = self.sock.recv(4096)
+
+            if not chunk:
+
+                # a pooled connection the server has closed meanwhile
+                if self.used and not self.buff:
+                    raise ConnectionResetError(f'{self.host}:{self.port} has closed')
+
+                self.closed = True
+                ans, self.buff = self.buff, b''
+                return ans.decode()
+
+            self.buff += chunk
+
+        line, self.buff = self.buff.split(b'\n', 1)
+        return line.decode()
+
+
+    def send_many(self, phrases, timeout=3):
+        """ Sends the command phrases at once, then reads the answers
+            (list of strings)
+        """
+        deadline  = time() + timeout
+        answers   = []
+        self.read = 0
+
+        self.sock.sendall( ''.join( [f'{p}\n' for p in phrases] ).encode() )
+
+        for p in phrases:
+            answers.append( self._readline(deadline) )
+            self.read += 1
+
+        self.used = True
+
+        return answers
+
+
+    def send(self, phrase, timeout=3):
+        return self.send_many([phrase], timeout)[0]
+
+
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
+
+
+def _checkout(host, port, timeout):
+    """ A pooled connection, or a new one
+    """
+    with POOL_LOCK:
+        idle = POOL.get( (host, port) )
+        if idle:
+            return idle.pop()
+
+    return Client(host, port, timeout, framed=(host, port) in PERSISTENT)
+
+
+def _probe(host, port, timeout):
+    """ Finds out if the server keeps the connection open (asyncio mode),
+        a legacy one answers the phrase as an unknown command then closes.
+    """
+    cli = Client(host, port, timeout)
+
+    try:
+        ans = cli.send('server_mode', timeout)
+    except:
+        cli.close()
+        raise
+
+    if ans == 'asyncio' and not cli.closed:
+        PERSISTENT.add( (host, port) )
+        _checkin(cli)
+    else:
+        cli.close()
+
+    PROBED.add( (host, port) )
+
+
+def _checkin(cli):
+
+    # a legacy server, or unread bytes that would be taken
+    # as the answer to the next command
+    if cli.closed or cli.buff or not cli.framed:
+        cli.close()
+        return
+
+    with POOL_LOCK:
+        idle = POOL.setdefault( (cli.host, cli.port), [] )
+        if len(idle) < POOL_SIZE:
+            idle.append(cli)
+            return
+
+    cli.close()
+
+
+def _send_many(phrases, host, port, timeout):
+    """ (raises errors)
+    """
+    deadline = time() + timeout
+    answers  = []
+    todo     = list(phrases)
+    retry    = True
+
+    if (host, port) not in PROBED:
+        _probe(host, port, timeout)
+
+    while todo:
+
+        cli = _checkout(host, port, max(0.01, deadline - time()))
+
+        # pipelining only with servers keeping the connection
+        n = len(todo) if (host, port) in PERSISTENT else 1
+
+        try:
+            answers += cli.send_many( todo[:n], max(0.01, deadline - time()) )
+
+        except ConnectionError:
+            cli.close()
+            # a stale pooled connection (nothing was answered),
+            # retry once with a new one
+            if not (cli.used and not cli.read and retry):
+                raise
+            retry = False
+            continue
+
+        except:
+            cli.close()
+            raise
+
+        todo = todo[n:]
+        _checkin(cli)
+
+    return answers
+
+
+def send_many(phrases, host, port, timeout=3):
+    """ Sends several command phrases, pipelined if possible
+        (list of strings)
+    """
+    try:
+        return _send_many(phrases, host, port, timeout)
+    except Exception as e:
+        return [str(e)] * len(phrases)
+
+
+def send(phrase, host, port, timeout=3):
+    """ Sends a command phrase
+        (string)
+    """
+    try:
+        return _send_many([phrase], host, port, timeout)[0]
+    except Exception as e:
+        return str(e)
+
+
+def get(field, host, port, timeout=3, offline=None):
+    """ A field of the preamp state, servers not supporting 'get_state'
+        will be asked for the whole state.
+        (None if not available, <offline> if the host does not answer)
+    """
+    try:
+        ans = _send_many([f'get_state {field}'], host, port, timeout)[0]
+    except:
+        return offline
+
+    try:
+        return json.loads(ans)
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        ans = _send_many(['state'], host, port, timeout)[0]
+    except:
+        return offline
+
+    try:
+        return json.loads(ans).get(field)
+    except:
+        return None
+
+
+class AsyncClient(object):
+    """ A persistent asyncio connection to an asyncio mode pAudio server.
+        Concurrent sends are pipelined, the answers come in order.
+    """
+
+    def __init__(self, host, port):
+        self.host       = host
+        self.port       = port
+        self.pending    = deque()
+        self.writer     = None
+        self.closed     = True
+        self.lock       = asyncio.Lock()
+
+
+    async def connect(self, timeout=3):
+
+        async with self.lock:
+
+            if not self.closed:
+                return
+
+            self.reader, self.writer = await asyncio.wait_for(
+                                asyncio.open_connection(self.host, self.port),
+                                timeout )
+            self.closed = False
+            self.task   = asyncio.ensure_future( self._read_loop() )
+
+
+    async def _read_loop(self):
+
+        try:
+            while True:
+
+                line = await self.reader.readline()
+                if not line:
+                    break
+
+                fut = self.pending.popleft()
+                # a timed out call is not waiting anymore
+                if not fut.done():
+                    fut.set_result( line.decode().rstrip('\n') )
+
+        except Exception:
+            pass
+
+        finally:
+            self.closed = True
+            while self.pending:
+                fut = self.pending.popleft()
+                if not fut.done():
+                    fut.set_exception( ConnectionError(f'{self.host}:{self.port} has closed') )
+
+
+    async def send_many(self, phrases, timeout=3):
+        """ (list of strings, raises errors)
+        """
+        if self.closed:
+            await self.connect(timeout)
+
+        loop = asyncio.get_running_loop()
+        futs = [ loop.create_future() for p in phrases ]
+        self.pending.extend(futs)
+
+        self.writer.write( ''.join( [f'{p}\n' for p in phrases] ).encode() )
+        await self.writer.drain()
+
+        return await asyncio.wait_for( asyncio.gather(*futs), timeout )
+
+
+    async def send(self, phrase, timeout=3):
+        """ (string, raises errors)
+        """
+        return (await self.send_many([phrase], timeout))[0]
+
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+        self.closed = True
+
+
+async def async_client(host, port, timeout=3):
+    """ The pooled AsyncClient for a host, for the running loop
+    """
+    key = (host, port, asyncio.get_running_loop())
+
+    if not key in ASYNC_CLIENTS:
+        ASYNC_CLIENTS[key] = AsyncClient(host, port)
+
+    cli = ASYNC_CLIENTS[key]
+
+    if cli.closed:
+        await cli.connect(timeout)
+
+    return cli
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+# This file is part of 'pAudio', a PC based personal audio system.
+
+"""
+    A tiny publish/subscribe hub for the server process.
+
+    Publishers hand over a whole dict for a topic, subscribers only receive
+    the top level keys that have changed (the delta).
+
+        publish('state', state)
+        watch_file('loudness_monitor', LDMON_PATH)    # mtime polling
+
+    Events are notified as they are, they are not kept as a topic value:
+
+        emit('events', {'type': 'level', 'value': -20.0, ...})
+
+    Subscribers can choose the topics (all by default):
+
+        snapshot = subscribe(callback, topics=None) # callback(message)
+        unsubscribe(callback)                       # from any thread
+
+    A message is a dict:
+
+        {'topic': 'state', 'data': {'level': -20.0}, 'full': False}
+
+    'full' messages carry the whole topic dict (used for the initial snapshot).
+"""
+
+import  os
+import  json
+import  copy
+import  threading
+from    time import sleep
+
+
+# Polling period for watched files (seconds)
+POLL_PERIOD = 0.1
+
+# The last published value for each topic
+TOPICS      = {}
+
+# Subscribers callbacks {callback: topics or None}
+SUBSCRIBERS = {}
+
+# Watched files {topic: [path, mtime_ns]}
+WATCHED     = {}
+
+LOCK        = threading.RLock()
+WATCHER     = None
+
+
+def delta(old, new):
+    """ The top level keys of `new` which differ from `old`
+        (removed keys are given as None)
+    """
+    d = {k: v for k, v in new.items() if k not in old or old[k] != v}
+
+    for k in old:
+        if k not in new:
+            d[k] = None
+
+    return d
+
+
+def publish(topic, data):
+    """ Updates a topic, then notifies its delta if any
+    """
+    with LOCK:
+
+        data = copy.deepcopy(data)
+        old  = TOPICS.get(topic, {})
+        d    = delta(old, data)
+        TOPICS[topic] = data
+
+        if d:
+            _notify( {'topic': topic, 'data': d, 'full': False} )
+
+
+def emit(topic, data):
+    """ Notifies an event
+    """
+    with LOCK:
+        _notify( {'topic': topic, 'data': copy.deepcopy(data), 'full': False} )
+
+
+def _notify(msg):
+
+    for callback, topics in SUBSCRIBERS.items():
+
+        if topics and not msg['topic'] in topics:
+            continue
+
+        try:
+            callback(msg)
+        except Exception as e:
+            print(f'(pubsub) subscriber error: {str(e)}')
+
+
+def snapshot(topics=None):
+    """ Full messages for all topics, or for the given ones
+        (list)
+    """
+    with LOCK:
+        return [ {'topic': t, 'data': copy.deepcopy(d), 'full': True}
+                 for t, d in TOPICS.items() if not topics or t in topics ]
+
+
+def subscribe(callback, topics=None):
+    """ Registers a callback(message) for the given topics (default all),
+        returns the current snapshot
+        (list of messages)
+    """
+    # (i) no file reads here, it is called from the server event loop,
+    #     the watched files are kept up to date by the watcher thread
+    with LOCK:
+        SUBSCRIBERS[callback] = topics
+        return snapshot(topics)
+
+
+def unsubscribe(callback):
+    with LOCK:
+        SUBSCRIBERS.pop(callback, None)
+
+
+def _poll_files():
+
+    for topic, (path, mtime) in list(WATCHED.items()):
+
+        try:
+            new_mtime = os.stat(path).st_mtime_ns
+        except:
+            continue
+
+        if new_mtime == mtime:
+            continue
+
+        try:
+            with open(path, 'r') as f:
+                data = json.loads(f.read())
+        except:
+            # maybe half written, will retry on next poll
+            continue
+
+        WATCHED[topic][1] = new_mtime
+
+        publish(topic, data)
+
+
+def _watch_loop():
+    """ Polls even if nobody is subscribed, so a new subscriber gets
+        an up to date snapshot (only a stat() per file if unchanged)
+    """
+    while True:
+        _poll_files()
+        sleep(POLL_PERIOD)
+
+
+def watch_file(topic, path):
+    """ A json file to be published when it changes (mtime polling)
+    """
+    global WATCHER
+
+    WATCHED[topic] = [path, 0]
+
+    if WATCHER is None:
+        WATCHER = threading.Thread(target=_watch_loop, daemon=True)
+        WATCHER.start()
@@ -9,6 +9,24 @@
 
     Usage:      remote_volume_daemon.py   start | stop
 
+    The level changes are received as typed events from the pAudio
+    server subscription ('subscribe events', see paudio.py)
+
+    Remotes are probed and updated concurrently. Optional config.yml:
+
+        remote_volume:
+            networks:   [192.168.1.32/27]   # CIDR ranges to scan
+            port:       9980                # remotes pAudio port
+            timeout:    0.5                 # per remote (seconds)
+            source_ttl: 10                  # remotes source caching (seconds)
+            multicast:                      # see level_sync.py
+                group:      239.255.98.1
+                port:       9996
+
+    With 'multicast', the level changes are sent as datagrams to the
+    remotes running 'level_sync.py listen', instead of probing and
+    updating every remote. No remotes scanning is needed then.
+
     NOTE:
     A newcoming remote listener machine will need to send 'hello'
     to this daemon at port <paudio_port> + 5 (usually 9995)
@@ -16,10 +34,11 @@
 """
 
 from    subprocess import Popen
-from    time import time
+from    time import sleep, time
+from    concurrent.futures import ThreadPoolExecutor, wait
 import  socket
-from    watchdog.observers import Observer
-from    watchdog.events import FileSystemEventHandler
+import  threading
+import  ipaddress
 import  sys
 import  os
 import  json
@@ -28,164 +47,284 @@ UHOME           = os.path.expanduser("~")
 sys.path.append( f'{UHOME}/pAudio/code/share' )
 
 import  server
-from    common  import CONFIG, USER, send_cmd, read_json_file, read_last_line
-
-LOG_DIR         = f'{UHOME}/pAudio/log'
-CMD_LOG_PATH    = f'{LOG_DIR}/paudio_cmd.log'
+import  paudio_client
+from    common  import CONFIG, USER, read_json_file
 
 
 # ------------- USER CONFIG --------------
-# x.x.x.RANGE
+# x.x.x.RANGE (if not any config.yml remote_volume networks)
 REMOTES_ADDR_RANGE = range(40, 59)
 # ----------------------------------------
 
+RCONFIG         = CONFIG.get('remote_volume') or {}
+REMOTES_PORT    = RCONFIG.get('port', CONFIG.get('paudio_port', 9980))
+TIMEOUT         = RCONFIG.get('timeout', 0.5)
+SOURCE_TTL      = RCONFIG.get('source_ttl', 10)
 
-# Generic handler from 'watchdog' for doing actions when a file change occurs
-class file_event_handler(FileSystemEventHandler):
-    """ Will do something when a <fname> change occurs
-    """
-    # (i) This is an inherited class from the imported one 'FileSystemEventHandler',
-    #     which provides the 'event' propiertie.
-    #     Here we expand the class with our custom parameters:
-    #     'fname' and wanted 'action'
-
-    def __init__(self, fname, action, antibound=True):
-        self.fname      = fname
-        self.action     = action
-        self.antibound  = antibound
-        self.ts         = time()
-
-    def on_modified(self, event):
-        # DEBUG
-        #print( f'(i) event type: {event.event_type}, file: {event.src_path}' )
-        if event.src_path == self.fname:
-            if self.antibound:
-                if (time() - self.ts) > .1:
-                    globals()[self.action]()
-                self.ts = time()
-            else:
-                    globals()[self.action]()
-
-
-def get_remote_selected_source(addr, port=9990, timeout=0.5):
+# Concurrent remotes probing and updating
+POOL            = ThreadPoolExecutor(max_workers=32)
+
+# Remotes last known selected source {addr: (source, timestamp)}
+SOURCES_CACHE   = {}
+
+MULTICAST       = bool( RCONFIG.get('multicast') )
+
+if MULTICAST:
+    import  level_sync
+    SYNC_SOCK   = level_sync.sender_socket()
+    SYNC_LOCK   = threading.Lock()
+    SYNC_SEQ    = 0
+    # the last datagram sent, periodically repeated
+    SYNC_LAST   = b''
+    # the master level settings, updated from the events
+    LEVELS      = {}
+
+
+def get_remote_selected_source(addr, port=REMOTES_PORT, timeout=TIMEOUT):
     """ Gets the selected source from a remote pAudio server at <addr:port>
         (string)
     """
-    remote_source = ''
+    remote_source = paudio_client.get('source', host=addr, port=port,
+                                      timeout=timeout, offline='')
+
+    # former pe.audio.sys project: 'source' was 'input'
+    # (only if the host did answer, an offline one would cost twice)
+    if remote_source is None:
+        remote_source = paudio_client.get('input', host=addr, port=port,
+                                          timeout=timeout)
+
+    return remote_source or ''
+
+
+def get_state():
+    """ The level settings from the pAudio server, the state file could
+        lag behind (it is saved in background). The file is used only if
+        the server is not reachable.
+        (dict)
+    """
+    state = paudio_client.send( 'get_state level lu_offset equal_loudness',
+                                host='localhost', port=CONFIG['paudio_port'],
+                                timeout=TIMEOUT )
     try:
-        tmp  = send_cmd('state', host=addr, port=port, timeout=timeout)
+        return json.loads(state)
+    except json.JSONDecodeError:
+        return read_json_file(f'{UHOME}/pAudio/.preamp_state')
+
+
+def is_listening(addr, use_cache=True):
+    """ The remote is listening to a source named *remote*.
+        The remote source is cached for SOURCE_TTL seconds.
+        (bool)
+    """
+    cached = SOURCES_CACHE.get(addr)
 
-        if not tmp.startswith('{') or not tmp.endswith('}'):
-            return remote_source
+    if use_cache and cached and time() - cached[1] < SOURCE_TTL:
+        source = cached[0]
 
-        remote_state  = json.loads(tmp)
+    else:
+        source = get_remote_selected_source(addr)
+        SOURCES_CACHE[addr] = (source, time())
 
-        # former pe.audio.sys project: 'source' was 'input'
-        remote_source = remote_state.get('source', '')
-        if not remote_source:
-            remote_source = remote_state.get('input', '')
+    return 'remote' in source.lower()
 
-    except Exception as e:
-        print(f'(remote_volume.get_remote_selected_source) Exception: {str(e)}')
 
-    return remote_source
+def run_parallel(func, addrs):
+    """ Runs func(addr) concurrently for the given addresses
+        (dict {addr: result})
+    """
+    jobs = { POOL.submit(func, addr): addr for addr in addrs }
 
+    wait(jobs)
 
-def get_state():
-    return read_json_file(f'{UHOME}/pAudio/.preamp_state')
+    results = {}
+    for job, addr in jobs.items():
+        try:
+            results[addr] = job.result()
+        except Exception as e:
+            print( f'(remote_volume) {addr}: {str(e)}' )
 
+    return results
 
-def detect_remotes():
-    """ list of remote IPs listening to a source named *remote*
+
+def scan_addresses():
+    """ The addresses where to look for remotes
     """
-    clients = []
+    addrs = []
 
-    for n in REMOTES_ADDR_RANGE:
+    if RCONFIG.get('networks'):
+        for net in RCONFIG["networks"]:
+            addrs += [ str(a) for a in
+                       ipaddress.ip_network(net, strict=False).hosts() ]
 
-        addr_list = my_ip.split('.')
-        addr_list[-1] = str(n)
-        addr = '.'.join( addr_list )
+    else:
+        prefix = my_ip.rsplit('.', 1)[0]
+        addrs = [ f'{prefix}.{n}' for n in REMOTES_ADDR_RANGE ]
 
-        if addr == my_ip:
-            continue
+    return [ a for a in dict.fromkeys(addrs) if a != my_ip ]
 
-        if 'remote' in get_remote_selected_source(addr).lower():
-            clients.append(addr)
 
-    return clients
+def detect_remotes():
+    """ list of remote IPs listening to a source named *remote*
+    """
+    addrs = scan_addresses()
+
+    found = run_parallel( lambda addr: is_listening(addr, use_cache=False),
+                          addrs )
+
+    return [ a for a in addrs if found.get(a) ]
 
 
 def remote_send_cmd(cli_addr, cmd):
     print( f'(remote_volume) remote {cli_addr} sending \'{cmd}\'' )
-    send_cmd( cmd, host=cli_addr, verbose=False )
+    paudio_client.send( cmd, host=cli_addr, port=REMOTES_PORT, timeout=TIMEOUT )
 
 
 def remote_update_levels(rem_addr):
-    level           = get_state()["level"]
-    lu_offset       = get_state()["lu_offset"]
-    equal_loudness  = get_state()["equal_loudness"]
-    remote_send_cmd(rem_addr, f'lu_offset {lu_offset}')
-    remote_send_cmd(rem_addr, f'loudness {equal_loudness}')
-    remote_send_cmd(rem_addr, f'level {level}')
+    state           = get_state()
+    level           = state["level"]
+    lu_offset       = state["lu_offset"]
+    equal_loudness  = state["equal_loudness"]
+    cmds            = [ f'lu_offset {lu_offset}',
+                        f'loudness {equal_loudness}',
+                        f'level {level}' ]
+    print( f'(remote_volume) remote {rem_addr} sending {cmds}' )
+    # pipelined in a single round trip
+    paudio_client.send_many( cmds, host=rem_addr, port=REMOTES_PORT,
+                             timeout=TIMEOUT )
+
+
+def multicast_levels(delta=None):
+    """ Sends the level settings datagram to the remotes
+    """
+    global SYNC_SEQ, SYNC_LAST
 
+    with SYNC_LOCK:
+        SYNC_SEQ += 1
+        SYNC_LAST = level_sync.pack(SYNC_SEQ, LEVELS, delta)
+        SYNC_SOCK.sendto( SYNC_LAST, (level_sync.GROUP, level_sync.PORT) )
 
-# The action triggered by the observer
-def relay_level_changes():
-    """ Notice that only relative level changes will be relayed
+    print( f'(remote_volume) multicast #{SYNC_SEQ}: {LEVELS} delta: {delta}' )
+
+
+def multicast_repeat_loop():
+    """ Repeats the last datagram, so that lost ones are recovered
+    """
+    while True:
+        sleep(level_sync.REPEAT)
+        with SYNC_LOCK:
+            if SYNC_LAST:
+                SYNC_SOCK.sendto( SYNC_LAST, (level_sync.GROUP, level_sync.PORT) )
+
+
+def fan_out(action):
+    """ Runs action(addr) concurrently for the remotes still listening to us,
+        the ones not listening anymore are purged from the remotes list.
     """
+    def job(addr):
+        if is_listening(addr):
+            action(addr)
+            return True
+        return False
+
+    for rem_addr, listening in run_parallel(job, list(remoteClients)).items():
+
+        if not listening and rem_addr in remoteClients:
+            print( f'remote {rem_addr} not listening by now :-/' )
+            remoteClients.remove( rem_addr )
+            print( f'Updated remote listening machines: {remoteClients}' )
 
-    # Read last command from the command log file
-    tmp = read_last_line( CMD_LOG_PATH )
-    # e.g.: "2020/10/23 17:16:43; level -1 add; done"
-    last_cmd = tmp.split(';')[1].strip()
 
-    # Filtering commands:
+# The action triggered by the events subscription
+def relay_level_changes(event):
+    """ Notice that only relative level changes will be relayed
+    """
+
+    # Filtering events:
     wanted_cmd = ''
 
-    # - relative level
-    if ('level' in last_cmd and 'add' in last_cmd):
-        wanted_cmd = last_cmd
+    match event["type"]:
+
+        # - relative level
+        case 'level':
+            if event["relative"]:
+                wanted_cmd = f'level {event["delta"]} add'
 
-    # - LU_offset (usually a toggle command)
-    if ('lu_offset' in last_cmd):
-        lu_offset       = get_state()["lu_offset"]
-        wanted_cmd      = f'lu_offset {lu_offset}'
+        # - LU_offset (usually a toggle command)
+        case 'lu_offset':
+            wanted_cmd = f'lu_offset {event["value"]}'
 
-    # - equal loudness (usually a toggle command)
-    if ('loudness' in last_cmd):
-        equal_loudness  = get_state()["equal_loudness"]
-        wanted_cmd      = f'loudness {equal_loudness}'
+        # - equal loudness (usually a toggle command)
+        case 'loudness':
+            wanted_cmd = f'loudness {event["value"]}'
+
+    if MULTICAST:
+
+        key = { 'level': 'level', 'lu_offset': 'lu_offset',
+                'loudness': 'equal_loudness' }[ event["type"] ]
+        LEVELS[key] = event["value"]
+
+        if wanted_cmd:
+            multicast_levels( event["delta"] if event["type"] == 'level' else None )
+
+        return
 
     # Early return
     if not wanted_cmd:
         return
 
     # Forwarding commands to remotes
-    for rem_addr in remoteClients:
+    fan_out( lambda rem_addr: remote_send_cmd(rem_addr, wanted_cmd) )
 
-        # Checking if remote is still listening to us
-        # then updates the level event to remote
-        if 'remote' in get_remote_selected_source(rem_addr):
-            remote_send_cmd(rem_addr, wanted_cmd)
 
-        # else purge from remotes list if not listening anymore
-        else:
-            print( f'remote {rem_addr} not listening by now :-/' )
-            remoteClients.remove( rem_addr )
-            print( f'Updated remote listening machines: {remoteClients}' )
+def events_loop():
+    """ Subscribes to the pAudio server events, reconnecting if needed.
+        If some event is lost, the whole level settings are broadcasted.
+    """
+    last_seq    = None
+    reconnect   = False
+
+    while True:
+
+        try:
+            with socket.create_connection( ('localhost', CONFIG['paudio_port']) ) as s:
+
+                s.sendall( b'subscribe events\n' )
+                print( f'(remote_volume) subscribed to pAudio events' )
+
+                # events could be missed while disconnected
+                if reconnect:
+                    broadcast_level_settings()
+                reconnect = True
+
+                for line in s.makefile('r'):
+
+                    event = json.loads(line)["data"]
+
+                    if last_seq is not None and event["seq"] != last_seq + 1:
+                        print( f'(remote_volume) some events were lost' )
+                        broadcast_level_settings()
+                    else:
+                        relay_level_changes(event)
+
+                    last_seq = event["seq"]
+
+        except Exception as e:
+            print( f'(remote_volume) events subscription: {str(e)}' )
+
+        # the server could be restarting
+        last_seq = None
+        sleep(1)
 
 
 # Broadcast level settings to all remote machines
 def broadcast_level_settings():
 
-    for rem_addr in remoteClients:
+    if MULTICAST:
+        LEVELS.update( get_state() )
+        multicast_levels()
+        return
 
-        if 'remote' in get_remote_selected_source(rem_addr):
-            remote_update_levels(rem_addr)
-        else:
-            print( f'remote {rem_addr} not listening by now :-/' )
-            remoteClients.remove( rem_addr )
-            print( f'Updated remote listening machines: {remoteClients}' )
+    fan_out( remote_update_levels )
 
 
 # The action called from our instance of <server.py> when receiving messages.
@@ -199,6 +338,8 @@ def do(cmd):
     if cmd == 'hello':
         if cli_addr != my_ip and '127.0.' not in cli_addr:
             print( f'(remote_volume) Received hello from: {cli_addr}' )
+            # it has just selected the remote source
+            SOURCES_CACHE[cli_addr] = ('remote', time())
             if cli_addr not in remoteClients:
                 # updating new client into remote clients list
                 remoteClients.append(cli_addr)
@@ -238,28 +379,25 @@ if __name__ == "__main__":
     # Retrieving basic data for this to work
     my_hostname     = socket.gethostname()
     my_ip           = socket.gethostbyname(f'{my_hostname}.local')
-    remoteClients   = detect_remotes()
-    print( f'(remote_volume) Detected {len(remoteClients)} '
-           f'remote listening machines: {remoteClients}' )
+
+    if MULTICAST:
+        remoteClients = []
+        print( f'(remote_volume) multicasting level changes to '
+               f'{level_sync.GROUP}:{level_sync.PORT}' )
+        if level_sync.REPEAT:
+            threading.Thread(target=multicast_repeat_loop, daemon=True).start()
+
+    else:
+        remoteClients = detect_remotes()
+        print( f'(remote_volume) Detected {len(remoteClients)} '
+               f'remote listening machines: {remoteClients}' )
 
     # Broadcast level settings to remote clients
     print( f'(remote_volume) broadcast level settings to remotes ...' )
     broadcast_level_settings()
 
-    #   WATCHDOG to observe file changes
-    #   https://watchdog.readthedocs.io/en/latest/
-    #   https://stackoverflow.com/questions/18599339/
-    #   python-watchdog-monitoring-file-for-changes
-    #   Use recursive=True to observe also subfolders
-    #   Even observing recursively the CPU load is negligible,
-    #   but we prefer to observe to a single folder.
-    observer = Observer()
-    observer.schedule( file_event_handler(  fname=CMD_LOG_PATH,
-                                            action='relay_level_changes',
-                                            antibound=True ),
-                                            path=LOG_DIR,
-                                            recursive=False )
-    observer.start()
+    # Level events from the pAudio server
+    threading.Thread(target=events_loop, daemon=True).start()
 
     print( f'(remote_volume) Keep relaying level changes to remotes ...' )
 
@@ -6,11 +6,26 @@
 """
     A general purpose TCP server to run a processing module
 
-    Usage:   server.py  <processing_module>  <address>  <port> [-v]
+    Usage:   server.py  <processing_module>  <address>  <port> [-v] [-a]
 
     e.g:     server.py  peaudiosys localhost 9990
 
     (use -v for VERBOSE debug info printout)
+
+    (use -a for the asyncio mode: concurrent clients, persistent connections
+     and newline framed commands)
+
+    asyncio mode answers are a single line: a multi line JSON answer is
+    compacted (same JSON value), any other multi line answer (plain text,
+    not issued by the pAudio services) is flattened joining its lines
+    with spaces.
+
+    asyncio mode answers 'asyncio' to the 'server_mode' phrase, so clients
+    can tell it keeps the connection open (see paudio_client.py)
+
+    asyncio mode also accepts the 'subscribe [topic ...]' command, then the
+    connection becomes a stream of newline terminated JSON messages as
+    published by the processing module, see pubsub.py
 """
 
 # UNDERSTANDING A SERVER:
@@ -22,9 +37,13 @@
 # to accept new connections. So two sockets are playing at the same time.
 
 import  socket
+import  asyncio
+import  json
 import  os
 import  sys
+import  signal
 from    fmt import Fmt
+import  pubsub
 UHOME = os.path.expanduser("~")
 
 
@@ -35,6 +54,15 @@ MODULEFOLDER = f'{UHOME}/pAudio/code'
 SERVICE = ''
 CLIADDR = ('', 0)
 
+# asyncio mode: a client sending a command phrase without the trailing
+# newline is considered a legacy one-shot client, so it will be answered
+# and closed after this idle time (seconds).
+LEGACY_IDLE = 0.1
+
+# asyncio mode: pending messages for a subscriber, if exceeded
+# the subscriber will receive a full snapshot instead.
+SUBS_QUEUE_SIZE = 100
+
 
 def handle_client(srv):
 
@@ -75,6 +103,190 @@ def run_server(addr, port):
         handle_client(srv)
 
 
+def is_read_only(cmd):
+    """ The processing module can tell us which commands do not modify
+        anything, so they can be attended concurrently.
+        Otherwise ALL commands will be serialized.
+        (bool)
+    """
+    tester = getattr(PROCESSOR_MOD, 'is_read_only', None)
+
+    if not tester:
+        return False
+
+    try:
+        return tester(cmd)
+    except:
+        return False
+
+
+async def process_cmd_async(cmd, cliaddr):
+    """ Read-only commands run concurrently in the loop's thread pool,
+        any other command is serialized into PROCESSOR_MOD.do()
+    """
+    global CLIADDR
+
+    loop = asyncio.get_running_loop()
+
+    if is_read_only(cmd):
+        return await loop.run_in_executor(None, PROCESSOR_MOD.do, cmd)
+
+    async with DO_LOCK:
+        CLIADDR = cliaddr
+        return await loop.run_in_executor(None, PROCESSOR_MOD.do, cmd)
+
+
+async def stream_events(reader, writer, topics=None):
+    """ Sends the published messages to a subscribed client
+        until it disconnects
+    """
+
+    loop  = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=SUBS_QUEUE_SIZE)
+
+    def enqueue(msg):
+        # A slow client will be resynchronized with a snapshot
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            msg = None
+        queue.put_nowait(msg)
+
+    def on_message(msg):
+        # called from any publisher thread
+        loop.call_soon_threadsafe(enqueue, msg)
+
+    messages = pubsub.subscribe(on_message, topics)
+
+    async def wait_eof():
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+
+    # Anything received from the client is ignored, but EOF ends the stream
+    eof = asyncio.ensure_future( wait_eof() )
+
+    try:
+        while True:
+
+            for msg in messages:
+                writer.write( json.dumps(msg).encode() + b'\n' )
+            await writer.drain()
+
+            get = asyncio.ensure_future( queue.get() )
+            await asyncio.wait( {get, eof}, return_when=asyncio.FIRST_COMPLETED )
+
+            if eof.done():
+                get.cancel()
+                break
+
+            msg = get.result()
+            messages = [msg] if msg else pubsub.snapshot(topics)
+
+    finally:
+        pubsub.unsubscribe(on_message)
+        eof.cancel()
+
+
+def single_line(result):
+    """ A newline framed answer (see the module docstring)
+    """
+    if '\n' not in result:
+        return result
+
+    try:
+        return json.dumps( json.loads(result) )
+    except ValueError:
+        return ' '.join( result.split() )
+
+
+async def handle_client_async(reader, writer):
+    """ A persistent connection: newline framed command phrases of
+        any length, one newline terminated answer for each one.
+    """
+
+    cliaddr = writer.get_extra_info('peername')
+    buff    = b''
+
+    try:
+
+        while True:
+
+            # A pending phrase w/o newline means a legacy one-shot client,
+            # e.g. <send_cmd> from older pAudio versions.
+            if buff:
+                try:
+                    chunk = await asyncio.wait_for(reader.read(4096), LEGACY_IDLE)
+                except asyncio.TimeoutError:
+                    chunk = None
+            else:
+                chunk = await reader.read(4096)
+
+            # EOF or legacy client: process the remaining phrase then close.
+            if not chunk:
+                cmd = buff.decode().strip()
+                if cmd:
+                    result = await process_cmd_async(cmd, cliaddr)
+                    writer.write( result.encode() )
+                    await writer.drain()
+                break
+
+            buff += chunk
+
+            while b'\n' in buff:
+
+                line, buff = buff.split(b'\n', 1)
+                cmd = line.decode().strip()
+                if not cmd:
+                    continue
+
+                if VERBOSE:
+                    print( f'(server-{SERVICE}) Rx: {cmd}' )
+
+                # The connection is dedicated to the subscription from now on
+                if cmd.split()[0] == 'subscribe':
+                    await stream_events(reader, writer, cmd.split()[1:] or None)
+                    break
+
+                # The connection will be kept open
+                if cmd == 'server_mode':
+                    writer.write( b'asyncio\n' )
+                    await writer.drain()
+                    continue
+
+                result = await process_cmd_async(cmd, cliaddr)
+
+                # The answer must be a single line
+                writer.write( single_line(result).encode() + b'\n' )
+                await writer.drain()
+
+                if VERBOSE:
+                    print( f'(server-{SERVICE}) Tx: {result}' )
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+
+    except Exception as e:
+        print( f'{Fmt.RED}(server-{SERVICE}) {cliaddr}: {str(e)}{Fmt.END}' )
+
+    finally:
+        writer.close()
+
+
+async def run_server_async(addr, port):
+
+    global DO_LOCK
+
+    # Serializes the command phrases that are not read-only
+    DO_LOCK = asyncio.Lock()
+
+    srv = await asyncio.start_server(handle_client_async, addr, port,
+                                     reuse_address=True)
+    async with srv:
+        await srv.serve_forever()
+
+
 if __name__ == "__main__":
 
     try:
@@ -89,6 +301,15 @@ if __name__ == "__main__":
     else:
         VERBOSE = False
 
+    if '-a' in sys.argv:
+        ASYNC_MODE = True
+    else:
+        ASYNC_MODE = False
+
+    # A regular exit on TERM, so that the processing module atexit
+    # handlers can run (e.g. to save pending state)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     # Importing the service module to be used later when processing commands
     # https://python-reference.readthedocs.io/en/latest/docs/functions/__import__.html
     sys.path.append( MODULEFOLDER )
@@ -96,4 +317,8 @@ if __name__ == "__main__":
 
     print( f'{Fmt.MAGENTA}(server.py) Loading \'{SERVICE}.py\' module, '
            f'listening at {ADDR}:{PORT} ...{Fmt.END}' )
-    run_server( ADDR, PORT )
+
+    if ASYNC_MODE:
+        asyncio.run( run_server_async( ADDR, PORT ) )
+    else:
+        run_server( ADDR, PORT )
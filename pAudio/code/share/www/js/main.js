@@ -43,7 +43,7 @@ var state               = {};       // The preamp-convolver state
 var player_info         = {};
 
 var aux_info            = { 'amp': 'n/a',
-                            'loudness_monitor': {'LU_I': 0, 'LU_M': 0, 'scope': 'track' },
+                            'loudness_monitor': {'LU_I': 0, 'LU_M': 0, 'LU_S': 0, 'LRA': 0, 'scope': 'track' },
                             'last_macro': '',
                             'warning': ''
 };
@@ -77,8 +77,11 @@ var metablank           = {         // A player's metadata blank dict
 var server_available    = false;
 var show_advanced       = false;    // defaults for display advanced controls
 var hide_graphs         = true;     // defaults for displaying graphs
+var events_live         = false;    // state and aux_info are pushed by the server
 
 var last_eq_params      = {};       // To evaluate if eq curve changed
+var last_eq_version     = -1;       // The last eq curve drawn on canvas
+var last_eq_graph_ver   = 0;        // The last server side eq.png graph version
 var last_drc            = '';       // To evaluate if drc changed
 var last_disc           = '';       // Helps on refreshing cd tracks list
 var last_input          = '';       // Helps on refreshing sources playlits
@@ -395,6 +398,9 @@ function init(){
     // SCHEDULES THE PAGE_UPDATE (only runtime variable items)
     setInterval( page_update, AUTO_UPDATE_INTERVAL );
 
+    // Pushed updates if available, page_update will poll otherwise
+    events_subscribe();
+
     // Alert user
     setTimeout(init_alert, 3000)
 
@@ -667,13 +673,23 @@ function page_update() {
 
 
         if ( hide_graphs == false ) {
-        // The temporary 'new_eq_graph' flag helps on slow machines because the new PNG graph
+        // The 'eq_graph_version' helps on slow machines because the new PNG graph
         // can take a while after the 'done' is received when issuing some audio command.
-            if (eq_changed() == true || aux_info.new_eq_graph == true) {
-                // Artifice to avoid using cached image by adding an offset timestamp
-                // inside the  http.GET image source request
-                document.getElementById("eq_img").src = 'images/eq.png?'
-                                                          + Math.floor(Date.now());
+            let new_eq_graph = false;
+            if ( aux_info.eq_graph_version !== undefined &&
+                 aux_info.eq_graph_version !== last_eq_graph_ver ) {
+                last_eq_graph_ver = aux_info.eq_graph_version;
+                new_eq_graph = true;
+            }
+            if (eq_changed() == true || new_eq_graph == true) {
+                // The eq curve is drawn here if the server provides it,
+                // otherwise the server side PNG graph will be used.
+                if ( eq_canvas_update() == false ) {
+                    // Artifice to avoid using cached image by adding an offset timestamp
+                    // inside the  http.GET image source request
+                    document.getElementById("eq_img").src = 'images/eq.png?'
+                                                              + Math.floor(Date.now());
+                }
             }
             if (drc_changed() == true) {
                 // Here we can use cached images because drc graphs does not change
@@ -770,11 +786,15 @@ function page_update() {
     }
 
     //// AUX STUFF
-    aux_info_get();
+    if (! events_live) {
+        aux_info_get();
+    }
     aux_info_refresh();
 
     // PREAMP STUFF
-    state_get();
+    if (! events_live) {
+        state_get();
+    }
 
     //  Cancel updating if not connected
     if (!server_available){
@@ -1210,6 +1230,132 @@ function control_cmd( cmd ) {
 }
 
 
+function eq_canvas_update() {
+    // Draws the eq curve given by the server, returns false if not available
+
+    let eq = {};
+    try{
+        eq = JSON.parse( control_cmd('preamp get_eq_response 200') );
+    }catch(e){
+        return false;
+    }
+    if ( ! eq.freq || eq.freq.length == 0 ) {
+        return false;
+    }
+
+    document.getElementById("eq_img").style.display     = 'none';
+    document.getElementById("eq_canvas").style.display  = 'block';
+
+    if ( eq.version == last_eq_version ) {
+        return true;
+    }
+    last_eq_version = eq.version;
+
+    // Same axes as the server side PNG graph (eqfir2png.py)
+    const FREQ_TICKS  = [20, 50, 100, 200, 500, 1e3, 2e3, 5e3, 1e4, 2e4];
+    const FREQ_LABELS = ['20', '50', '100', '200', '500', '1K', '2K', '5K', '10K', '20K'];
+    const DB_MIN = -9, DB_MAX = 21;
+    const DB_TICKS = [-6, 0, 6, 12, 18];
+
+    const canvas = document.getElementById("eq_canvas");
+    const ctx = canvas.getContext('2d');
+    const W = canvas.width, H = canvas.height;
+    const x0 = 30, x1 = W - 10, y0 = 15, y1 = H - 20;
+
+    function fx(f){
+        return x0 + (x1 - x0) * Math.log10(f / 20) / Math.log10(20000 / 20);
+    }
+    function fy(dB){
+        dB = Math.max(DB_MIN, Math.min(DB_MAX, dB));
+        return y1 - (y1 - y0) * (dB - DB_MIN) / (DB_MAX - DB_MIN);
+    }
+
+    ctx.fillStyle = 'rgb(38, 38, 38)';
+    ctx.fillRect(0, 0, W, H);
+
+    ctx.font = '9px sans-serif';
+    ctx.fillStyle = 'white';
+    ctx.strokeStyle = 'white';
+    ctx.lineWidth = 1;
+    ctx.strokeRect(x0, y0, x1 - x0, y1 - y0);
+    ctx.textAlign = 'center';
+    ctx.fillText('EQ', (x0 + x1) / 2, 10);
+    for (let i = 0; i < FREQ_TICKS.length; i++) {
+        ctx.fillText(FREQ_LABELS[i], fx(FREQ_TICKS[i]), H - 6);
+    }
+    ctx.textAlign = 'right';
+    for (const dB of DB_TICKS) {
+        ctx.fillText(dB.toString(), x0 - 4, fy(dB) + 3);
+    }
+
+    ctx.strokeStyle = 'grey';
+    ctx.lineWidth = 3;
+    ctx.beginPath();
+    for (let i = 0; i < eq.freq.length; i++) {
+        if (eq.freq[i] < 20) {
+            continue;
+        }
+        ctx.lineTo( fx(eq.freq[i]), fy(eq.mag[i]) );
+    }
+    ctx.stroke();
+
+    return true;
+}
+
+
+function events_subscribe() {
+    // Server-sent events with the preamp state, aux info and loudness
+    // monitor changes. EventSource reconnects by itself if the stream fails.
+
+    if ( typeof(EventSource) == 'undefined' ) {
+        return;
+    }
+
+    const source = new EventSource('/events');
+
+    source.onmessage = function(ev) {
+        let msg = {};
+        try{
+            msg = JSON.parse(ev.data);
+        }catch(e){
+            return;
+        }
+
+        switch (msg.topic) {
+            case 'state':
+                state = msg.full ? msg.data : Object.assign(state, msg.data);
+                break;
+            case 'aux_info':
+                // loudness_monitor is pushed apart
+                const ldmon = aux_info.loudness_monitor;
+                aux_info = msg.full ? msg.data : Object.assign(aux_info, msg.data);
+                aux_info.loudness_monitor = ldmon;
+                break;
+            case 'loudness_monitor':
+                aux_info.loudness_monitor = msg.full ? msg.data
+                                : Object.assign(aux_info.loudness_monitor, msg.data);
+                break;
+            default:
+                return;
+        }
+
+        // Polling is resumed until the state is received
+        if (msg.topic == 'state' && msg.full) {
+            events_live = true;
+            server_available = true;
+        }
+
+        if (events_live) {
+            page_update();
+        }
+    };
+
+    source.onerror = function() {
+        events_live = false;
+    };
+}
+
+
 function state_get() {
     try{
         state = JSON.parse( control_cmd('preamp state') );
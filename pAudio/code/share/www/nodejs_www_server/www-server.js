@@ -204,6 +204,78 @@ function onHttpReq( httpReq, httpRes ){
         http_serve_file(fpath);
     }
 
+    // Server-sent events: relays the pAudio subscription stream
+    // (newline terminated JSON messages) to the browser
+    else if (httpReq.url === '/events') {
+
+        httpRes.writeHead(200, {'Content-Type':     'text/event-stream',
+                                'Cache-Control':    'no-cache',
+                                'Connection':       'keep-alive'});
+
+        const client = net.createConnection( { port:PA_PORT,
+                                               host:PA_ADDR } );
+        let buff = '';
+
+        client.on('error', function(err){
+            httpRes.end();
+            client.destroy();
+            console.log( FgRed, '(node) events: cannot connect to pAudio at '
+                         + PA_ADDR + ':' + PA_PORT, Reset );
+        });
+
+        client.write( 'subscribe state aux_info loudness_monitor\n' );
+
+        client.on('data', (data) => {
+            buff += data.toString();
+            const lines = buff.split('\n');
+            buff = lines.pop();
+            for (const line of lines){
+                if (line){
+                    httpRes.write('data: ' + line + '\n\n');
+                }
+            }
+        });
+
+        client.on('end', () => {
+            httpRes.end();
+        });
+
+        // The browser has gone
+        httpReq.on('close', () => {
+            client.destroy();
+        });
+
+        if (verbose) console.log( FgGreen, '(node) events subscription', Reset );
+    }
+
+    // Commands latency metrics for a Prometheus scraper
+    else if (httpReq.url === '/metrics') {
+
+        const client = net.createConnection( { port:PA_PORT,
+                                               host:PA_ADDR } );
+        let buff = '';
+
+        client.on('error', function(err){
+            httpRes.writeHead(503, {'Content-Type': 'text/plain'});
+            httpRes.end();
+            client.destroy();
+        });
+
+        client.write( 'aux metrics prometheus\n' );
+
+        client.on('data', (data) => {
+            buff += data.toString();
+            if (buff.endsWith('\n')){
+                client.end();
+                // the text comes as a JSON string
+                httpRes.writeHead(200, {'Content-Type':
+                                        'text/plain; version=0.0.4'});
+                httpRes.write( JSON.parse(buff) );
+                httpRes.end();
+            }
+        });
+    }
+
     // A query for the server side (url = ....?command=....)
     else if (httpReq.url.match(/\?command=/g)){
 
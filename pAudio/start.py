@@ -170,6 +170,30 @@ def load_loudness_monitor_daemon(mode='start'):
         sp.Popen(tmp, shell=True)
 
 
+def load_level_sync_listener(mode='start'):
+    """ Multiroom level synchronization by multicast, if configured
+    """
+
+    if not (CONFIG.get('remote_volume') or {}).get('multicast'):
+        return
+
+    if mode == 'stop':
+
+        if not process_is_running('level_sync.py listen'):
+            return
+
+        print(f'{Fmt.GRAY}(start) Stopping level_sync.py{Fmt.END}')
+
+        tmp = f'python3 {MAINFOLDER}/code/share/level_sync.py stop'
+        sp.Popen(tmp, shell=True)
+
+    else:
+        print(f'{Fmt.GRAY}(start) Running level_sync.py listener in background ...{Fmt.END}')
+
+        tmp = f'python3 {MAINFOLDER}/code/share/level_sync.py listen'
+        sp.Popen(tmp, shell=True)
+
+
 def start_zita_link():
     """ A LAN audio connection based on zita-njbridge from Fons Adriaensen.
 
@@ -262,6 +286,9 @@ def stop():
     # The loudness_monitor daemon
     load_loudness_monitor_daemon(mode='stop')
 
+    # The multiroom level sync listener
+    load_level_sync_listener(mode='stop')
+
     # Plugins (stand-alone processes)
     run_plugins(mode='stop')
 
@@ -278,7 +305,14 @@ def stop():
         sp.call('pkill -KILL jackd', shell=True)
 
     # server.py (be careful with trailing space in command line below)
-    sp.call('pkill -KILL -f "server.py paudio "', shell=True)
+    # TERM let it save the pending state, KILL if it does not finish.
+    sp.call('pkill -TERM -f "server.py paudio "', shell=True)
+    tries = 20
+    while tries and process_is_running('server.py paudio '):
+        sleep(.1)
+        tries -= 1
+    if tries == 0:
+        sp.call('pkill -KILL -f "server.py paudio "', shell=True)
 
     # Node.js web server
     # ---
@@ -291,7 +325,8 @@ def start():
 
     # The stand-alone control server
     if not process_is_running('paudio_ctrl'):
-        srv_cmd = f'python3 {MAINFOLDER}/code/share/server.py paudio_ctrl {ADDR} {CTRL_PORT}'
+        # asyncio mode, so that clients can keep the connection
+        srv_cmd = f'python3 {MAINFOLDER}/code/share/server.py paudio_ctrl {ADDR} {CTRL_PORT} -a'
         sp.Popen(srv_cmd, shell=True)
 
     else:
@@ -318,7 +353,8 @@ def start():
 
     # Run the pAudio main server to listen for commands
     # This INCLUDES running CamillaDSP
-    srv_cmd = f'python3 {MAINFOLDER}/code/share/server.py paudio {ADDR} {PORT}'
+    # (i) asyncio mode (-a) for concurrent clients and persistent connections
+    srv_cmd = f'python3 {MAINFOLDER}/code/share/server.py paudio {ADDR} {PORT} -a'
 
     if verbose:
         srv_cmd += ' -v'
@@ -342,6 +378,9 @@ def start():
     # The loudness_monitor daemon
     load_loudness_monitor_daemon()
 
+    # The multiroom level sync listener
+    load_level_sync_listener()
+
     # Plugins (stand-alone processes)
     run_plugins()
 
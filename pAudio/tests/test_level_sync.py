@@ -0,0 +1,147 @@
+"""
+    level_sync datagrams on loopback, from the master sender socket to a
+    listener socket, through level_sync.receive():
+
+    - in order datagrams apply the relative level deltas
+
+    - a dropped sequence number falls back to the absolute level
+
+    - repeated or stale datagrams are ignored
+
+    - a restarted master (new id) starts again by the absolute level
+"""
+
+import  os
+import  sys
+import  tempfile
+import  pytest
+
+# level_sync reads ~/pAudio/config.yml when imported
+HOME = tempfile.mkdtemp()
+os.makedirs( f'{HOME}/pAudio/loudspeakers' )
+with open( f'{HOME}/pAudio/config.yml', 'w' ) as f:
+    f.write( 'remote_volume:\n'
+             '    multicast:\n'
+             '        group:      239.255.98.1\n'
+             '        port:       19996\n'
+             '        interface:  127.0.0.1\n'
+             '        repeat:     0\n' )
+
+_home = os.environ['HOME']
+os.environ['HOME'] = HOME
+
+sys.path.append( os.path.join( os.path.dirname(__file__), '../code/share' ) )
+
+import  level_sync as ls
+
+os.environ['HOME'] = _home
+
+
+STATE = {'level': -20.0, 'lu_offset': 6, 'equal_loudness': True}
+
+
+@pytest.fixture
+def link(monkeypatch):
+    """ (send, receive) on loopback, listening to the master
+    """
+    monkeypatch.setattr( ls, 'listening_to', lambda addr, port: True )
+
+    tx = ls.sender_socket()
+    rx = ls.listener_socket()
+    rx.settimeout(2)
+
+    last = {}
+
+    def send(seq, level=-20.0, delta=None, sender_id=None):
+        msg = ls.pack( seq, dict(STATE, level=level), delta )
+        if sender_id:
+            msg = msg.replace( str(ls.SENDER_ID).encode(),
+                               str(sender_id).encode() )
+        tx.sendto( msg, (ls.GROUP, ls.PORT) )
+
+    def receive():
+        return ls.receive(rx, last, 9980)[1]
+
+    yield send, receive
+
+    tx.close()
+    rx.close()
+
+
+def test_relative_deltas_in_order(link):
+
+    send, receive = link
+
+    send(1, -20.0)
+    assert receive() == ['lu_offset 6', 'loudness True', 'level -20.0']
+
+    send(2, -21.0, delta=-1.0)
+    assert receive() == ['lu_offset 6', 'loudness True', 'level -1.0 add']
+
+    send(3, -19.0, delta=+2.0)
+    assert receive()[-1] == 'level 2.0 add'
+
+
+def test_dropped_sequence_falls_back_to_absolute(link):
+
+    send, receive = link
+
+    send(1, -20.0)
+    receive()
+
+    # seq 2 lost
+    send(3, -23.0, delta=-1.0)
+    assert receive()[-1] == 'level -23.0'
+
+    send(4, -24.0, delta=-1.0)
+    assert receive()[-1] == 'level -1.0 add'
+
+
+def test_repeated_and_stale_are_ignored(link):
+
+    send, receive = link
+
+    send(1, -20.0)
+    receive()
+    send(2, -21.0, delta=-1.0)
+    receive()
+
+    # the periodic repetition of the last one
+    send(2, -21.0, delta=-1.0)
+    assert receive() == []
+
+    # an older one arriving late
+    send(1, -20.0)
+    assert receive() == []
+
+    send(3, -22.0, delta=-1.0)
+    assert receive()[-1] == 'level -1.0 add'
+
+
+def test_master_restart(link):
+
+    send, receive = link
+
+    send(5, -20.0)
+    receive()
+
+    # a lower seq from a restarted master is not stale
+    send(1, -30.0, delta=-1.0, sender_id=ls.SENDER_ID + 1)
+    assert receive()[-1] == 'level -30.0'
+
+
+def test_not_listening_resets(link, monkeypatch):
+
+    send, receive = link
+
+    send(1, -20.0)
+    receive()
+
+    monkeypatch.setattr( ls, 'listening_to', lambda addr, port: False )
+    send(2, -21.0, delta=-1.0)
+    assert receive() == []
+
+    # listening again, the next one is applied by the absolute level
+    monkeypatch.setattr( ls, 'listening_to', lambda addr, port: True )
+    send(3, -22.0, delta=-1.0)
+    assert receive()[-1] == 'level -22.0'
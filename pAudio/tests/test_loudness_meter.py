@@ -0,0 +1,158 @@
+"""
+    LU_meter measurements versus direct computations:
+
+    - the block by block K-filter and energies (loudness_meter.k_block)
+      versus the cascade of its two biquads over the whole stream
+
+    - the momentary and short-term loudness from the blocks ring buffer
+      versus the mean square of the last 400 ms and 3 s of samples, also
+      while the windows are still filling
+
+    - the histogram gated integrated loudness and loudness range versus
+      the EBU R128 (BS.1770) and EBU Tech 3342 gating over all the values,
+      within half a histogram bin
+"""
+
+import  os
+import  sys
+import  numpy as np
+import  pytest
+from    scipy.signal import lfilter
+
+sys.path.append( os.path.join( os.path.dirname(__file__),
+                               '../code/share/audiotools' ) )
+
+import  loudness_meter as lm
+
+
+FS          = 48000
+BS          = 4800                              # 100 ms blocks
+
+# half a histogram bin
+TOLERANCE   = lm.LoudnessHistogram.STEP / 2
+
+
+def program(seed, seconds=60):
+    """ Stereo noise, its level going to a random one every second
+    """
+    rng    = np.random.default_rng(seed)
+    knots  = rng.uniform(-40, 0, seconds + 1)
+    dB     = np.interp( np.arange(FS * seconds) / FS, np.arange(seconds + 1),
+                        knots )
+    return rng.standard_normal( (FS * seconds, 2) ) * 10 ** (dB[:, None] / 20) * 0.3
+
+
+def k_filter_reference(x):
+    """ The two biquads of the K-filter in cascade, channel by channel
+    """
+    y = x.copy()
+    for b, a in ( lm.biquad(FS, 100,  .707, 'hpf'            ),
+                  lm.biquad(FS, 1000, .707, 'highshelf', 4.0 ) ):
+        y = np.stack( [ lfilter(b, a, y[:, ch]) for ch in (0, 1) ], axis=1 )
+    return y
+
+
+def loudness_series(k, nblocks):
+    """ Loudness of nblocks windows, sliding by 100 ms blocks
+    """
+    e = np.sum( k.reshape(-1, BS, 2) ** 2, axis=(1, 2) )
+    msq = np.convolve( e, np.ones(nblocks), 'valid' ) / (BS * nblocks)
+    return -0.691 + 10 * np.log10(msq)
+
+
+def power_mean(L):
+    return -0.691 + 10 * np.log10( np.mean( 10 ** ((L + 0.691) / 10) ) )
+
+
+def integrated_reference(M):
+    M = M[M > -70]
+    return power_mean( M[M > power_mean(M) - 10] )
+
+
+def lra_reference(S):
+    S = S[S > -70]
+    S = S[S > power_mean(S) - 20]
+    return np.percentile(S, 95) - np.percentile(S, 10)
+
+
+def test_k_filter_blockwise_matches_biquads_cascade():
+
+    x   = program(0, seconds=5)
+    sos = lm.k_weighting_sos(FS)
+
+    zi  = np.zeros( (sos.shape[0], 2, 2) )
+    y   = []
+    e   = []
+    for i in range(0, len(x), BS):
+        block, energy, zi = lm.k_block( sos, zi, x[i : i + BS] )
+        y.append(block)
+        e.append(energy)
+
+    ref = k_filter_reference(x)
+
+    assert np.max( np.abs( np.concatenate(y) - ref ) ) < 1e-12
+    assert np.allclose( e, np.sum( ref.reshape(-1, BS, 2) ** 2, axis=1 ),
+                        rtol=1e-10 )
+
+
+def test_blocks_ring_loudness():
+
+    x    = program(1, seconds=8)
+    sos  = lm.k_weighting_sos(FS)
+    zi   = np.zeros( (sos.shape[0], 2, 2) )
+    ring = lm.BlocksRing(BS, 30)
+    k    = k_filter_reference(x)
+
+    for n, i in enumerate( range(0, len(x), BS), start=1 ):
+
+        _, energy, zi = lm.k_block( sos, zi, x[i : i + BS] )
+        ring.add(energy)
+
+        for nblocks in 4, 30:
+            # the samples of the window, or so far
+            w   = k[ max(0, n - nblocks) * BS : n * BS ]
+            ref = -0.691 + 10 * np.log10( np.sum(w ** 2) / len(w) )
+            assert abs( ring.loudness(nblocks) - ref ) < 1e-9
+
+
+def test_blocks_ring_silent():
+
+    ring = lm.BlocksRing(BS, 30)
+    assert ring.loudness(30) == -100.0
+
+    ring.add( np.zeros(2) )
+    assert ring.loudness(30) == -100.0
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_integrated_loudness(seed):
+
+    M = loudness_series( k_filter_reference(program(seed)), 4 )
+
+    h = lm.LoudnessHistogram()
+    for L in M:
+        h.add(L)
+
+    assert abs( h.integrated() - integrated_reference(M) ) < TOLERANCE
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_loudness_range(seed):
+
+    S = loudness_series( k_filter_reference(program(seed)), 30 )
+
+    h = lm.LoudnessHistogram()
+    for L in S:
+        h.add(L)
+
+    assert abs( h.loudness_range() - lra_reference(S) ) < TOLERANCE
+
+
+def test_empty_and_silent():
+
+    h = lm.LoudnessHistogram()
+    assert h.integrated() == -100.0
+    assert h.loudness_range() == 0.0
+
+    h.add(-100.0)
+    assert h.integrated() == -100.0
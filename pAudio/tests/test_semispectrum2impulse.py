@@ -0,0 +1,60 @@
+"""
+    semispectrum2impulse() (real cepstrum by rfft) versus the former
+    Hilbert based semispectrum2impulse_hilbert()
+"""
+
+import  os
+import  sys
+import  numpy as np
+import  pytest
+
+sys.path.append( os.path.join( os.path.dirname(__file__),
+                               '../code/share/audiotools' ) )
+
+import  tools
+
+
+TOLERANCE = 1e-12
+
+
+@pytest.mark.parametrize('taps', [256, 4096, 16384])
+def test_single_curve(taps):
+
+    rng    = np.random.default_rng(taps)
+    semisp = rng.uniform(-12, 12, taps // 2 + 1)
+
+    imp = tools.semispectrum2impulse(semisp)
+    ref = tools.semispectrum2impulse_hilbert(semisp)
+
+    assert imp.shape == (taps,)
+    assert np.max(np.abs(imp - ref)) < TOLERANCE
+
+
+def test_batched_curves():
+
+    rng    = np.random.default_rng(0)
+    semisp = rng.uniform(-12, 12, (8, 2049))
+
+    imps = tools.semispectrum2impulse(semisp)
+
+    assert imps.shape == (8, 4096)
+    for curve, imp in zip(semisp, imps):
+        ref = tools.semispectrum2impulse_hilbert(curve)
+        assert np.max(np.abs(imp - ref)) < TOLERANCE
+
+
+def test_linear_magnitudes():
+
+    rng    = np.random.default_rng(1)
+    semisp = rng.uniform(0.25, 4, 1025)
+
+    imp = tools.semispectrum2impulse(semisp, dB=False)
+    ref = tools.semispectrum2impulse_hilbert(semisp, dB=False)
+
+    assert np.max(np.abs(imp - ref)) < TOLERANCE
+
+
+def test_even_length_is_rejected():
+
+    with pytest.raises(ValueError):
+        tools.semispectrum2impulse( np.zeros(1024) )
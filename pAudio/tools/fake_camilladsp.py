@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+
+"""
+    A CamillaDSP stand-in for benchmarking and testing pAudio without
+    any sound hardware. It does not process audio at all, it just answers
+    the websocket commands used by the `camilladsp` Python client.
+
+    It accepts the same command line as the real thing, so it can be
+    symlinked as `camilladsp` somewhere in the PATH (see paudio_bench.py)
+
+    usage:  fake_camilladsp.py  [-a 127.0.0.1] [-p 1234] [--logfile path]
+                                [-m] [--apply_ms 0]
+
+        -m          starts muted, as the real one (pAudio uses it)
+
+        --apply_ms  simulated time to apply a new config (default 0)
+
+        other camilladsp options (--wait, a config file, ...) are ignored
+
+    Supported websocket commands:
+
+        GetVersion, GetState, GetStopReason, GetConfigTitle,
+        GetConfigJson, SetConfigJson, PatchConfig,
+        GetVolume, SetVolume, GetMute, SetMute,
+        GetFaderVolume, SetFaderVolume, AdjustFaderVolume,
+        GetFaderMute, SetFaderMute, Stop, Exit
+
+    Conv filters files are checked when a config is uploaded, and the
+    expected bytes are read as the real DSP does.
+"""
+
+import  os
+import  sys
+import  json
+import  base64
+import  hashlib
+import  asyncio
+import  struct
+from    time import time, strftime
+
+
+VERSION     = '2.0.3'
+WS_GUID     = '258EAFA5-E914-47DA-95CA-C5AB0DC11B41'
+
+# The simulated DSP
+DSP = {
+        'state':        'Inactive',
+        'stop_reason':  'None',
+        'config':       None,
+        'pending':      None,       # (config, apply_time)
+        'volume':       [0.0] * 5,
+        'mute':         [False] * 5
+      }
+
+APPLY_MS    = 0.0
+LOGFILE     = None
+
+
+def log(msg):
+    line = f'{strftime("%Y-%m-%d %H:%M:%S")} INFO [fake_camilladsp] {msg}'
+    if LOGFILE:
+        with open(LOGFILE, 'a') as f:
+            f.write(f'{line}\n')
+    else:
+        print(line)
+
+
+def merge_patch(cfg, patch):
+    for k, v in patch.items():
+        if type(v) == dict and type(cfg.get(k)) == dict:
+            merge_patch(cfg[k], v)
+        else:
+            cfg[k] = v
+
+
+def check_conv_files(cfg):
+    """ Reads the Conv filters coefficients as the real DSP would do
+        (raises an error if missing)
+    """
+    for name, f in (cfg.get('filters') or {}).items():
+
+        if f.get('type') != 'Conv':
+            continue
+
+        params = f.get('parameters') or {}
+        fname  = params.get('filename')
+
+        if not fname:
+            continue
+
+        if not os.path.isfile(fname):
+            raise ValueError(f'Could not open coefficient file `{fname}` '
+                             f'for filter `{name}`')
+
+        with open(fname, 'rb') as fh:
+            fh.seek( params.get('skip_bytes_lines') or 0 )
+            fh.read( params.get('read_bytes_lines') or -1 )
+
+
+def update_state():
+    """ A pending config becomes the active one after APPLY_MS
+    """
+    if DSP['pending'] and time() >= DSP['pending'][1]:
+        DSP['config']  = DSP['pending'][0]
+        DSP['pending'] = None
+        DSP['state']   = 'Running'
+
+
+def set_config(cfg):
+    check_conv_files(cfg)
+    if APPLY_MS:
+        DSP['pending'] = (cfg, time() + APPLY_MS / 1000)
+        DSP['state']   = 'Starting' if DSP['config'] is None else DSP['state']
+    else:
+        DSP['config']  = cfg
+        DSP['state']   = 'Running'
+
+
+def do(command, arg):
+    """ Returns the reply value, raises an error if any
+    """
+    update_state()
+
+    match command:
+
+        case 'GetVersion':
+            return VERSION
+
+        case 'GetState':
+            return DSP['state']
+
+        case 'GetStopReason':
+            return DSP['stop_reason']
+
+        case 'GetConfigTitle':
+            cfg = DSP['config'] or {}
+            return cfg.get('title') or ''
+
+        case 'GetConfigJson':
+            return json.dumps(DSP['config'])
+
+        case 'SetConfigJson':
+            set_config( json.loads(arg) )
+
+        case 'PatchConfig':
+            if DSP['config'] is None:
+                raise ValueError('No config loaded')
+            cfg = json.loads( json.dumps(DSP['config']) )
+            merge_patch(cfg, arg)
+            set_config(cfg)
+
+        case 'GetVolume':
+            return DSP['volume'][0]
+
+        case 'SetVolume':
+            DSP['volume'][0] = float(arg)
+
+        case 'GetMute':
+            return DSP['mute'][0]
+
+        case 'SetMute':
+            DSP['mute'][0] = bool(arg)
+
+        case 'GetFaderVolume':
+            return [int(arg), DSP['volume'][int(arg)]]
+
+        case 'SetFaderVolume':
+            DSP['volume'][int(arg[0])] = float(arg[1])
+
+        case 'AdjustFaderVolume':
+            DSP['volume'][int(arg[0])] += float(arg[1])
+            return [int(arg[0]), DSP['volume'][int(arg[0])]]
+
+        case 'GetFaderMute':
+            return [int(arg), DSP['mute'][int(arg)]]
+
+        case 'SetFaderMute':
+            DSP['mute'][int(arg[0])] = bool(arg[1])
+
+        case 'Stop':
+            DSP['state']       = 'Inactive'
+            DSP['stop_reason'] = 'None'
+
+        case 'Exit':
+            log('exit requested')
+            os._exit(0)
+
+        case _:
+            raise NotImplementedError(f'unsupported command `{command}`')
+
+
+def reply(raw):
+    """ The JSON reply for a JSON command as sent by the `camilladsp` client
+    """
+    try:
+        query = json.loads(raw)
+    except Exception as e:
+        return json.dumps( {'Invalid': {'result': 'Error', 'value': str(e)}} )
+
+    if type(query) == dict:
+        command, arg = list(query.items())[0]
+    else:
+        command, arg = query, None
+
+    try:
+        value = do(command, arg)
+        ans = {'result': 'Ok'}
+        if value is not None:
+            ans['value'] = value
+
+    except NotImplementedError as e:
+        return json.dumps( {'Invalid': {'result': 'Error', 'value': str(e)}} )
+
+    except Exception as e:
+        log(f'ERROR {command}: {str(e)}')
+        ans = {'result': 'Error', 'value': str(e)}
+
+    return json.dumps( {command: ans} )
+
+
+# A minimal websocket server (RFC 6455), text frames only
+
+async def ws_handshake(reader, writer):
+
+    request = await reader.readuntil(b'\r\n\r\n')
+
+    key = ''
+    for line in request.decode().split('\r\n'):
+        if line.lower().startswith('sec-websocket-key:'):
+            key = line.split(':', 1)[1].strip()
+
+    accept = base64.b64encode( hashlib.sha1((key + WS_GUID).encode()).digest() )
+
+    writer.write( b'HTTP/1.1 101 Switching Protocols\r\n'
+                  b'Upgrade: websocket\r\n'
+                  b'Connection: Upgrade\r\n'
+                  b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n' )
+    await writer.drain()
+
+
+async def ws_recv(reader):
+    """ (opcode, payload) of a client frame
+    """
+    b0, b1 = await reader.readexactly(2)
+
+    opcode = b0 & 0x0F
+    length = b1 & 0x7F
+
+    if length == 126:
+        length = struct.unpack('>H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', await reader.readexactly(8))[0]
+
+    mask    = await reader.readexactly(4) if b1 & 0x80 else b'\x00' * 4
+    payload = await reader.readexactly(length)
+
+    # unmasking the whole payload as a big integer is way faster
+    mask    = (mask * (length // 4 + 1))[:length]
+    payload = ( int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big') ) \
+              .to_bytes(length, 'big')
+
+    return opcode, payload
+
+
+def ws_frame(opcode, payload):
+
+    n = len(payload)
+
+    if n < 126:
+        header = struct.pack('>BB', 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, n)
+
+    return header + payload
+
+
+async def handle_client(reader, writer):
+
+    try:
+        await ws_handshake(reader, writer)
+
+        while True:
+
+            opcode, payload = await ws_recv(reader)
+
+            match opcode:
+
+                case 0x1:   # text
+                    ans = reply( payload.decode() )
+                    writer.write( ws_frame(0x1, ans.encode()) )
+
+                case 0x9:   # ping
+                    writer.write( ws_frame(0xA, payload) )
+
+                case 0x8:   # close
+                    writer.write( ws_frame(0x8, payload[:2]) )
+                    await writer.drain()
+                    break
+
+            await writer.drain()
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+    finally:
+        writer.close()
+
+
+async def main(addr, port):
+    srv = await asyncio.start_server(handle_client, addr, port)
+    log(f'listening on {addr}:{port}')
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == '__main__':
+
+    addr = '127.0.0.1'
+    port = 1234
+
+    args = sys.argv[1:]
+
+    while args:
+
+        opc = args.pop(0)
+
+        if opc in ('-a', '--address'):
+            addr = args.pop(0)
+
+        elif opc in ('-p', '--port'):
+            port = int( args.pop(0) )
+
+        elif opc in ('-o', '--logfile'):
+            LOGFILE = args.pop(0)
+
+        elif opc in ('-m', '--mute'):
+            DSP['mute'][0] = True
+
+        elif opc == '--apply_ms':
+            APPLY_MS = float( args.pop(0) )
+
+        elif opc in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+
+        # other camilladsp options (--wait, ...) are meaningless here
+
+    try:
+        asyncio.run( main(addr, port) )
+    except KeyboardInterrupt:
+        pass
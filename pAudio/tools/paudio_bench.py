@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Rafael Sánchez
+
+"""
+    Commands latency benchmark, no sound hardware needed.
+
+    CamillaDSP is replaced by tools/fake_camilladsp.py, then pAudio runs
+    representative command mixes and reports the p50/p95/p99 latencies
+    for each command.
+
+    usage:  paudio_bench.py  [-n=20] [-mix=knob,preset,poll] [-server]
+                             [-apply_ms=0]
+
+        -n          repetitions for each command of a mix
+        -mix        comma separated mixes:
+                        knob    level, bass, treble and balance sweeps
+                        preset  scene recalls, target, loudness and drc changes
+                        poll    what the web page asks for periodically
+        -server     drive a `server.py paudio` process through its socket,
+                    otherwise paudio.do() is run inside this process and the
+                    commands are broken down in stages:
+                        make_eq, FIR write, config upload, fader,
+                        state save, PNG render
+        -apply_ms   simulated CamillaDSP config apply time
+
+    (!) Stop pAudio before running this, because the preamp will start
+        the fake CamillaDSP instead. The preamp state file is restored
+        when finished, but the commands are logged as usual.
+
+    The `camilladsp` Python module is needed as well as for pAudio.
+"""
+
+import  os
+import  sys
+import  json
+import  shutil
+import  tempfile
+import  threading
+import  subprocess as sp
+from    time import time, sleep
+import  numpy as np
+
+UHOME       = os.path.expanduser('~')
+MAINFOLDER  = f'{UHOME}/pAudio'
+sys.path.append(f'{MAINFOLDER}/code/share')
+
+from    common import *
+import  paudio_client
+
+STATE_PATH  = f'{MAINFOLDER}/.preamp_state'
+FAKE_CDSP   = f'{os.path.dirname(os.path.realpath(__file__))}/fake_camilladsp.py'
+
+# Collected latencies {label: [ms, ...]}
+LATENCIES   = {}
+
+# Stages of the commands {label: {stage: [ms, ...]}}
+STAGES      = {}
+
+# Stages running in other threads, e.g. the state saver or the PNG renderer
+BACKGROUND  = {}
+
+# The command in progress (label, thread ident)
+CURRENT     = (None, None)
+
+
+def knob_mix(n, state):
+    cmds = []
+    for knob in 'level', 'bass', 'treble', 'balance':
+        for step in '-1', '+1':
+            cmds += [ (f'{knob} {step} add', f'{knob} {step} add') ] * n
+    return cmds
+
+
+def preset_mix(n, state):
+
+    level = state["level"]
+
+    scenes = [ {'level': level - 3, 'bass': 2, 'treble': -1},
+               {'level': level,     'bass': 0, 'treble':  0} ]
+
+    targets  = get_target_sets(fs=CONFIG["samplerate"])[:2] or ['none']
+    drc_sets = get_drc_sets_from_loudspeaker_folder()[:1] + ['none']
+
+    cmds = []
+    for i in range(n):
+        for j, scene in enumerate(scenes):
+            cmds.append( (f'scene #{j}', f'scene {json.dumps(scene)}') )
+        cmds.append( ('target', f'target {targets[i % len(targets)]}') )
+        cmds.append( ('loudness toggle', 'loudness toggle') )
+        if len(drc_sets) > 1:
+            cmds.append( ('drc', f'drc {drc_sets[i % len(drc_sets)]}') )
+    return cmds
+
+
+def poll_mix(n, state):
+    cmds = []
+    for i in range(n):
+        cmds.append( ('state',                  'state') )
+        cmds.append( ('aux info',               'aux info') )
+        cmds.append( ('get_eq_response 100',    'get_eq_response 100') )
+    return cmds
+
+
+MIXES = { 'knob': knob_mix, 'preset': preset_mix, 'poll': poll_mix }
+
+
+def prepare_fake_camilladsp(apply_ms):
+    """ A `camilladsp` launcher in a temporary folder, first in the PATH
+        (folder)
+    """
+    folder = tempfile.mkdtemp(prefix='paudio_bench_')
+
+    with open(f'{folder}/camilladsp', 'w') as f:
+        f.write( '#!/bin/sh\n'
+                 f'exec {sys.executable} "{FAKE_CDSP}" --apply_ms {apply_ms} "$@"\n' )
+    os.chmod(f'{folder}/camilladsp', 0o755)
+
+    os.environ["PATH"] = f'{folder}:{os.environ["PATH"]}'
+
+    return folder
+
+
+def probe(stage, func):
+    """ Wraps a function so that its wall time is collected as a stage
+    """
+    def wrapper(*args, **kwargs):
+
+        t0 = time()
+        try:
+            return func(*args, **kwargs)
+
+        finally:
+            ms = (time() - t0) * 1000
+            label, ident = CURRENT
+            if threading.get_ident() == ident:
+                STAGES.setdefault(label, {}).setdefault(stage, []).append(ms)
+            else:
+                BACKGROUND.setdefault(stage, []).append(ms)
+
+    return wrapper
+
+
+def install_probes():
+
+    from services import preamp
+    import eqfir2png
+
+    DSP  = preamp.DSP
+    mkeq = DSP.mkeq
+
+    for stage, module, fname in (
+            ('make_eq',         mkeq,       'make_eq'),
+            ('FIR write',       mkeq,       'save_eq_IR'),
+            ('config upload',   DSP,        'set_config_sync'),
+            ('fader',           DSP,        'set_volume'),
+            ('PNG render',      eqfir2png,  'fir2png') ):
+
+        setattr( module, fname, probe(stage, getattr(module, fname)) )
+
+    # the saver thread calls its own flush()
+    preamp.STATE_SAVER.flush = probe('state save', preamp.STATE_SAVER.flush)
+
+
+def run_inproc(cmds):
+
+    global CURRENT
+
+    import paudio
+
+    for label, phrase in cmds:
+
+        CURRENT = (label, threading.get_ident())
+
+        t0 = time()
+        paudio.do(phrase)
+        LATENCIES.setdefault(label, []).append( (time() - t0) * 1000 )
+
+    CURRENT = (None, None)
+
+
+def run_server(cmds, con):
+
+    for label, phrase in cmds:
+
+        t0 = time()
+        con.send(phrase, timeout=60)
+        LATENCIES.setdefault(label, []).append( (time() - t0) * 1000 )
+
+
+def print_report():
+
+    def pcts(values):
+        return [ np.percentile(values, p) for p in (50, 95, 99) ] + [max(values)]
+
+    print(f'\n{Fmt.BOLD}{"command":24} {"n":>5} {"p50":>8} {"p95":>8} '
+          f'{"p99":>8} {"max":>8}  (ms){Fmt.END}')
+
+    for label, values in LATENCIES.items():
+        p50, p95, p99, pmax = pcts(values)
+        print(f'{label:24} {len(values):5} {p50:8.1f} {p95:8.1f} {p99:8.1f} {pmax:8.1f}')
+
+        for stage, svalues in STAGES.get(label, {}).items():
+            p50, p95, p99, pmax = pcts(svalues)
+            print(f'{Fmt.BLUE}    {stage:20} {len(svalues):5} {p50:8.1f} '
+                  f'{p95:8.1f} {p99:8.1f} {pmax:8.1f}{Fmt.END}')
+
+    if BACKGROUND:
+        print(f'\n{Fmt.BOLD}background (not in the command path){Fmt.END}')
+        for stage, svalues in BACKGROUND.items():
+            p50, p95, p99, pmax = pcts(svalues)
+            print(f'    {stage:20} {len(svalues):5} {p50:8.1f} '
+                  f'{p95:8.1f} {p99:8.1f} {pmax:8.1f}')
+
+
+if __name__ == "__main__":
+
+    n           = 20
+    mixes       = list(MIXES)
+    use_server  = False
+    apply_ms    = 0
+
+    for opc in sys.argv[1:]:
+
+        if opc.startswith('-n='):
+            n = int( opc.split('=')[-1] )
+
+        elif opc.startswith('-mix='):
+            mixes = opc.split('=')[-1].split(',')
+
+        elif opc == '-server':
+            use_server = True
+
+        elif opc.startswith('-apply_ms='):
+            apply_ms = float( opc.split('=')[-1] )
+
+        else:
+            print(__doc__)
+            sys.exit()
+
+    for mix in mixes:
+        if not mix in MIXES:
+            print(f'{Fmt.RED}unknown mix `{mix}`{Fmt.END}')
+            sys.exit()
+
+    if process_is_running('server.py paudio '):
+        print(f'{Fmt.RED}pAudio is running, please stop it first.{Fmt.END}')
+        sys.exit()
+
+    # The preamp state will be restored when finished
+    saved_state = b''
+    if os.path.isfile(STATE_PATH):
+        with open(STATE_PATH, 'rb') as f:
+            saved_state = f.read()
+
+    bin_folder = prepare_fake_camilladsp(apply_ms)
+
+    srv = None
+
+    try:
+
+        if use_server:
+
+            port = CONFIG.get('paudio_port', 9980)
+
+            srv = sp.Popen( [sys.executable, f'{CODEFOLDER}/share/server.py',
+                             'paudio', 'localhost', str(port), '-a'] )
+
+            if not wait4server(timeout=60):
+                print(f'{Fmt.RED}No answer from `server.py paudio`{Fmt.END}')
+                sys.exit()
+
+            # a persistent connection
+            con   = paudio_client.Client('localhost', port)
+            state = json.loads( con.send('state') )
+
+            for mix in mixes:
+                print(f'{Fmt.BLUE}running mix `{mix}` ...{Fmt.END}')
+                run_server( MIXES[mix](n, state), con )
+
+            con.close()
+
+        else:
+
+            sys.path.append(CODEFOLDER)
+            import paudio
+            install_probes()
+
+            for mix in mixes:
+                print(f'{Fmt.BLUE}running mix `{mix}` ...{Fmt.END}')
+                run_inproc( MIXES[mix](n, paudio.preamp.state) )
+
+            # wait for the background stages
+            sleep(1)
+            paudio.preamp.STATE_SAVER.flush()
+
+        print_report()
+
+    finally:
+
+        if srv:
+            srv.terminate()
+            srv.wait()
+
+        sp.call( ['pkill', '-f', FAKE_CDSP] )
+        shutil.rmtree(bin_folder)
+
+        if saved_state:
+            with open(STATE_PATH, 'wb') as f:
+                f.write(saved_state)